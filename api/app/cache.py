@@ -0,0 +1,80 @@
+import threading
+from array import array
+from collections import OrderedDict
+
+# Накладные расходы на запись кэша сверх самого массива строк
+ENTRY_OVERHEAD_BYTES = 256
+
+
+class FilterResultCache:
+    """LRU-кэш отфильтрованных номеров строк с ограничением по памяти.
+
+    Ключ - (file_id, ...); все записи файла сбрасываются через invalidate(file_id).
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def entry_size(rows):
+        return rows.itemsize * len(rows) + ENTRY_OVERHEAD_BYTES
+
+    def __contains__(self, key):
+        """Есть ли результат в кэше - без учёта в hits и misses"""
+        with self.lock:
+            return key in self.entries
+
+    def get(self, key):
+        with self.lock:
+            rows = self.entries.get(key)
+            if rows is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return rows
+
+    def put(self, key, rows):
+        rows = rows if isinstance(rows, array) else array('I', rows)
+        size = self.entry_size(rows)
+        if size > self.max_bytes:
+            return rows
+
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= self.entry_size(previous)
+
+            self.entries[key] = rows
+            self.bytes += size
+
+            while self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= self.entry_size(evicted)
+
+        return rows
+
+    def invalidate(self, file_id):
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == file_id]:
+                self.bytes -= self.entry_size(self.entries.pop(key))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+            }
@@ -0,0 +1,211 @@
+"""Каталог сохранённых файлов в базе (модель LogFile).
+
+Поиск файла по file_id, список файлов сессии и отбор устаревших файлов -
+запросы по индексам таблицы, а не перебор LOG_STORAGE_DIR, и список
+файлов сессии переживает перезапуск процесса. Файл попадает в каталог,
+когда его разобранный лог записан на диск, и удаляется из каталога
+вместе с файлами. Файлы, сохранённые до появления каталога, заносятся в
+него index_storage_dir (команда migrate_parsed_logs).
+
+Загрузка, содержимое которой уже разобрано той же версией парсера (тот же
+content_hash), не разбирается заново: share_parsed заносит её как ещё одну
+запись с теми же файлами на диске. Файлы - общий результат разбора с
+подсчётом ссылок: release удаляет запись, а файлы остаются, пока на них
+ссылаются другие записи.
+"""
+import os
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import transaction
+
+from app.models import LogFile
+
+from . import codec
+from .logfile import FORMAT_VERSION, PARSED_SUFFIX, ParsedLogFile
+from .parser import PARSER_VERSION
+from .source import SOURCE_SUFFIX
+
+JSON_SUFFIX = '_parsed.json'
+# Версии форматов, у которых нет своей: разобранный лог в JSON и исходный файл без разбора
+JSON_FORMAT = 'parsed_json'
+RAW_FORMAT = 'raw'
+
+
+def to_datetime(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc)
+
+
+def file_size(path):
+    return os.path.getsize(path) if path and os.path.exists(path) else 0
+
+
+def format_of(file_path):
+    if file_path.endswith(PARSED_SUFFIX):
+        return FORMAT_VERSION
+    if file_path.endswith(JSON_SUFFIX):
+        return JSON_FORMAT
+    return RAW_FORMAT
+
+
+def record(file_id, file_data, line_count, statistics):
+    """Заносит файл в каталог или обновляет его запись; file_data - данные файла, как в DATA_STORAGE"""
+    file_path = file_data['file_path']
+    source_path = file_data.get('source_path')
+    LogFile.objects.update_or_create(file_id=file_id, defaults={
+        'session_id': file_data['session_id'],
+        'original_filename': file_data['filename'],
+        'file_name': os.path.basename(file_path),
+        'source_name': os.path.basename(source_path) if source_path else '',
+        'file_bytes': file_size(file_path),
+        'source_bytes': file_size(source_path),
+        'line_count': line_count,
+        'statistics': statistics or {},
+        'format_version': format_of(file_path),
+        'content_hash': file_data.get('content_hash') or '',
+        'parser_version': file_data.get('parser_version') or '',
+        'created_at': to_datetime(file_data['timestamp']),
+    })
+
+
+def lookup(file_id):
+    return LogFile.objects.filter(file_id=file_id).first()
+
+
+def session_files(session_id):
+    return list(LogFile.objects.filter(session_id=session_id).order_by('created_at'))
+
+
+def created_before(timestamp):
+    return list(LogFile.objects.filter(created_at__lt=to_datetime(timestamp)))
+
+
+def stored_names():
+    """Имена файлов LOG_STORAGE_DIR, на которые ссылается каталог"""
+    names = set()
+    for file_name, source_name in LogFile.objects.values_list('file_name', 'source_name'):
+        names.update((file_name, source_name))
+    names.discard('')
+    return names
+
+
+def references(entry):
+    """Сколько записей каталога ссылаются на файлы entry на диске"""
+    return LogFile.objects.filter(file_name=entry.file_name).count()
+
+
+def release(file_id):
+    """Удаляет файл из каталога; возвращает, сколько записей ещё ссылаются на его файлы на диске"""
+    with transaction.atomic():
+        entry = lookup(file_id)
+        if entry is None:
+            return 0
+        entry.delete()
+        return references(entry)
+
+
+def share_parsed(content_hash, file_id, session_id, filename, timestamp):
+    """Заносит file_id ссылкой на сохранённый разбор того же содержимого той же версией парсера.
+
+    Возвращает новую запись; None - такого разбора нет.
+    """
+    with transaction.atomic():
+        candidates = LogFile.objects.filter(
+            content_hash=content_hash, parser_version=PARSER_VERSION, format_version=FORMAT_VERSION,
+        )
+        for entry in candidates:
+            if not os.path.exists(entry.file_path) or (entry.source_path and not os.path.exists(entry.source_path)):
+                continue
+            return LogFile.objects.create(
+                file_id=file_id,
+                session_id=session_id,
+                original_filename=filename,
+                file_name=entry.file_name,
+                source_name=entry.source_name,
+                file_bytes=entry.file_bytes,
+                source_bytes=entry.source_bytes,
+                line_count=entry.line_count,
+                statistics=entry.statistics,
+                format_version=entry.format_version,
+                content_hash=entry.content_hash,
+                parser_version=entry.parser_version,
+                created_at=to_datetime(timestamp),
+            )
+    return None
+
+
+def describe(entry):
+    """Запись каталога для ответа API"""
+    return {
+        'file_id': entry.file_id,
+        'filename': entry.original_filename,
+        'status': 'done',
+        'line_count': entry.line_count,
+        'file_bytes': entry.file_bytes,
+        'source_bytes': entry.source_bytes,
+        'statistics': entry.statistics,
+        'format_version': entry.format_version,
+        'timestamp': entry.created_at.timestamp(),
+    }
+
+
+def index_file(filename):
+    """Заносит в каталог файл filename из LOG_STORAGE_DIR; False - это не файл лога"""
+    file_path = os.path.join(settings.LOG_STORAGE_DIR, filename)
+    source_path = None
+
+    content = {}
+    if filename.endswith(PARSED_SUFFIX):
+        with ParsedLogFile(file_path) as log_file:
+            metadata = log_file.metadata
+            # Копия общего разбора, отделённая перед дописыванием, названа не по file_id
+            file_id = metadata.get('file_id') or filename[:-len(PARSED_SUFFIX)]
+            line_count, statistics = len(log_file), log_file.statistics
+            if log_file.source is not None:
+                source_path = log_file.source.path
+                # Хеш содержимого записан при загрузке; после дописывания строк его в метаданных нет
+                content = {key: metadata.get(key) for key in ('content_hash', 'parser_version')}
+    elif filename.endswith(JSON_SUFFIX):
+        file_id = filename[:-len(JSON_SUFFIX)]
+        with open(file_path, 'rb') as f:
+            file_content = codec.load(f)
+        metadata = file_content.get('metadata', {})
+        result = file_content.get('parsed_data', {})
+        line_count, statistics = len(result.get('logs', [])), result.get('statistics', {})
+    elif filename.endswith((SOURCE_SUFFIX, '.tmp')) or '_' not in filename:
+        return False
+    else:
+        # Исходный файл старого формата {file_id}_{имя}: он разбирается при первом обращении
+        file_id, original_name = filename.split('_', 1)
+        metadata = {'original_filename': original_name}
+        line_count, statistics = 0, {}
+
+    record(file_id, {
+        'filename': metadata.get('original_filename', 'Unknown'),
+        'file_path': file_path,
+        'source_path': source_path,
+        'session_id': metadata.get('session_id', ''),
+        'timestamp': metadata.get('timestamp', os.path.getctime(file_path)),
+        **content,
+    }, line_count, statistics)
+    return True
+
+
+def index_storage_dir():
+    """Заносит в каталог файлы LOG_STORAGE_DIR, которых в нём ещё нет; возвращает их число"""
+    if not os.path.exists(settings.LOG_STORAGE_DIR):
+        return 0
+
+    known = set(LogFile.objects.values_list('file_name', flat=True))
+    indexed = 0
+    # По имени: {id}_parsed.tflog идёт после {id}_parsed.json и заменяет его запись
+    for filename in sorted(os.listdir(settings.LOG_STORAGE_DIR)):
+        if filename in known:
+            continue
+        try:
+            if index_file(filename):
+                indexed += 1
+                print(f"Indexed {filename}")
+        except Exception as e:
+            print(f"Error indexing {filename}: {e}")
+    return indexed
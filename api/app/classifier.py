@@ -0,0 +1,223 @@
+import re
+
+OPERATION_MARKERS = {
+    'plan': [
+        'plan',
+        'terraform plan',
+        'plan operation',
+        'planning',
+        'refresh plan',
+        'plan:',
+        '-plan-',
+        'execution plan',
+        'proposed changes',
+        'speculative plan',
+        'no actions need to be taken',
+        'planned change',
+        'refresh:'
+    ],
+    'apply': [
+        'apply',
+        'terraform apply',
+        'apply operation',
+        'applying',
+        'apply:',
+        '-apply-',
+        'provisioning',
+        'deploying',
+        'creating',
+        'modifying',
+        'destroying',
+        'executing actions',
+        'applying configuration'
+    ],
+    'validate': [
+        'validate',
+        'validation',
+        'validating',
+        'validate operation',
+        'syntax valid',
+        'configuration is valid',
+        'checking configuration'
+    ],
+    'init': [
+        'init',
+        'terraform init',
+        'initializing',
+        'initialization',
+        'init:',
+        '-init-',
+        'initializing backend',
+        'installing plugins',
+        'downloading modules',
+        'provider installation',
+        'module installation',
+        'terraform.lock.hcl',
+        'required_providers'
+    ],
+    'destroy': [
+        'destroy',
+        'terraform destroy',
+        'destroying',
+        'destroy:',
+        'deprovisioning',
+        'cleaning up',
+        'removing resources',
+        'destroy mode',
+        'plan to destroy',
+        'destroy plan',
+        'apply -destroy'
+    ],
+    'refresh': [
+        'refresh',
+        'refreshing',
+        'refresh:',
+        'refresh-only',
+        'updating state',
+        'synchronizing state',
+        'reconcile state'
+    ]
+}
+
+COMPONENT_INDICATORS = {
+    'core': [
+        'terraform', 'cli', 'command', 'args', 'version',
+        'root', 'working directory', 'config'
+    ],
+    'backend': [
+        'backend', 'statemgr', 'state', 'local:', 'remote:',
+        'loading state', 'saving state'
+    ],
+    'provider': [
+        'provider', 'registry', 'plugin', 'tf-provider',
+        'initializing provider'
+    ],
+    'provisioner': [
+        'provisioner', 'local-exec', 'remote-exec'
+    ],
+    'http': [
+        'http', 'https', 'request', 'response', 'get', 'post',
+        'status code', 'header'
+    ],
+    'grpc': [
+        'grpc', 'rpc', 'protocol', 'client', 'server'
+    ]
+}
+
+MESSAGE_TYPE_MARKERS = {
+    'error': ['error', 'failed'],
+    'warning': ['warning', 'warn'],
+    'debug': ['debug'],
+    'trace': ['trace']
+}
+
+LEVEL_PATTERNS = {
+    'error': ['error', 'failed', 'failure', 'exception', 'panic', 'fatal'],
+    'warn': ['warn', 'warning', 'deprecated', 'deprecation'],
+    'info': ['info', 'starting', 'completed', 'success', 'created', 'updated'],
+    'debug': ['debug', 'checking', 'scanning', 'reading', 'writing'],
+    'trace': ['trace', 'waiting', 'calling', 'entering', 'exiting']
+}
+
+RAW_OPERATION_MARKERS = {
+    'plan': ['plan', 'planning'],
+    'apply': ['apply', 'applying'],
+    'validate': ['validate', 'validation'],
+    'init': ['init', 'initializing'],
+    'destroy': ['destroy', 'destroying']
+}
+
+RAW_COMPONENT_INDICATORS = {
+    'core': ['terraform', 'cli', 'command'],
+    'backend': ['backend', 'state'],
+    'provider': ['provider', 'registry'],
+    'http': ['http', 'request'],
+    'grpc': ['grpc', 'rpc']
+}
+
+RAW_LEVEL_PATTERNS = {
+    'error': ['error', 'failed', 'failure', 'exception'],
+    'warn': ['warn', 'warning'],
+    'info': ['info', 'starting', 'completed'],
+    'debug': ['debug'],
+    'trace': ['trace']
+}
+
+
+def _trie_pattern(markers):
+    trie = {}
+    for marker in markers:
+        node = trie
+        for char in marker:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def emit(node):
+        branches = [re.escape(char) + emit(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        return '(?:' + body + ')?' if '' in node else body
+
+    return emit(trie)
+
+
+class MarkerClassifier:
+    """Классифицирует текст сразу по нескольким таблицам маркеров за один проход.
+
+    Каждая таблица - это упорядоченный словарь {категория: [маркеры]} и значение
+    по умолчанию; результат совпадает с последовательными проверками
+    ``any(marker in text for marker in markers)`` по категориям в порядке таблицы.
+    """
+
+    def __init__(self, tables):
+        self.defaults = tuple(default for _, default in tables)
+        markers = {marker for table, _ in tables for group in table.values() for marker in group}
+
+        # Регулярка-бор в lookahead находит в каждой позиции самый длинный маркер,
+        # поэтому маркеры-префиксы найденного считаются совпавшими вместе с ним.
+        self.pattern = re.compile('(?=(%s))' % _trie_pattern(markers))
+
+        hits_by_marker = {marker: set() for marker in markers}
+        for table_index, (table, _) in enumerate(tables):
+            for rank, group in enumerate(table.values()):
+                for marker in group:
+                    hits_by_marker[marker].add((table_index, rank))
+
+        self.implied = {
+            marker: frozenset().union(*(
+                hits for prefix, hits in hits_by_marker.items() if marker.startswith(prefix)
+            ))
+            for marker in markers
+        }
+        self.categories = tuple(tuple(table) for table, _ in tables)
+        self._cache = {}
+
+    def classify(self, text_lower):
+        found = frozenset(self.pattern.findall(text_lower))
+        result = self._cache.get(found)
+        if result is None:
+            hits = set()
+            for marker in found:
+                hits |= self.implied[marker]
+            result = tuple(
+                next((category for rank, category in enumerate(categories) if (table_index, rank) in hits), default)
+                for table_index, (categories, default) in enumerate(zip(self.categories, self.defaults))
+            )
+            if len(self._cache) < 65536:
+                self._cache[found] = result
+        return result
+
+
+ENTRY_CLASSIFIER = MarkerClassifier([
+    (OPERATION_MARKERS, None),
+    (COMPONENT_INDICATORS, 'unknown'),
+    (MESSAGE_TYPE_MARKERS, 'info'),
+    (LEVEL_PATTERNS, 'info'),
+])
+
+RAW_CLASSIFIER = MarkerClassifier([
+    (RAW_OPERATION_MARKERS, 'general'),
+    (RAW_COMPONENT_INDICATORS, 'unknown'),
+    (RAW_LEVEL_PATTERNS, 'info'),
+])
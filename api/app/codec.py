@@ -0,0 +1,81 @@
+"""JSON-кодек для разбора логов и хранения результатов.
+
+Использует orjson или msgspec, если они установлены, иначе стандартный json.
+Декодирование всегда совпадает со стандартным json.loads: всё, что быстрый
+бэкенд не принял или мог прочитать иначе (NaN, длинные целые, одиночные
+суррогаты), повторно разбирается стандартной библиотекой, и ошибки
+поднимаются как json.JSONDecodeError.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+JSONDecodeError = json.JSONDecodeError
+
+# Целые длиннее 64 бит быстрые бэкенды читают как float или отвергают.
+# Вместо регулярки (она медленнее самого разбора) все цифры сводятся к нулю
+# через bytes.translate и ищется подряд идущая двадцатка нулей.
+_DIGITS_TO_ZERO = bytes.maketrans(b'123456789', b'000000000')
+_LONG_INTEGER = b'0' * 20
+
+if orjson is not None:
+    BACKEND = 'orjson'
+    _fast_loads = orjson.loads
+    _fast_dumps = orjson.dumps
+    _fast_errors = (orjson.JSONDecodeError,)
+    _fast_encode_errors = (orjson.JSONEncodeError,)
+elif msgspec is not None:
+    BACKEND = 'msgspec'
+    _fast_loads = msgspec.json.decode
+    _fast_dumps = msgspec.json.encode
+    _fast_errors = (msgspec.DecodeError,)
+    _fast_encode_errors = (msgspec.EncodeError, TypeError, OverflowError)
+else:
+    BACKEND = 'json'
+    _fast_loads = None
+    _fast_dumps = None
+    _fast_errors = ()
+    _fast_encode_errors = ()
+
+
+def loads(data):
+    if _fast_loads is not None:
+        try:
+            encoded = data.encode('utf-8') if isinstance(data, str) else bytes(data)
+        except UnicodeEncodeError:
+            encoded = None
+
+        if encoded is not None and _LONG_INTEGER not in encoded.translate(_DIGITS_TO_ZERO):
+            try:
+                return _fast_loads(encoded)
+            except _fast_errors:
+                pass
+
+    return json.loads(data)
+
+
+def dumps(obj):
+    """Сериализует объект в компактный UTF-8 JSON (bytes)"""
+    if _fast_dumps is not None:
+        try:
+            return _fast_dumps(obj)
+        except _fast_encode_errors:
+            pass
+
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def load(fp):
+    return loads(fp.read())
+
+
+def dump(obj, fp):
+    fp.write(dumps(obj))
@@ -0,0 +1,191 @@
+"""Столбцы ColumnarLogStore в файле разобранного лога, отображаемые в память.
+
+Раздел столбцов (см. logfile) хранит массивы чисел хранилища как есть,
+сообщения (и raw_data, если исходного лога нет) - одним блоком UTF-8 со
+смещениями, а словари значений категорий - одним JSON. Хранилище,
+загруженное из раздела (mapped_store), не копирует столбцы в память
+процесса: они читаются прямо из mmap файла, и страницы файла в страничном
+кэше ОС общие для всех процессов-воркеров, открывших его. Каждый процесс
+разбирает только словари значений и строит свои индексы по запросам.
+
+Отображённые столбцы только для чтения; перед дописыванием строк
+хранилище переводит их в собственные массивы (ColumnarLogStore.thaw).
+"""
+import sys
+from array import array
+
+from . import codec
+from .store import CATEGORY_FIELDS, INTERNED_FIELDS, ColumnarLogStore, estimate_size
+
+# Отображать можно только файл с тем же порядком байт, что у процесса; иначе столбцы копируются
+CAN_MAP = sys.byteorder == 'little'
+ALIGNMENT = 8
+
+# Вид значения в MappedValues
+VALUE_TEXT = 0
+VALUE_NONE = 1
+VALUE_JSON = 2
+
+STORE_ARRAYS = ('line_numbers', 'id_kinds', 'timestamps', 'epoch_ns', 'body_flags')
+
+
+def padding(offset):
+    return -offset % ALIGNMENT
+
+
+def map_array(buffer, start, typecode, count):
+    """Массив из буфера: при CAN_MAP - memoryview без копирования, иначе копия"""
+    itemsize = array(typecode).itemsize
+    if CAN_MAP:
+        return memoryview(buffer)[start:start + itemsize * count].cast(typecode)
+    values = array(typecode)
+    values.frombytes(buffer[start:start + itemsize * count])
+    values.byteswap()
+    return values
+
+
+class MappedValues:
+    """Последовательность значений столбца (строки, None или JSON) в отображённом файле"""
+
+    def __init__(self, kinds, bounds, blob):
+        self.kinds = kinds
+        self.bounds = bounds
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, row):
+        kind = self.kinds[row]
+        if kind == VALUE_NONE:
+            return None
+        data = self.blob[self.bounds[row]:self.bounds[row + 1]]
+        if kind == VALUE_TEXT:
+            return str(data, 'utf-8', 'surrogatepass')
+        return codec.loads(bytes(data))
+
+    def __iter__(self):
+        for row in range(len(self.kinds)):
+            yield self[row]
+
+
+class MappedPostings:
+    """Хеш-индекс CodedColumn в отображённом файле: строки всех кодов подряд и границы кода"""
+
+    def __init__(self, rows, bounds):
+        self.rows = rows
+        self.bounds = bounds
+
+    def __len__(self):
+        return len(self.bounds) - 1
+
+    def __getitem__(self, code):
+        return self.rows[self.bounds[code]:self.bounds[code + 1]]
+
+
+class SectionWriter:
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+        self.arrays = {}
+
+    def add(self, name, typecode, data, count):
+        self.parts.append(b'\0' * padding(self.size))
+        self.size += padding(self.size)
+        self.arrays[name] = [self.size, typecode, count]
+        self.parts.append(data)
+        self.size += len(data)
+
+    def array(self, name, values):
+        if isinstance(values, memoryview):
+            typecode = values.format
+        else:
+            typecode = 'B' if isinstance(values, (bytes, bytearray)) else values.typecode
+        data = bytes(values) if typecode == 'B' else values
+        if typecode != 'B' and sys.byteorder != 'little':
+            data = array(typecode, data)
+            data.byteswap()
+        self.add(name, typecode, data if typecode == 'B' else data.tobytes(), len(values))
+
+    def values(self, name, values):
+        kinds = bytearray()
+        bounds = array('q', [0])
+        blob = bytearray()
+        for value in values:
+            if value is None:
+                kinds.append(VALUE_NONE)
+            elif value.__class__ is str:
+                kinds.append(VALUE_TEXT)
+                blob += value.encode('utf-8', 'surrogatepass')
+            else:
+                kinds.append(VALUE_JSON)
+                blob += codec.dumps(value)
+            bounds.append(len(blob))
+        self.array(f'{name}.kinds', kinds)
+        self.array(f'{name}.bounds', bounds)
+        self.add(f'{name}.blob', 'B', bytes(blob), len(blob))
+
+    def bytes(self):
+        return b''.join(self.parts)
+
+
+def encode_columns(store):
+    """Раздел столбцов хранилища: (описание для заголовка файла, байты раздела)"""
+    section = SectionWriter()
+    for name in STORE_ARRAYS:
+        section.array(name, getattr(store, name))
+
+    dictionaries = {'timestamp_labels': store.timestamp_labels.values, 'columns': {}}
+    for field, column in store.columns.items():
+        section.array(f'{field}.data', column.data)
+        dictionaries['columns'][field] = {'values': column.values, 'counts': list(column.counts)}
+        if column.postings is not None:
+            bounds = array('q', [0])
+            rows = array('I')
+            for posting in column.postings:
+                rows.extend(posting)
+                bounds.append(len(rows))
+            section.array(f'{field}.postings', rows)
+            section.array(f'{field}.bounds', bounds)
+
+    section.values('messages', store.messages)
+    if store.source is None:
+        section.values('raw_data', store.raw_data)
+
+    dictionaries['overrides'] = {str(row): entry for row, entry in store.overrides.items()}
+    dictionaries = codec.dumps(dictionaries)
+    section.add('dictionaries', 'B', dictionaries, len(dictionaries))
+    return {'arrays': section.arrays, 'is_sorted': store.is_sorted}, section.bytes()
+
+
+def mapped_store(buffer, start, descriptor, source=None):
+    """ColumnarLogStore, столбцы которого читаются из buffer (mmap файла) с позиции start"""
+    arrays = descriptor['arrays']
+
+    def get(name):
+        offset, typecode, count = arrays[name]
+        return map_array(buffer, start + offset, typecode, count)
+
+    def get_values(name):
+        return MappedValues(get(f'{name}.kinds'), get(f'{name}.bounds'), get(f'{name}.blob'))
+
+    store = ColumnarLogStore(source)
+    for name in STORE_ARRAYS:
+        setattr(store, name, get(name))
+    store.is_sorted = descriptor['is_sorted']
+
+    dictionaries = codec.loads(bytes(get('dictionaries')))
+    store.timestamp_labels.load(dictionaries['timestamp_labels'], [0] * len(dictionaries['timestamp_labels']))
+    for field in CATEGORY_FIELDS + INTERNED_FIELDS:
+        column = store.columns[field]
+        column.load(dictionaries['columns'][field]['values'], dictionaries['columns'][field]['counts'], get(f'{field}.data'))
+        if column.postings is not None:
+            column.postings = MappedPostings(get(f'{field}.postings'), get(f'{field}.bounds'))
+
+    store.messages = get_values('messages')
+    if source is None:
+        store.raw_data = get_values('raw_data')
+    store.overrides = {int(row): entry for row, entry in dictionaries['overrides'].items()}
+    store.payload_bytes = sum(estimate_size(entry) for entry in store.overrides.values())
+    store.mapped = True
+    return store
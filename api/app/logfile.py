@@ -0,0 +1,277 @@
+"""Файл разобранного лога с произвольным доступом к записям.
+
+Формат (числа little-endian):
+    MAGIC                     8 байт
+    длина заголовка           uint32
+    заголовок                 JSON: metadata, statistics, json_bodies, count,
+                              block_rows, blocks, is_sorted, source, columns
+    индекс блоков             blocks + 1 смещений uint64 от начала файла
+    строки source             только если source задан: count смещений int64,
+                              count длин uint32 и count байт флагов тел
+    столбцы                   только если columns задан: раздел столбцов
+                              хранилища (см. columns), выровненный на 8 байт
+    блоки                     сжатые zlib JSON-массивы по block_rows записей
+
+Файл открывается через mmap: страница записей читается распаковкой одного-двух
+блоков, остальной файл не трогается. Если рядом сохранён исходный лог (source -
+имя файла в том же каталоге), raw_data в блоках не пишется и читается из него.
+Файл со столбцами загружается в память без разбора блоков (mapped_store), и
+загрузившие его процессы делят его страницы.
+"""
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+
+from . import codec, metrics
+from .columns import encode_columns, map_array, mapped_store, padding
+from .source import SourceLog
+from .store import body_flags_of
+
+MAGIC = b'TFLOGB1\n'
+PARSED_SUFFIX = '_parsed.tflog'
+# Версия формата для каталога файлов
+FORMAT_VERSION = MAGIC.decode().strip()
+
+# Записей в блоке: страница в 100 строк затрагивает не больше двух блоков
+BLOCK_ROWS = 512
+# Быстрое сжатие: JSON логов и так сжимается в разы, а запись не должна тормозить загрузку
+COMPRESS_LEVEL = 1
+
+_HEADER_LENGTH = struct.Struct('<I')
+
+
+def _little_endian(values):
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+class ParsedLogWriter:
+    """Пишет файл разобранного лога по мере поступления записей.
+
+    В памяти держатся только уже сжатые блоки; сам файл собирается в close(),
+    когда известны статистика и метаданные. source (SourceLog) должен лежать
+    в том же каталоге и описывать добавленные записи по порядку.
+    """
+
+    def __init__(self, path, block_rows=BLOCK_ROWS, source=None):
+        self.path = path
+        self.block_rows = block_rows
+        self.source = source
+        self.blocks = []
+        self.pending = []
+        self.count = 0
+        self.body_flags = bytearray()
+        self.is_sorted = True
+        self.last_line_number = None
+
+    def add(self, entry, body_flags=None):
+        """body_flags - готовые флаги тел, если raw_data записи уже не хранится"""
+        line_number = entry.get('line_number')
+        if self.is_sorted and self.count:
+            previous = self.last_line_number
+            if not (isinstance(previous, int) and isinstance(line_number, int) and previous <= line_number):
+                self.is_sorted = False
+        self.last_line_number = line_number
+        self.count += 1
+
+        if self.source is not None:
+            self.body_flags.append(body_flags_of(entry.get('raw_data')) if body_flags is None else body_flags)
+            entry = dict(entry, raw_data=None)
+
+        self.pending.append(entry)
+        if len(self.pending) >= self.block_rows:
+            self.flush_block()
+
+    def extend(self, entries):
+        for entry in entries:
+            self.add(entry)
+
+    @metrics.timed('persist')
+    def flush_block(self):
+        if self.pending:
+            self.blocks.append(zlib.compress(codec.dumps(self.pending), COMPRESS_LEVEL))
+            self.pending = []
+
+    def close(self, metadata, statistics, json_bodies=None, columns=None):
+        """Записывает файл целиком; он появляется на месте через os.replace.
+
+        columns - ColumnarLogStore с теми же записями: его столбцы сохраняются
+        в файле, и при загрузке записи не разбираются заново.
+        """
+        self.flush_block()
+        self.write_file(metadata, statistics, json_bodies, columns)
+
+    @metrics.timed('write')
+    def write_file(self, metadata, statistics, json_bodies, columns=None):
+        source = self.source
+
+        spans = b''
+        if source is not None:
+            spans = _little_endian(source.offsets) + _little_endian(source.lengths) + bytes(self.body_flags)
+
+        columns_descriptor, columns_data = None, b''
+        if columns is not None:
+            with columns.lock:
+                columns_descriptor, columns_data = encode_columns(columns)
+
+        header = codec.dumps({
+            'metadata': metadata,
+            'statistics': statistics,
+            'json_bodies': json_bodies or {},
+            'count': self.count,
+            'block_rows': self.block_rows,
+            'blocks': len(self.blocks),
+            'is_sorted': self.is_sorted,
+            'source': os.path.basename(source.path) if source is not None else None,
+            'columns': columns_descriptor,
+        })
+
+        offsets = array('Q')
+        offset = len(MAGIC) + _HEADER_LENGTH.size + len(header) + 8 * (len(self.blocks) + 1) + len(spans)
+        if columns_data:
+            columns_data = b'\0' * padding(offset) + columns_data
+            offset += len(columns_data)
+        for block in self.blocks:
+            offsets.append(offset)
+            offset += len(block)
+        offsets.append(offset)
+
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(_HEADER_LENGTH.pack(len(header)))
+            f.write(header)
+            f.write(_little_endian(offsets))
+            f.write(spans)
+            f.write(columns_data)
+            for block in self.blocks:
+                f.write(block)
+        os.replace(tmp_path, self.path)
+        self.blocks = []
+
+
+def write_parsed_log(path, metadata, result, block_rows=BLOCK_ROWS, source=None, columns=None):
+    """Сохраняет результат разбора целиком (см. ParsedLogWriter)"""
+    writer = ParsedLogWriter(path, block_rows, source)
+    writer.extend(result.get('logs', []))
+    writer.close(metadata, result.get('statistics', {}), result.get('json_bodies'), columns)
+
+
+class ParsedLogFile:
+    """Чтение файла, записанного write_parsed_log.
+
+    Используется как контекстный менеджер. rows(start, stop) отдаёт записи
+    целиком; перебор файла отдаёт их как сохранены - при source с raw_data None
+    (для загрузки в ColumnarLogStore вместе с source и body_flags).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            if self.map[:len(MAGIC)] != MAGIC:
+                raise ValueError(f'Неизвестный формат файла: {path}')
+
+            start = len(MAGIC) + _HEADER_LENGTH.size
+            (header_length,) = _HEADER_LENGTH.unpack_from(self.map, len(MAGIC))
+            header = codec.loads(self.map[start:start + header_length])
+
+            position = start + header_length
+            self.offsets = self._read_array('Q', position, header['blocks'] + 1)
+            position += 8 * (header['blocks'] + 1)
+
+            self.source = None
+            self.body_flags = None
+            if header.get('source'):
+                count = header['count']
+                # Смещения строк не копируются: их страницы общие у всех процессов, открывших файл
+                line_offsets = map_array(self.map, position, 'q', count)
+                line_lengths = map_array(self.map, position + 8 * count, 'I', count)
+                flags_start = position + 12 * count
+                self.body_flags = self.map[flags_start:flags_start + count]
+                self.source = SourceLog(
+                    os.path.join(os.path.dirname(path), header['source']), line_offsets, line_lengths
+                )
+                position += 13 * count
+
+            self.columns = header.get('columns')
+            self.columns_start = position + padding(position)
+        except Exception:
+            self.close()
+            raise
+
+        self.metadata = header['metadata']
+        self.statistics = header['statistics']
+        self.json_bodies = header['json_bodies']
+        self.count = header['count']
+        self.block_rows = header['block_rows']
+        self.is_sorted = header['is_sorted']
+
+    def _read_array(self, typecode, start, count):
+        values = array(typecode)
+        values.frombytes(self.map[start:start + values.itemsize * count])
+        if sys.byteorder != 'little':
+            values.byteswap()
+        return values
+
+    def mapped_store(self):
+        """ColumnarLogStore файла со столбцами, отображёнными из него (None, если файл записан без столбцов)"""
+        if self.columns is None:
+            return None
+        store = mapped_store(self.map, self.columns_start, self.columns, self.source)
+        store.statistics = self.statistics
+        store.json_bodies = self.json_bodies
+        return store
+
+    def close(self):
+        try:
+            self.map.close()
+        except BufferError:
+            # Отображённые столбцы или смещения source ещё используются: mmap закроется вместе с ними
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def read_block(self, block):
+        start, end = self.offsets[block], self.offsets[block + 1]
+        return codec.loads(zlib.decompress(self.map[start:end]))
+
+    def rows(self, start, stop, raw_data=True):
+        """Записи с номерами [start, stop), распаковываются только нужные блоки.
+
+        raw_data=False не читает raw_data из source (там остаётся None).
+        """
+        start = max(start, 0)
+        stop = min(stop, self.count)
+        entries = []
+        if start >= stop:
+            return entries
+
+        block_rows = self.block_rows
+        for block in range(start // block_rows, (stop - 1) // block_rows + 1):
+            first = block * block_rows
+            entries.extend(self.read_block(block)[max(start - first, 0):stop - first])
+
+        if self.source is not None and raw_data:
+            for row, entry in enumerate(entries, start):
+                entry['raw_data'] = self.source.raw_data(row)
+        return entries
+
+    def __iter__(self):
+        for block in range(len(self.offsets) - 1):
+            yield from self.read_block(block)
+
@@ -0,0 +1,186 @@
+"""Синтетические логи Terraform (TF_LOG=json) для нагрузочных проверок.
+
+Записи повторяют формы из примеров в media/temp и api/uploaded_logs: строки
+ядра без модуля, цепочки RPC провайдера с общим tf_req_id, HTTP-запросы и
+ответы провайдера с телами в tf_http_req_body/tf_http_res_body и изредка
+строки не в JSON. Один и тот же seed даёт один и тот же файл.
+"""
+import json
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+
+DEFAULT_START = '2025-09-09T15:31:32.757289+03:00'
+
+PROVIDER_ADDR = 't1/t1-cloud/t1'
+
+RPCS = (
+    ('GetProviderSchema', 19), ('ValidateResourceConfig', 15), ('PlanResourceChange', 10),
+    ('ValidateDataResourceConfig', 9), ('ReadDataSource', 5), ('ApplyResourceChange', 3),
+    ('ValidateProviderConfig', 2), ('ConfigureProvider', 1), ('ReadResource', 4),
+)
+RESOURCE_TYPES = (
+    't1_vpc_network', 't1_vpc_subnet', 't1_vpc_vip', 't1_compute_instance',
+    't1_vpc_security_group', 't1_dns_record', 't1_s3_bucket',
+)
+DATA_SOURCE_TYPES = ('t1_vpc_network', 't1_vpc_subnet', 't1_compute_image', 't1_iam_project')
+CORE_MESSAGES = (
+    ('info', 'Terraform version: 1.13.1'),
+    ('debug', 'using github.com/hashicorp/go-tfe v1.74.1'),
+    ('trace', 'Stdout is a terminal of width 185'),
+    ('debug', 'Attempting to open CLI config file: /home/user/.terraformrc'),
+    ('trace', 'Meta.Backend: no config given or present on disk, so returning nil config'),
+    ('debug', 'checking for provisioner in "."'),
+    ('trace', 'terraform.contextPlugins: Initializing provider "registry.terraform.io/t1/t1-cloud"'),
+    ('info', 'backend/local: starting Plan operation'),
+    ('trace', 'vertex "t1_vpc_network.main": starting visit (*terraform.NodePlannableResourceInstance)'),
+    ('debug', 'ReferenceTransformer: "t1_vpc_subnet.main" references: []'),
+    ('warn', 'Provider "registry.terraform.io/t1/t1-cloud" produced an invalid plan, but we are tolerating it'),
+)
+FRAMEWORK_MESSAGES = (
+    'Checking ProviderSchema lock', 'Calling provider defined Resource Schema',
+    'Called provider defined Resource Schema', 'Calling provider defined DataSource Read',
+    'Value switched to prior value due to semantic equality logic', 'Marking Computed attributes with null configuration values as unknown',
+)
+RAW_LINES = (
+    '{ts} [DEBUG] provider.stdio: received EOF, stopping recv loop: err="rpc error: code = Unavailable"',
+    '{ts} [INFO]  provider: plugin process exited: path=.terraform/providers/t1 pid=4242',
+    '{ts} [WARN]  unexpected data: registry.terraform.io/t1/t1-cloud:stderr="panic recovered"',
+    'Error: Failed to query available provider packages',
+    '{ts} [TRACE] statemgr.Filesystem: reading latest snapshot from terraform.tfstate',
+)
+
+# Доли строк: HTTP-пары, строки ядра и строки не в JSON; остальное - цепочки RPC
+HTTP_SHARE = 0.04
+CORE_SHARE = 0.25
+RAW_SHARE = 0.02
+ERROR_SHARE = 0.01
+
+
+class TerraformLogGenerator:
+    """Генератор строк лога: iter_lines(count) отдаёт ровно count строк без перевода строки"""
+
+    def __init__(self, seed=0, start=DEFAULT_START):
+        self.random = random.Random(seed)
+        self.time = datetime.fromisoformat(start)
+        if self.time.tzinfo is None:
+            self.time = self.time.replace(tzinfo=timezone.utc)
+
+    def uuid(self):
+        return str(uuid.UUID(int=self.random.getrandbits(128)))
+
+    def tick(self, max_us=400):
+        self.time += timedelta(microseconds=self.random.randint(1, max_us))
+
+    def timestamps(self):
+        # Как в логах Terraform: @timestamp с микросекундами, timestamp провайдера - с миллисекундами
+        at = self.time.isoformat(timespec='microseconds')
+        short = self.time.strftime('%Y-%m-%dT%H:%M:%S.') + f'{self.time.microsecond // 1000:03d}' + self.time.strftime('%z')
+        return at, short
+
+    def entry(self, level, message, **fields):
+        self.tick()
+        at, short = self.timestamps()
+        entry = {'@level': level, '@message': message}
+        if fields:
+            entry['@caller'] = fields.pop('caller', '/go/pkg/mod/github.com/hashicorp/terraform-plugin-go@v0.26.0/tfprotov6/tf6server/server.go:522')
+            entry['@module'] = fields.pop('module', 'sdk.proto')
+        entry['@timestamp'] = at
+        entry.update(fields)
+        if 'tf_req_id' in fields:
+            entry['timestamp'] = short
+        # hclog пишет ключи по алфавиту
+        return json.dumps(entry, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+
+    def core_line(self):
+        level, message = self.random.choice(CORE_MESSAGES)
+        return self.entry(level, message)
+
+    def raw_line(self):
+        self.tick()
+        ts = self.time.strftime('%Y-%m-%dT%H:%M:%S.') + f'{self.time.microsecond // 1000:03d}' + self.time.strftime('%z')
+        return self.random.choice(RAW_LINES).format(ts=ts)
+
+    def request_lines(self):
+        """Цепочка строк одного RPC провайдера с общим tf_req_id"""
+        names, weights = zip(*RPCS)
+        rpc = self.random.choices(names, weights)[0]
+        fields = {'tf_provider_addr': PROVIDER_ADDR, 'tf_req_id': self.uuid(), 'tf_rpc': rpc}
+        if 'Data' in rpc:
+            fields['tf_data_source_type'] = self.random.choice(DATA_SOURCE_TYPES)
+        elif rpc != 'GetProviderSchema' and 'Provider' not in rpc:
+            fields['tf_resource_type'] = self.random.choice(RESOURCE_TYPES)
+
+        yield self.entry('trace', 'Received request', tf_proto_version='6.8', **fields)
+        yield self.entry('trace', 'Sending request downstream', tf_proto_version='6.8', **fields)
+        for _ in range(self.random.randint(1, 6)):
+            yield self.entry(
+                'trace', self.random.choice(FRAMEWORK_MESSAGES), module='sdk.framework',
+                caller='/go/pkg/mod/github.com/hashicorp/terraform-plugin-framework@v1.13.0/internal/fwserver/server.go:389',
+                **fields
+            )
+        if self.random.random() < ERROR_SHARE * 10:
+            yield self.entry(
+                'error', 'Response contains error diagnostic', tf_proto_version='6.8',
+                diagnostic_severity='ERROR', diagnostic_summary='Error reading resource', **fields
+            )
+        self.tick(5000)
+        yield self.entry(
+            'trace', 'Received downstream response', tf_proto_version='6.8',
+            diagnostic_error_count=0, diagnostic_warning_count=0,
+            tf_req_duration_ms=self.random.randint(0, 300), **fields
+        )
+        yield self.entry('trace', 'Served request', tf_proto_version='6.8', **fields)
+
+    def http_lines(self):
+        """Запрос провайдера к API и ответ с JSON-телом"""
+        trans_id = self.uuid()
+        uri = f'/vpc/api/v1/projects/proj-{self.random.getrandbits(40):x}/networks'
+        resource = self.random.choice(RESOURCE_TYPES)
+        common = {
+            'module': 't1', 'caller': '/go/pkg/mod/github.com/hashicorp/terraform-plugin-sdk/v2@v2.36.0/helper/logging/logging_http_transport.go:162',
+            'tf_http_trans_id': trans_id, 'tf_resource_type': resource,
+        }
+        request_body = json.dumps({'name': f'network{self.random.randint(1, 999)}', 'description': 'description for my network'})
+        yield self.entry(
+            'debug', 'Sending HTTP Request', tf_http_op_type='request', tf_http_req_method='POST',
+            tf_http_req_uri=uri, tf_http_req_version='HTTP/1.1', tf_http_req_body=request_body, **common
+        )
+        self.tick(80000)
+        response_body = json.dumps([
+            {'name': 'default', 'status': 'available', 'id': self.uuid(), 'description': 'Предварительно созданная сеть.', 'shared_from': None}
+            for _ in range(self.random.randint(1, 4))
+        ], ensure_ascii=False)
+        yield self.entry(
+            'debug', 'Received HTTP Response', tf_http_op_type='response', tf_http_res_status_code=200,
+            tf_http_res_status_reason='200 OK', tf_http_res_version='HTTP/2.0', tf_http_res_body=response_body,
+            **common
+        )
+
+    def iter_lines(self, count):
+        produced = 0
+        while produced < count:
+            roll = self.random.random()
+            if roll < RAW_SHARE:
+                lines = (self.raw_line(),)
+            elif roll < RAW_SHARE + HTTP_SHARE:
+                lines = self.http_lines()
+            elif roll < RAW_SHARE + HTTP_SHARE + CORE_SHARE:
+                lines = (self.core_line(),)
+            else:
+                lines = self.request_lines()
+
+            for line in lines:
+                if produced == count:
+                    return
+                produced += 1
+                yield line
+
+
+def write_log(path, lines, seed=0, start=DEFAULT_START):
+    """Пишет в path лог из lines строк; возвращает размер файла в байтах"""
+    size = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for line in TerraformLogGenerator(seed, start).iter_lines(lines):
+            size += f.write(line + '\n')
+    return size
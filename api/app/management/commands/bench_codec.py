@@ -0,0 +1,60 @@
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app import codec
+
+
+def best_of(repeat, func):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает стандартный json и app.codec на файлах из LOG_STORAGE_DIR'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', help='Файлы *_parsed.json (по умолчанию все из LOG_STORAGE_DIR)')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or sorted(
+            os.path.join(settings.LOG_STORAGE_DIR, name)
+            for name in os.listdir(settings.LOG_STORAGE_DIR)
+            if name.endswith('_parsed.json')
+        )
+        repeat = options['repeat']
+
+        self.stdout.write(f'codec backend: {codec.BACKEND}')
+        self.stdout.write(f'{"file":<44} {"stage":<12} {"json, s":>10} {"codec, s":>10} {"speedup":>8}')
+
+        for path in paths:
+            with open(path, 'rb') as f:
+                content = f.read()
+            document = json.loads(content)
+            lines = [
+                json.dumps(log['raw_data'], ensure_ascii=False)
+                for log in document.get('parsed_data', {}).get('logs', [])
+            ]
+
+            stages = [
+                ('load', lambda: json.loads(content), lambda: codec.loads(content)),
+                ('dump', lambda: json.dumps(document, ensure_ascii=False, indent=2).encode('utf-8'),
+                 lambda: codec.dumps(document)),
+                ('lines', lambda: [json.loads(line) for line in lines], lambda: [codec.loads(line) for line in lines]),
+            ]
+            for stage, baseline, candidate in stages:
+                baseline_time = best_of(repeat, baseline)
+                codec_time = best_of(repeat, candidate)
+                self.stdout.write(
+                    f'{os.path.basename(path)[:44]:<44} {stage:<12} '
+                    f'{baseline_time:>10.4f} {codec_time:>10.4f} {baseline_time / codec_time:>7.1f}x'
+                )
@@ -0,0 +1,188 @@
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app import codec
+from app.loggen import write_log
+
+# Запросы, задержка которых измеряется; параметры - как у get_logs
+BENCH_FILTERS = {
+    'level': {'level': 'error'},
+    'level_component': {'level': 'trace', 'component': 'provider'},
+    'rpc': {'rpc': 'PlanResourceChange'},
+    'req_id': {'req_id': 'a3'},
+    'search_text': {'search_text': 'downstream'},
+    'raw_data_search': {'rawDataSearch': 't1_vpc_subnet'},
+    'body_filter': {'body_filter': 'has_res_body'},
+    'time_range': {'time_from': '15:31:40', 'time_to': '15:32:10'},
+    'combined': {'level': 'trace', 'rpc': 'ReadDataSource', 'search_text': 'request'},
+}
+
+# Метрики, по которым сравнивается с базовой линией, и в какую сторону лучше
+HIGHER_IS_BETTER = ('lines_per_sec',)
+# Разница во времени запроса меньше этой считается шумом, а не регрессией
+MIN_DELTA_MS = 0.5
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss в Linux - в килобайтах, в macOS - в байтах
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def best_of(repeat, func):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_file(path, repeat):
+    """Замеры одного файла; выполняется в отдельном процессе, чтобы пик памяти был только его"""
+    import django
+    django.setup()
+
+    from app.parser import TerraformLogParser
+    from app.store import ColumnarLogStore
+    from app.views import apply_filters
+
+    rss_before = peak_rss_mb()
+
+    start = time.perf_counter()
+    parser = TerraformLogParser()
+    with open(path, 'rb') as f:
+        logs = list(parser.iter_entries(f))
+    parse_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    store = ColumnarLogStore.from_result({'logs': logs})
+    store_seconds = time.perf_counter() - start
+    del logs
+
+    queries = {}
+    for name, params in BENCH_FILTERS.items():
+        start = time.perf_counter()
+        rows = apply_filters(store, params)
+        cold = time.perf_counter() - start
+        warm = best_of(repeat, lambda: apply_filters(store, params))
+        queries[name] = {'rows': len(rows), 'cold_ms': cold * 1000, 'warm_ms': warm * 1000}
+
+    return {
+        'lines': len(store),
+        'bytes': os.path.getsize(path),
+        'parse_seconds': parse_seconds,
+        'lines_per_sec': len(store) / parse_seconds,
+        'store_seconds': store_seconds,
+        'store_mb': store.nbytes() / 1024 / 1024,
+        'peak_rss_mb': peak_rss_mb(),
+        'peak_rss_delta_mb': peak_rss_mb() - rss_before,
+        'queries': queries,
+    }
+
+
+def compare_metrics(result, baseline):
+    """Пары (метрика, было, стало) для сравнения с базовой линией"""
+    pairs = [(name, baseline.get(name), result[name]) for name in ('lines_per_sec', 'peak_rss_mb')]
+    for name, query in result['queries'].items():
+        base_query = baseline.get('queries', {}).get(name)
+        if base_query:
+            pairs.append((f'{name}.warm_ms', base_query['warm_ms'], query['warm_ms']))
+    return [(name, before, after) for name, before, after in pairs if before]
+
+
+class Command(BaseCommand):
+    help = 'Замеряет разбор и фильтры на синтетических логах; результаты сохраняются и сравниваются как JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, nargs='+', default=[10_000, 100_000],
+                            help='Размеры синтетических логов в строках')
+        parser.add_argument('--paths', nargs='*', default=[], help='Готовые логи вместо синтетических')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--save', help='Сохранить результаты в JSON (базовая линия)')
+        parser.add_argument('--baseline', help='Сравнить с ранее сохранёнными результатами')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Допустимое ухудшение относительно базовой линии (0.2 = 20%%)')
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        results = {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'codec': codec.BACKEND,
+            'seed': options['seed'],
+            'runs': {},
+        }
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            inputs = [(os.path.basename(path), path) for path in options['paths']]
+            for lines in ([] if inputs else options['lines']):
+                path = os.path.join(tmp_dir, f'synthetic_{lines}.log')
+                write_log(path, lines, options['seed'])
+                inputs.append((str(lines), path))
+
+            for name, path in inputs:
+                # Новый процесс на каждый файл: пик RSS не копится от предыдущих замеров
+                context = multiprocessing.get_context('spawn')
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    result = executor.submit(bench_file, path, repeat).result()
+                results['runs'][name] = result
+                self.report(name, result)
+
+        if options['save']:
+            with open(options['save'], 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Saved: {options['save']}")
+
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as f:
+                baseline = json.load(f)
+            regressions = self.compare(results, baseline, options['tolerance'])
+            if regressions and options['fail_on_regression']:
+                raise CommandError(f'Regressions: {", ".join(regressions)}')
+
+    def report(self, name, result):
+        self.stdout.write(
+            f"{name}: {result['lines']} lines, {result['bytes'] / 1024 / 1024:.1f} MB, "
+            f"parse {result['parse_seconds']:.2f} s ({result['lines_per_sec']:,.0f} lines/s), "
+            f"store {result['store_seconds']:.2f} s / {result['store_mb']:.1f} MB, "
+            f"peak RSS {result['peak_rss_mb']:.0f} MB (+{result['peak_rss_delta_mb']:.0f} MB)"
+        )
+        self.stdout.write(f'  {"query":<18} {"rows":>9} {"cold, ms":>10} {"warm, ms":>10}')
+        for query, timing in result['queries'].items():
+            self.stdout.write(
+                f"  {query:<18} {timing['rows']:>9} {timing['cold_ms']:>10.2f} {timing['warm_ms']:>10.2f}"
+            )
+
+    def compare(self, results, baseline, tolerance):
+        regressions = []
+        for name, result in results['runs'].items():
+            base = baseline.get('runs', {}).get(name)
+            if base is None:
+                self.stdout.write(f'{name}: no baseline')
+                continue
+
+            self.stdout.write(f'{name} vs baseline {baseline.get("created", "")}:')
+            for metric, before, after in compare_metrics(result, base):
+                change = (after - before) / before
+                worse = -change if metric in HIGHER_IS_BETTER else change
+                mark = ''
+                if metric.endswith('_ms') and abs(after - before) < MIN_DELTA_MS:
+                    worse = 0
+                if worse > tolerance:
+                    mark = '  REGRESSION'
+                    regressions.append(f'{name}/{metric}')
+                self.stdout.write(f'  {metric:<26} {before:>12.2f} {after:>12.2f} {change:>+8.1%}{mark}')
+        return regressions
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from app.loggen import DEFAULT_START, write_log
+
+
+class Command(BaseCommand):
+    help = 'Пишет синтетический лог Terraform (TF_LOG=json) заданного размера'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Куда записать лог')
+        parser.add_argument('--lines', type=int, default=10_000, help='Число строк (10 тыс. - 10 млн)')
+        parser.add_argument('--seed', type=int, default=0, help='Один seed - один и тот же файл')
+        parser.add_argument('--start', default=DEFAULT_START, help='Время первой записи, ISO 8601')
+
+    def handle(self, *args, **options):
+        size = write_log(options['path'], options['lines'], options['seed'], options['start'])
+        self.stdout.write(f"Written {options['lines']} lines, {size / 1024 / 1024:.1f} MB: {options['path']}")
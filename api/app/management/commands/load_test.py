@@ -0,0 +1,138 @@
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+
+from app.loggen import write_log
+
+SESSION_ID = 'load-test'
+UPLOAD_URL = '/api/upload/'
+# Строк в логе, страницы которого запрашивают зрители
+VIEWER_LOG_LINES = 5000
+PERCENTILES = (0.5, 0.95, 0.99)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочная проверка ASGI-пути в одном процессе: задержка небольших запросов get_logs '
+        'от многих зрителей без фоновой нагрузки и во время загрузки и разбора большого лога'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=100_000, help='Строк в большом загружаемом логе')
+        parser.add_argument('--viewers', type=int, default=50, help='Одновременных зрителей')
+        parser.add_argument('--duration', type=float, default=5.0, help='Длительность замера без нагрузки, секунды')
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--max-p99-ratio', type=float,
+                            help='Ошибка, если p99 во время загрузки больше p99 без неё во столько раз')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            storage_dir = os.path.join(tmp_dir, 'storage')
+            os.makedirs(storage_dir)
+            with override_settings(LOG_STORAGE_DIR=storage_dir):
+                results = asyncio.run(self.run(tmp_dir, options))
+
+        baseline, loaded = results['baseline'], results['upload']
+        self.stdout.write(f'Big upload: {options["lines"]} lines, parsed in {results["upload_seconds"]:.2f} s')
+        self.stdout.write(f'  {"phase":<10} {"requests":>9} {"req/s":>8} {"p50, ms":>9} {"p95, ms":>9} {"p99, ms":>9} {"max, ms":>9}')
+        for name, latencies, seconds in (('idle', *baseline), ('upload', *loaded)):
+            values = [percentile(latencies, fraction) * 1000 for fraction in PERCENTILES]
+            self.stdout.write(
+                f'  {name:<10} {len(latencies):>9} {len(latencies) / seconds:>8.0f} '
+                + ' '.join(f'{value:>9.2f}' for value in values)
+                + f' {max(latencies) * 1000:>9.2f}'
+            )
+
+        ratio = percentile(loaded[0], 0.99) / percentile(baseline[0], 0.99)
+        self.stdout.write(f'p99 during upload / idle p99: {ratio:.2f}')
+        if options['max_p99_ratio'] is not None and ratio > options['max_p99_ratio']:
+            raise CommandError(f'p99 grew {ratio:.2f}x during the upload (limit {options["max_p99_ratio"]})')
+
+    async def run(self, tmp_dir, options):
+        client = AsyncClient()
+        viewer_log = os.path.join(tmp_dir, 'viewer.log')
+        big_log = os.path.join(tmp_dir, 'big.log')
+        await asyncio.to_thread(write_log, viewer_log, VIEWER_LOG_LINES, options['seed'])
+        await asyncio.to_thread(write_log, big_log, options['lines'], options['seed'] + 1)
+
+        file_id = await self.upload(client, viewer_log)
+        await self.wait_for_job(client, file_id)
+        pages = max(1, VIEWER_LOG_LINES // options['page_size'])
+
+        baseline = await self.viewers(client, file_id, pages, options, until=time.monotonic() + options['duration'])
+
+        upload_started = time.monotonic()
+        done = asyncio.Event()
+        upload_seconds = None
+
+        async def big_upload():
+            nonlocal upload_seconds
+            try:
+                big_file_id = await self.upload(client, big_log)
+                await self.wait_for_job(client, big_file_id)
+                upload_seconds = time.monotonic() - upload_started
+            finally:
+                done.set()
+
+        viewers = asyncio.ensure_future(self.viewers(client, file_id, pages, options, done=done))
+        await big_upload()
+        loaded = await viewers
+        return {'baseline': baseline, 'upload': loaded, 'upload_seconds': upload_seconds}
+
+    async def upload(self, client, path):
+        # Тело запроса собирается вне цикла событий: иначе замер задержек зрителей учёл бы и его
+        def encode():
+            with open(path, 'rb') as f:
+                return encode_multipart(BOUNDARY, {'log_file': f, 'session_id': SESSION_ID})
+
+        body = await asyncio.to_thread(encode)
+        response = await client.generic('POST', UPLOAD_URL, body, content_type=MULTIPART_CONTENT)
+        if response.status_code != 200:
+            raise CommandError(f'Upload failed: {response.content[:200]!r}')
+        return response.json()['file_id']
+
+    async def wait_for_job(self, client, job_id):
+        while True:
+            response = await client.post(UPLOAD_URL, {'action': 'get_job_status', 'job_id': job_id, 'session_id': SESSION_ID})
+            status = response.json()['status']
+            if status == 'done':
+                return
+            if status == 'error':
+                raise CommandError(f'Parse failed: {response.json()["message"]}')
+            await asyncio.sleep(0.05)
+
+    async def viewers(self, client, file_id, pages, options, until=None, done=None):
+        """Задержки запросов страниц от options['viewers'] зрителей до момента until или события done"""
+        latencies = []
+        rng = random.Random(options['seed'])
+
+        def running():
+            return not done.is_set() if done is not None else time.monotonic() < until
+
+        async def viewer():
+            while running():
+                params = {
+                    'action': 'get_logs', 'file_id': file_id, 'session_id': SESSION_ID,
+                    'page': rng.randint(1, pages), 'page_size': options['page_size'],
+                }
+                start = time.perf_counter()
+                response = await client.post(UPLOAD_URL, params)
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    raise CommandError(f'get_logs failed: {response.status_code}')
+
+        started = time.monotonic()
+        await asyncio.gather(*(viewer() for _ in range(options['viewers'])))
+        return latencies, time.monotonic() - started
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from app.catalog import index_storage_dir
+from app.views import convert_parsed_json_files
+
+
+class Command(BaseCommand):
+    help = (
+        'Переводит *_parsed.json из LOG_STORAGE_DIR в формат с произвольным доступом '
+        'и заносит в каталог файлы, сохранённые до его появления'
+    )
+
+    def handle(self, *args, **options):
+        converted = convert_parsed_json_files()
+        self.stdout.write(f'Converted files: {converted}')
+        indexed = index_storage_dir()
+        self.stdout.write(f'Indexed files: {indexed}')
@@ -0,0 +1,192 @@
+"""Замеры времени по стадиям разбора и обработки запросов.
+
+Каждая стадия копится в гистограмме процесса (выдаётся в формате Prometheus
+по /api/metrics/) и во время текущего запроса - для заголовка Server-Timing.
+При METRICS_ENABLED = False замеры не делаются вовсе: stage() возвращает
+пустой контекстный менеджер, timed() - сразу вызывает функцию, а парсер
+вместо часов вызывает заглушку.
+"""
+import functools
+import threading
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+# Границы корзин гистограмм, секунды
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+PREFIX = 'tflog'
+
+# Время стадий текущего запроса; None вне запроса (фоновые задачи, команды)
+_request_timings = ContextVar('request_timings', default=None)
+
+
+def enabled():
+    return settings.configured and settings.METRICS_ENABLED
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = 0
+        while index < len(BUCKETS) and value > BUCKETS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Гистограммы длительности стадий и счётчики процесса"""
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def observe(self, stage_name, seconds):
+        with self.lock:
+            histogram = self.stages.get(stage_name)
+            if histogram is None:
+                histogram = self.stages[stage_name] = Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def clear(self):
+        with self.lock:
+            self.stages.clear()
+            self.counters.clear()
+
+    def render(self):
+        """Текстовый формат Prometheus (version 0.0.4)"""
+        lines = []
+        with self.lock:
+            if self.stages:
+                lines.append(f'# HELP {PREFIX}_stage_seconds Time spent per processing stage')
+                lines.append(f'# TYPE {PREFIX}_stage_seconds histogram')
+            for stage_name, histogram in sorted(self.stages.items()):
+                cumulative = 0
+                for bound, count in zip((*BUCKETS, '+Inf'), histogram.counts):
+                    cumulative += count
+                    lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{stage_name}",le="{bound}"}} {cumulative}')
+                lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{stage_name}"}} {histogram.sum:.9f}')
+                lines.append(f'{PREFIX}_stage_seconds_count{{stage="{stage_name}"}} {histogram.count}')
+
+            for name, value in sorted(self.counters.items()):
+                lines.append(f'# TYPE {PREFIX}_{name} counter')
+                lines.append(f'{PREFIX}_{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def record(stage_name, seconds):
+    """Учитывает уже измеренное время стадии"""
+    REGISTRY.observe(stage_name, seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage_name] = timings.get(stage_name, 0.0) + seconds
+
+
+def count(name, value=1):
+    if enabled():
+        REGISTRY.inc(name, value)
+
+
+class _Stage:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.name, time.perf_counter() - self.start)
+
+
+def stage(name):
+    """Контекстный менеджер, замеряющий стадию name"""
+    if not enabled():
+        return nullcontext()
+    return _Stage(name)
+
+
+def timed(name):
+    """Декоратор: каждый вызов функции замеряется как стадия name"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return func(*args, **kwargs)
+            with _Stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def server_timing(timings):
+    return ', '.join(f'{name};dur={seconds * 1000:.3f}' for name, seconds in timings.items())
+
+
+class ServerTimingMiddleware:
+    """Собирает время стадий запроса и отдаёт его в заголовке Server-Timing.
+
+    Работает и в синхронной, и в асинхронной цепочке: под ASGI Django не
+    переключается ради неё в поток.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not enabled():
+            return self.get_response(request)
+
+        timings = {}
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_timings.reset(token)
+        return self.finish(response, timings, start)
+
+    async def __acall__(self, request):
+        if not enabled():
+            return await self.get_response(request)
+
+        timings = {}
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_timings.reset(token)
+        return self.finish(response, timings, start)
+
+    def finish(self, response, timings, start):
+        timings['total'] = time.perf_counter() - start
+        REGISTRY.observe('request', timings['total'])
+        response['Server-Timing'] = server_timing(timings)
+        return response
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LogFile',
+            fields=[
+                ('file_id', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('session_id', models.CharField(max_length=128)),
+                ('original_filename', models.CharField(max_length=255)),
+                ('file_name', models.CharField(max_length=255)),
+                ('source_name', models.CharField(blank=True, default='', max_length=255)),
+                ('file_bytes', models.BigIntegerField(default=0)),
+                ('source_bytes', models.BigIntegerField(default=0)),
+                ('line_count', models.PositiveIntegerField(default=0)),
+                ('statistics', models.JSONField(default=dict)),
+                ('format_version', models.CharField(max_length=32)),
+                ('created_at', models.DateTimeField(db_index=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['session_id', 'created_at'], name='logfile_session_created')],
+            },
+        ),
+    ]
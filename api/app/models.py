@@ -0,0 +1,47 @@
+import os
+
+from django.conf import settings
+from django.db import models
+
+
+class LogFile(models.Model):
+    """Сохранённый разобранный файл из LOG_STORAGE_DIR (каталог файлов, см. catalog.py).
+
+    Имена файлов хранятся относительно LOG_STORAGE_DIR: каталог можно
+    перенести вместе с базой.
+
+    Одинаковые загрузки - разные записи (у каждой своя сессия и имя), которые
+    ссылаются на одни файлы на диске; файлы удаляются вместе с последней из них.
+    """
+
+    file_id = models.CharField(primary_key=True, max_length=64)
+    session_id = models.CharField(max_length=128)
+    original_filename = models.CharField(max_length=255)
+    # Файл разобранного лога (или исходный файл старого формата) и исходный лог рядом с ним
+    file_name = models.CharField(max_length=255)
+    source_name = models.CharField(max_length=255, blank=True, default='')
+    file_bytes = models.BigIntegerField(default=0)
+    source_bytes = models.BigIntegerField(default=0)
+    line_count = models.PositiveIntegerField(default=0)
+    statistics = models.JSONField(default=dict)
+    format_version = models.CharField(max_length=32)
+    # SHA-256 исходного лога и версия парсера, которой он разобран: по ним находится готовый
+    # результат разбора для одинаковой загрузки. Пусто - содержимое не известно или уже дописано
+    content_hash = models.CharField(max_length=64, blank=True, default='', db_index=True)
+    parser_version = models.CharField(max_length=32, blank=True, default='')
+    created_at = models.DateTimeField(db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['session_id', 'created_at'], name='logfile_session_created')]
+
+    def __str__(self):
+        return f'{self.file_id} ({self.original_filename})'
+
+    @property
+    def file_path(self):
+        return os.path.join(settings.LOG_STORAGE_DIR, self.file_name)
+
+    @property
+    def source_path(self):
+        return os.path.join(settings.LOG_STORAGE_DIR, self.source_name) if self.source_name else None
@@ -1,85 +1,324 @@
+import io
 import json
+import os
 import re
-from datetime import datetime
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from time import perf_counter
+from . import codec, metrics
+from .classifier import (
+    ENTRY_CLASSIFIER, RAW_CLASSIFIER,
+    OPERATION_MARKERS, COMPONENT_INDICATORS, LEVEL_PATTERNS,
+    RAW_OPERATION_MARKERS, RAW_COMPONENT_INDICATORS, RAW_LEVEL_PATTERNS,
+)
+
+PARALLEL_MIN_CHUNK_BYTES = 8 * 1024 * 1024
+# Версия разбора: повышается, когда те же строки начинают разбираться иначе.
+# Сохранённый результат разбора переиспользуется для одинаковых загрузок только той же версии
+PARSER_VERSION = '1'
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_FRACTION = re.compile(r'[.,]([0-9]+)')
+# Дата и время с явным часовым поясом в строке лога без JSON
+_RAW_ZONED_TIMESTAMP = re.compile(r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})')
+
+
+def _no_clock():
+    return 0.0
+
+
+def split_byte_ranges(file_path, parts, min_chunk_bytes=PARALLEL_MIN_CHUNK_BYTES):
+    """Делит файл на диапазоны байт, каждый из которых заканчивается переводом строки"""
+    size = os.path.getsize(file_path)
+    chunk_size = max(min_chunk_bytes, -(-size // max(parts, 1)))
+
+    ranges = []
+    start = 0
+    with open(file_path, 'rb') as f:
+        while start < size:
+            f.seek(min(start + chunk_size, size))
+            f.readline()
+            end = min(f.tell(), size)
+            ranges.append((start, end))
+            start = end
+
+    return ranges
+
+
+def _read_byte_range(file_path, start, end):
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        return f.read(end - start)
+
+
+def epoch_ns(dt, timestamp_str=''):
+    """Наносекунды от эпохи для datetime; дробная часть берётся из строки целиком, а не до микросекунд"""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    delta = dt.replace(microsecond=0) - _EPOCH
+    seconds = delta.days * 86400 + delta.seconds
+
+    match = _FRACTION.search(timestamp_str)
+    if match:
+        return seconds * 1_000_000_000 + int(match.group(1)[:9].ljust(9, '0'))
+    return seconds * 1_000_000_000 + dt.microsecond * 1000
+
+
+def count_lines(data):
+    # Те же границы строк, что у текстового режима open(): \n, \r и \r\n
+    count = data.count(b'\n') + data.count(b'\r') - data.count(b'\r\n')
+    if data and not data.endswith((b'\n', b'\r')):
+        count += 1
+    return count
+
+
+def _count_lines_in_range(task):
+    file_path, start, end = task
+    return count_lines(_read_byte_range(file_path, start, end))
+
+
+def _parse_byte_range(task):
+    file_path, start, end, first_line = task
+    data = _read_byte_range(file_path, start, end)
+
+    parser = TerraformLogParser()
+    logs = list(parser.iter_entries(io.BytesIO(data), first_line, start))
+    return logs, parser.statistics, parser.line_offsets, parser.line_lengths
+
 
 class TerraformLogParser:
     def __init__(self):
         self.parsed_logs = []
+        self.statistics = self.empty_statistics()
+        # Смещение и длина в байтах исходной строки каждой отданной записи (если разбирался файл или бинарный поток)
+        self.line_offsets = array('q')
+        self.line_lengths = array('I')
+        # Состояние потокового разбора (feed/finish): хвост без перевода строки и позиция в потоке
+        self.pending = []
+        self.next_line = 1
+        self.next_offset = 0
+
+    def parse_file(self, file_path, workers=1):
+        if workers and workers > 1:
+            self.parse_ranges_in_parallel(file_path, workers)
+        else:
+            self.parsed_logs.extend(self.iter_entries(file_path))
+
+        return {
+            'count': len(self.parsed_logs),
+            'logs': self.parsed_logs,
+            'statistics': self.generate_statistics()
+        }
 
-    def parse_file(self, file_path):
-        with open(file_path, 'r', encoding='utf-8') as f:
-            for line_num, line in enumerate(f, 1):
+    def parse_ranges_in_parallel(self, file_path, workers):
+        """Разбирает файл по диапазонам байт в пуле процессов.
+
+        Сначала считаются строки в каждом диапазоне, чтобы воркеры сразу
+        проставляли глобальные line_number и id; затем результаты и
+        статистика склеиваются по порядку, как при последовательном разборе.
+        """
+        ranges = split_byte_ranges(file_path, workers * 4, PARALLEL_MIN_CHUNK_BYTES)
+        if len(ranges) < 2:
+            self.parsed_logs.extend(self.iter_entries(file_path))
+            return
+
+        with ProcessPoolExecutor(max_workers=min(workers, len(ranges))) as pool:
+            line_counts = list(pool.map(_count_lines_in_range, [(file_path, start, end) for start, end in ranges]))
+
+            tasks = []
+            first_line = 1
+            for (start, end), line_count in zip(ranges, line_counts):
+                tasks.append((file_path, start, end, first_line))
+                first_line += line_count
+
+            for logs, statistics, line_offsets, line_lengths in pool.map(_parse_byte_range, tasks):
+                self.parsed_logs.extend(logs)
+                self.merge_statistics(statistics)
+                self.line_offsets.extend(line_offsets)
+                self.line_lengths.extend(line_lengths)
+
+    def iter_entries(self, file_or_stream, first_line=1, first_offset=0):
+        """Построчно разбирает лог и отдаёт записи по одной, не накапливая их.
+
+        Принимает путь к файлу или поток строк (текстовый или бинарный);
+        статистика по отданным записям копится в ``self.statistics``, а для
+        файла и бинарного потока - ещё и положение строк в ``line_offsets``
+        и ``line_lengths`` (first_offset - смещение начала потока в файле).
+        """
+        # Без метрик часы - заглушка: проход тот же, а суммы стадий не записываются
+        timed = metrics.enabled()
+        clock = perf_counter if timed else _no_clock
+        decode = bodies = classify = statistics = 0.0
+        lines = raw_lines = 0
+        try:
+            for line_num, (offset, length, line) in enumerate(self.iter_lines(file_or_stream), first_line):
                 line = line.strip()
                 if not line:
                     continue
 
+                lines += 1
+                start = clock()
                 try:
-                    data = json.loads(line)
-                    self.process_log_entry(data, line_num)
+                    data = codec.loads(line)
                 except json.JSONDecodeError:
-                    self.process_raw_line(line, line_num)
-
-        return {
-            'count': len(self.parsed_logs),
-            'logs': self.parsed_logs,
-            'statistics': self.generate_statistics()
-        }
+                    decoded = clock()
+                    entry = self.build_raw_entry(line, line_num)
+                    raw_lines += 1
+                    parsed = decoded
+                else:
+                    decoded = clock()
+                    data = self.parse_json_bodies_in_data(data)
+                    parsed = clock()
+                    entry = self.build_parsed_log_entry(data, line_num)
+                classified = clock()
+                self.update_statistics(entry)
+
+                decode += decoded - start
+                bodies += parsed - decoded
+                classify += classified - parsed
+                statistics += clock() - classified
+
+                if offset is not None:
+                    self.line_offsets.append(first_offset + offset)
+                    self.line_lengths.append(length)
+                yield entry
+        finally:
+            if timed and lines:
+                metrics.record('decode', decode)
+                metrics.record('bodies', bodies)
+                metrics.record('classify', classify)
+                metrics.record('statistics', statistics)
+                metrics.count('parsed_lines_total', lines)
+                metrics.count('raw_lines_total', raw_lines)
+
+    def feed(self, chunk):
+        """Разбирает очередной кусок байт потока и возвращает записи его завершённых строк.
+
+        Строка, разорванная между кусками, склеивается и разбирается, когда
+        придёт её конец; последнюю строку без перевода строки отдаёт finish().
+        """
+        end = chunk.rfind(b'\n') + 1
+        if not end:
+            self.pending.append(chunk)
+            return []
+
+        # Всё после последнего \n ждёт следующего куска: там может оказаться \n от \r\n
+        self.pending.append(chunk[:end])
+        data = b''.join(self.pending)
+        self.pending = [chunk[end:]] if end < len(chunk) else []
+        return self.parse_block(data)
+
+    def finish(self):
+        data = b''.join(self.pending)
+        self.pending = []
+        return self.parse_block(data)
+
+    def parse_block(self, data):
+        entries = list(self.iter_entries(io.BytesIO(data), self.next_line, self.next_offset))
+        self.next_line += count_lines(data)
+        self.next_offset += len(data)
+        return entries
+
+    def iter_lines(self, file_or_stream):
+        """Строки как (смещение, длина в байтах, текст); у текстового потока смещение и длина - None"""
+        if isinstance(file_or_stream, (str, os.PathLike)):
+            with open(file_or_stream, 'rb') as f:
+                yield from self.iter_lines(f)
+            return
+
+        offset = 0
+        for line in file_or_stream:
+            if not isinstance(line, bytes):
+                yield None, None, line
+                continue
+
+            # Границы строк как у текстового режима open(): кроме \n ещё \r и \r\n
+            for part in line.splitlines(keepends=True) if b'\r' in line else (line,):
+                yield offset, len(part), part.decode('utf-8')
+                offset += len(part)
+
+    def parse_raw_data(self, line):
+        """raw_data записи для уже обрезанной строки - то же, что кладёт в запись разбор файла"""
+        try:
+            data = codec.loads(line)
+        except json.JSONDecodeError:
+            return {'raw_line': line}
+        return self.parse_json_bodies_in_data(data)
 
     def process_log_entry(self, data, line_num):
-        parsed_data = self.parse_json_bodies_in_data(data)
+        self.parsed_logs.append(self.build_log_entry(data, line_num))
 
-        operation = self.detect_operation(parsed_data)
-        level = self.extract_level(parsed_data)
-        component = self.detect_component(parsed_data)
-        message_type = self.detect_message_type(parsed_data)
+    def build_log_entry(self, data, line_num):
+        return self.build_parsed_log_entry(self.parse_json_bodies_in_data(data), line_num)
 
-        log_entry = {
+    def build_parsed_log_entry(self, parsed_data, line_num):
+        """Запись из строки JSON, в которой тела HTTP уже разобраны"""
+        message, operation, component, message_type, level = self.classify_entry(parsed_data)
+        timestamp, timestamp_ns = self.extract_timestamps(parsed_data)
+
+        return {
             'id': f"log_{line_num}",
-            'timestamp': self.extract_timestamp(parsed_data),
+            'timestamp': timestamp,
             'level': level,
             'operation': operation,
             'component': component,
             'message_type': message_type,
-            'message': self.extract_message(parsed_data),
+            'message': message,
             'raw_data': parsed_data,
             'line_number': line_num,
             'tf_req_id': parsed_data.get('@request_id') or parsed_data.get('tf_req_id') or parsed_data.get('req_id', ''),
             'tf_resource_type': parsed_data.get('@resource_type') or parsed_data.get('tf_resource_type') or parsed_data.get('resource_type', ''),
-            'tf_rpc': parsed_data.get('@rpc') or parsed_data.get('tf_rpc') or parsed_data.get('rpc', '')
+            'tf_rpc': parsed_data.get('@rpc') or parsed_data.get('tf_rpc') or parsed_data.get('rpc', ''),
+            'timestamp_ns': timestamp_ns
         }
 
-        self.parsed_logs.append(log_entry)
-
     def parse_json_bodies_in_data(self, data):
-        result = data.copy()
-
         json_fields = ['tf_http_req_body', 'tf_http_res_body']
 
+        # Копию делаем только для записей с телами - остальные отдаются как есть
+        if isinstance(data, dict) and not any(field in data for field in json_fields):
+            return data
+
+        result = data.copy()
+
         for field in json_fields:
             if field in result and result[field]:
                 field_value = result[field]
 
                 if isinstance(field_value, str) and field_value.strip():
                     try:
-                        parsed_json = json.loads(field_value)
+                        parsed_json = codec.loads(field_value)
                         result[field] = parsed_json
                     except json.JSONDecodeError:
                         try:
                             unescaped = field_value.encode().decode('unicode_escape')
-                            parsed_json = json.loads(unescaped)
+                            parsed_json = codec.loads(unescaped)
                             result[field] = parsed_json
                         except (json.JSONDecodeError, UnicodeDecodeError):
                             pass
 
         return result
 
+    def classify_entry(self, data):
+        message = self.extract_message(data)
+        operation, component, message_type, message_level = ENTRY_CLASSIFIER.classify(message.lower())
+
+        if operation is None:
+            operation = self.detect_operation_from_context(data)
+
+        level = self.extract_level_from_fields(data) or message_level
+
+        return message, operation, component, message_type, level
+
     def process_raw_line(self, line, line_num):
+        self.parsed_logs.append(self.build_raw_entry(line, line_num))
+
+    def build_raw_entry(self, line, line_num):
         timestamp = self.extract_timestamp_from_raw(line)
-        level = self.extract_level_from_raw(line)
-        operation = self.detect_operation_from_raw(line)
-        component = self.detect_component_from_raw(line)
+        operation, component, level = RAW_CLASSIFIER.classify(line.lower())
 
-        log_entry = {
+        return {
             'id': f"raw_{line_num}",
             'timestamp': timestamp,
             'level': level,
@@ -91,98 +330,21 @@ class TerraformLogParser:
             'line_number': line_num,
             'tf_req_id': self.extract_req_id_from_raw(line),
             'tf_resource_type': '',
-            'tf_rpc': ''
+            'tf_rpc': '',
+            'timestamp_ns': self.extract_timestamp_ns_from_raw(line)
         }
 
-        self.parsed_logs.append(log_entry)
-
     def detect_operation(self, data):
         message = self.extract_message(data)
         message_lower = message.lower()
 
-        operation_markers = {
-            'plan': [
-                'plan',
-                'terraform plan',
-                'plan operation',
-                'planning',
-                'refresh plan',
-                'plan:',
-                '-plan-',
-                'execution plan',
-                'proposed changes',
-                'speculative plan',
-                'no actions need to be taken',
-                'planned change',
-                'refresh:'
-            ],
-            'apply': [
-                'apply',
-                'terraform apply',
-                'apply operation',
-                'applying',
-                'apply:',
-                '-apply-',
-                'provisioning',
-                'deploying',
-                'creating',
-                'modifying',
-                'destroying',
-                'executing actions',
-                'applying configuration'
-            ],
-            'validate': [
-                'validate',
-                'validation',
-                'validating',
-                'validate operation',
-                'syntax valid',
-                'configuration is valid',
-                'checking configuration'
-            ],
-            'init': [
-                'init',
-                'terraform init',
-                'initializing',
-                'initialization',
-                'init:',
-                '-init-',
-                'initializing backend',
-                'installing plugins',
-                'downloading modules',
-                'provider installation',
-                'module installation',
-                'terraform.lock.hcl',
-                'required_providers'
-            ],
-            'destroy': [
-                'destroy',
-                'terraform destroy',
-                'destroying',
-                'destroy:',
-                'deprovisioning',
-                'cleaning up',
-                'removing resources',
-                'destroy mode',
-                'plan to destroy',
-                'destroy plan',
-                'apply -destroy'
-            ],
-            'refresh': [
-                'refresh',
-                'refreshing',
-                'refresh:',
-                'refresh-only',
-                'updating state',
-                'synchronizing state',
-                'reconcile state'
-            ]
-        }
-
-        for op, markers in operation_markers.items():
+        for op, markers in OPERATION_MARKERS.items():
             if any(marker in message_lower for marker in markers):
                 return op
 
+        return self.detect_operation_from_context(data)
+
+    def detect_operation_from_context(self, data):
         if 'plan' in str(data.get('@module', '')).lower():
             return 'plan'
         elif 'apply' in str(data.get('@module', '')).lower():
@@ -201,15 +363,7 @@ class TerraformLogParser:
     def detect_operation_from_raw(self, line):
         line_lower = line.lower()
 
-        operation_markers = {
-            'plan': ['plan', 'planning'],
-            'apply': ['apply', 'applying'],
-            'validate': ['validate', 'validation'],
-            'init': ['init', 'initializing'],
-            'destroy': ['destroy', 'destroying']
-        }
-
-        for op, markers in operation_markers.items():
+        for op, markers in RAW_OPERATION_MARKERS.items():
             if any(marker in line_lower for marker in markers):
                 return op
 
@@ -219,32 +373,7 @@ class TerraformLogParser:
         message = self.extract_message(data)
         message_lower = message.lower()
 
-        component_indicators = {
-            'core': [
-                'terraform', 'cli', 'command', 'args', 'version',
-                'root', 'working directory', 'config'
-            ],
-            'backend': [
-                'backend', 'statemgr', 'state', 'local:', 'remote:',
-                'loading state', 'saving state'
-            ],
-            'provider': [
-                'provider', 'registry', 'plugin', 'tf-provider',
-                'initializing provider'
-            ],
-            'provisioner': [
-                'provisioner', 'local-exec', 'remote-exec'
-            ],
-            'http': [
-                'http', 'https', 'request', 'response', 'get', 'post',
-                'status code', 'header'
-            ],
-            'grpc': [
-                'grpc', 'rpc', 'protocol', 'client', 'server'
-            ]
-        }
-
-        for component, indicators in component_indicators.items():
+        for component, indicators in COMPONENT_INDICATORS.items():
             if any(indicator in message_lower for indicator in indicators):
                 return component
 
@@ -253,15 +382,7 @@ class TerraformLogParser:
     def detect_component_from_raw(self, line):
         line_lower = line.lower()
 
-        component_indicators = {
-            'core': ['terraform', 'cli', 'command'],
-            'backend': ['backend', 'state'],
-            'provider': ['provider', 'registry'],
-            'http': ['http', 'request'],
-            'grpc': ['grpc', 'rpc']
-        }
-
-        for component, indicators in component_indicators.items():
+        for component, indicators in RAW_COMPONENT_INDICATORS.items():
             if any(indicator in line_lower for indicator in indicators):
                 return component
 
@@ -283,6 +404,19 @@ class TerraformLogParser:
         return 'info'
 
     def extract_level(self, data):
+        level = self.extract_level_from_fields(data)
+        if level:
+            return level
+
+        message = self.extract_message(data).lower()
+
+        for level_name, patterns in LEVEL_PATTERNS.items():
+            if any(pattern in message for pattern in patterns):
+                return level_name
+
+        return 'info'
+
+    def extract_level_from_fields(self, data):
         level_fields = ['@level', 'level', 'log_level', 'severity']
         for field in level_fields:
             level = data.get(field)
@@ -291,40 +425,22 @@ class TerraformLogParser:
                 if level_str in ['error', 'warn', 'warning', 'info', 'debug', 'trace']:
                     return 'warn' if level_str == 'warning' else level_str
 
-        message = self.extract_message(data).lower()
-
-        level_patterns = {
-            'error': ['error', 'failed', 'failure', 'exception', 'panic', 'fatal'],
-            'warn': ['warn', 'warning', 'deprecated', 'deprecation'],
-            'info': ['info', 'starting', 'completed', 'success', 'created', 'updated'],
-            'debug': ['debug', 'checking', 'scanning', 'reading', 'writing'],
-            'trace': ['trace', 'waiting', 'calling', 'entering', 'exiting']
-        }
-
-        for level_name, patterns in level_patterns.items():
-            if any(pattern in message for pattern in patterns):
-                return level_name
-
-        return 'info'
+        return None
 
     def extract_level_from_raw(self, line):
         line_lower = line.lower()
 
-        level_patterns = {
-            'error': ['error', 'failed', 'failure', 'exception'],
-            'warn': ['warn', 'warning'],
-            'info': ['info', 'starting', 'completed'],
-            'debug': ['debug'],
-            'trace': ['trace']
-        }
-
-        for level_name, patterns in level_patterns.items():
+        for level_name, patterns in RAW_LEVEL_PATTERNS.items():
             if any(pattern in line_lower for pattern in patterns):
                 return level_name
 
         return 'info'
 
     def extract_timestamp(self, data):
+        return self.extract_timestamps(data)[0]
+
+    def extract_timestamps(self, data):
+        """Время записи для показа ('%H:%M:%S.%f' до мс) и полное время в нс от эпохи (или None)"""
         timestamp_fields = ['@timestamp', 'timestamp', 'time', '@time']
 
         for field in timestamp_fields:
@@ -336,11 +452,11 @@ class TerraformLogParser:
                             timestamp_str = timestamp_str.replace('Z', '+00:00')
 
                         dt = datetime.fromisoformat(timestamp_str)
-                        return dt.strftime('%H:%M:%S.%f')[:-3]
+                        return dt.strftime('%H:%M:%S.%f')[:-3], epoch_ns(dt, timestamp_str)
                 except (ValueError, TypeError):
                     continue
 
-        return '--:--:--'
+        return '--:--:--', None
 
     def extract_timestamp_from_raw(self, line):
         patterns = [
@@ -359,6 +475,18 @@ class TerraformLogParser:
 
         return '--:--:--'
 
+    def extract_timestamp_ns_from_raw(self, line):
+        # Время без часового пояса нельзя сопоставить с остальным логом - для него только метка
+        match = _RAW_ZONED_TIMESTAMP.search(line)
+        if match:
+            timestamp_str = match.group()
+            try:
+                dt = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00').replace(',', '.'))
+                return epoch_ns(dt, timestamp_str)
+            except ValueError:
+                pass
+        return None
+
     def extract_req_id_from_raw(self, line):
         patterns = [
             r'req[_\-]id[=:]?\s*([\w\-]+)',
@@ -383,26 +511,46 @@ class TerraformLogParser:
 
         return json.dumps(data, ensure_ascii=False)
 
-    def generate_statistics(self):
-        stats = {
-            'total_entries': len(self.parsed_logs),
+    def empty_statistics(self):
+        return {
+            'total_entries': 0,
             'by_level': {},
             'by_operation': {},
             'by_component': {},
             'errors_count': 0
         }
 
-        for log in self.parsed_logs:
-            level = log['level']
-            stats['by_level'][level] = stats['by_level'].get(level, 0) + 1
+    def update_statistics(self, log):
+        stats = self.statistics
+        stats['total_entries'] += 1
+
+        level = log['level']
+        stats['by_level'][level] = stats['by_level'].get(level, 0) + 1
 
-            operation = log['operation']
-            stats['by_operation'][operation] = stats['by_operation'].get(operation, 0) + 1
+        operation = log['operation']
+        stats['by_operation'][operation] = stats['by_operation'].get(operation, 0) + 1
 
-            component = log['component']
-            stats['by_component'][component] = stats['by_component'].get(component, 0) + 1
+        component = log['component']
+        stats['by_component'][component] = stats['by_component'].get(component, 0) + 1
 
-            if log['level'] == 'error':
-                stats['errors_count'] += 1
+        if level == 'error':
+            stats['errors_count'] += 1
 
-        return stats
+    def merge_statistics(self, other):
+        stats = self.statistics
+        stats['total_entries'] += other['total_entries']
+        stats['errors_count'] += other['errors_count']
+
+        for key in ('by_level', 'by_operation', 'by_component'):
+            for name, count in other[key].items():
+                stats[key][name] = stats[key].get(name, 0) + count
+
+    def generate_statistics(self):
+        stats = self.statistics
+        return {
+            'total_entries': stats['total_entries'],
+            'by_level': dict(stats['by_level']),
+            'by_operation': dict(stats['by_operation']),
+            'by_component': dict(stats['by_component']),
+            'errors_count': stats['errors_count']
+        }
@@ -0,0 +1,72 @@
+from django.http import HttpResponse, StreamingHttpResponse
+
+from . import codec, metrics
+
+
+class JsonResponse(HttpResponse):
+    """JSON-ответ, сериализуемый через app.codec вместо стандартного json"""
+
+    def __init__(self, data, safe=True, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError(
+                'In order to allow non-dict objects to be serialized set the '
+                'safe parameter to False.'
+            )
+        kwargs.setdefault('content_type', 'application/json')
+        with metrics.stage('serialize'):
+            content = codec.dumps(data)
+        super().__init__(content=content, **kwargs)
+
+
+class NdjsonResponse(StreamingHttpResponse):
+    """Потоковый ответ: каждый объект из items - отдельная строка JSON (NDJSON).
+
+    С batched=True элементы items - списки объектов: строки списка уходят
+    клиенту одним куском, а не отдельной записью в сокет на каждую.
+    items может быть и асинхронным итератором (для ASGI).
+    """
+
+    def __init__(self, items, batched=False, **kwargs):
+        kwargs.setdefault('content_type', 'application/x-ndjson')
+        super().__init__(map_items(items, self.encode_batch if batched else self.encode), **kwargs)
+
+    @staticmethod
+    def encode(item):
+        return codec.dumps(item) + b'\n'
+
+    @staticmethod
+    def encode_batch(batch):
+        return b''.join(codec.dumps(item) + b'\n' for item in batch)
+
+
+class EventStreamResponse(StreamingHttpResponse):
+    """Server-sent events: events отдаёт пары (id события, данные) или None - комментарий для поддержания связи.
+
+    events может быть и асинхронным итератором (для ASGI).
+    """
+
+    def __init__(self, events, event='message', **kwargs):
+        kwargs.setdefault('content_type', 'text/event-stream')
+        super().__init__(map_items(events, lambda item: self.encode(item, event)), **kwargs)
+        self['Cache-Control'] = 'no-cache'
+        # Иначе nginx копит ответ в буфере и события приходят пачками
+        self['X-Accel-Buffering'] = 'no'
+
+    @staticmethod
+    def encode(item, event):
+        if item is None:
+            return b': keep-alive\n\n'
+        event_id, data = item
+        return f'id: {event_id}\nevent: {event}\n'.encode() + b'data: ' + codec.dumps(data) + b'\n\n'
+
+
+def map_items(items, encode):
+    """encode над элементами синхронного или асинхронного итератора, с сохранением его вида"""
+    if hasattr(items, '__aiter__'):
+        return _map_async(items, encode)
+    return map(encode, items)
+
+
+async def _map_async(items, encode):
+    async for item in items:
+        yield encode(item)
@@ -0,0 +1,74 @@
+import mmap
+import threading
+from array import array
+from collections import OrderedDict
+
+from .parser import TerraformLogParser
+
+SOURCE_SUFFIX = '_source.log'
+
+# Сколько разобранных raw_data держать в памяти: страница списка и открытые детали
+RAW_DATA_CACHE_SIZE = 512
+
+
+class SourceLog:
+    """Исходный файл лога, из которого raw_data читается по требованию.
+
+    Для каждой записи хранятся только смещение и длина её строки в байтах
+    (в порядке записей); raw_data разбирается из строки так же, как при
+    разборе всего файла, и последние RAW_DATA_CACHE_SIZE результатов кэшируются.
+    """
+
+    def __init__(self, path, offsets=None, lengths=None):
+        self.path = path
+        self.offsets = offsets if offsets is not None else array('q')
+        self.lengths = lengths if lengths is not None else array('I')
+        self.map = None
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.parser = TerraformLogParser()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def nbytes(self):
+        # Смещения, отображённые из файла разобранного лога, - в общем страничном кэше, а не в памяти процесса
+        if isinstance(self.offsets, memoryview):
+            return 0
+        return len(self.offsets) * self.offsets.itemsize + len(self.lengths) * self.lengths.itemsize
+
+    def thaw(self):
+        """Собственные массивы смещений вместо отображённых из файла - перед дописыванием строк"""
+        if isinstance(self.offsets, memoryview):
+            self.offsets = array('q', self.offsets.tobytes())
+            self.lengths = array('I', self.lengths.tobytes())
+
+    def line(self, index):
+        start = self.offsets[index]
+        end = start + self.lengths[index]
+
+        source_map = self.map
+        if source_map is None or len(source_map) < end:
+            # Файл ещё дописывается при загрузке - отображаем его заново
+            with self.lock:
+                if self.map is None or len(self.map) < end:
+                    with open(self.path, 'rb') as f:
+                        self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                source_map = self.map
+
+        return source_map[start:end].decode('utf-8').strip()
+
+    def raw_data(self, index, cache=True):
+        with self.lock:
+            raw_data = self.cache.get(index)
+            if raw_data is not None:
+                self.cache.move_to_end(index)
+                return raw_data
+
+        raw_data = self.parser.parse_raw_data(self.line(index))
+        if cache:
+            with self.lock:
+                self.cache[index] = raw_data
+                if len(self.cache) > RAW_DATA_CACHE_SIZE:
+                    self.cache.popitem(last=False)
+        return raw_data
@@ -0,0 +1,154 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class LogStorage:
+    """Хранилище разобранных файлов с ограничением по памяти.
+
+    Для каждого file_id хранится словарь с метаданными (filename, file_path,
+    session_id, timestamp) и, пока файл в памяти, ключ 'logs' с
+    ColumnarLogStore. При превышении max_bytes у давно не использованных
+    файлов выгружается только 'logs' - метаданные остаются, поэтому
+    очистка сессии видит и выгруженные файлы. Выгруженный файл заново
+    загружается через get(file_id, loader); одновременные запросы к нему
+    ждут одну общую загрузку. Закреплённые файлы (pin - например, ещё
+    разбираемые) не выгружаются. Файл, удалённый (pop) во время своей
+    загрузки, после неё в хранилище не возвращается.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.files = {}
+        self.resident = OrderedDict()
+        self.pinned = set()
+        self.bytes = 0
+        self.loading = {}
+        # Загружаемые file_id, удалённые во время загрузки
+        self.dropped = set()
+        self.evictions = 0
+        self.loads = 0
+        self.lock = threading.RLock()
+
+    def __contains__(self, file_id):
+        return file_id in self.files
+
+    def __len__(self):
+        return len(self.files)
+
+    def metadata(self, file_id):
+        """Данные файла без загрузки: у выгруженного файла в них нет 'logs'"""
+        with self.lock:
+            return self.files.get(file_id)
+
+    def items(self):
+        with self.lock:
+            return list(self.files.items())
+
+    def put(self, file_id, file_data):
+        with self.lock:
+            self.files[file_id] = file_data
+            self._account(file_id)
+            self._evict(keep=file_id)
+
+    def get(self, file_id, loader=None):
+        """Данные файла с загруженным 'logs' или None.
+
+        Если файл выгружен или ещё не открывался, вызывает loader() - ровно
+        один раз на все одновременные запросы этого file_id.
+        """
+        with self.lock:
+            file_data = self.files.get(file_id)
+            if file_data is not None and 'logs' in file_data:
+                self._account(file_id)
+                self._evict(keep=file_id)
+                return file_data
+
+            if loader is None:
+                return None
+
+            pending = self.loading.get(file_id)
+            owner = pending is None
+            if owner:
+                pending = self.loading[file_id] = Future()
+
+        if not owner:
+            return pending.result()
+
+        try:
+            file_data = loader()
+        except BaseException as e:
+            with self.lock:
+                del self.loading[file_id]
+                self.dropped.discard(file_id)
+            pending.set_exception(e)
+            raise
+
+        with self.lock:
+            del self.loading[file_id]
+            if file_id in self.dropped:
+                # Файл удалили, пока он загружался: данные отдаются ждавшим, но не кэшируются
+                self.dropped.discard(file_id)
+            elif file_data is not None:
+                self.loads += 1
+                self.put(file_id, file_data)
+        pending.set_result(file_data)
+        return file_data
+
+    def pin(self, file_id):
+        with self.lock:
+            self.pinned.add(file_id)
+
+    def unpin(self, file_id):
+        with self.lock:
+            self.pinned.discard(file_id)
+            if file_id in self.resident:
+                self._account(file_id)
+                self._evict(keep=file_id)
+
+    def pop(self, file_id):
+        with self.lock:
+            if file_id in self.loading:
+                self.dropped.add(file_id)
+            self.pinned.discard(file_id)
+            self.bytes -= self.resident.pop(file_id, 0)
+            return self.files.pop(file_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.dropped.update(self.loading)
+            self.files.clear()
+            self.resident.clear()
+            self.pinned.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'files': len(self.files),
+                'resident_files': len(self.resident),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'evictions': self.evictions,
+                'loads': self.loads,
+            }
+
+    def _account(self, file_id):
+        size = self.files[file_id]['logs'].nbytes()
+        self.bytes += size - self.resident.pop(file_id, 0)
+        self.resident[file_id] = size
+
+    def _evict(self, keep):
+        while self.bytes > self.max_bytes:
+            file_id = next((
+                candidate for candidate in self.resident
+                if candidate != keep and candidate not in self.pinned
+            ), None)
+            if file_id is None:
+                break
+
+            self.bytes -= self.resident.pop(file_id)
+            file_data = self.files[file_id]
+            # Словарь заменяется, а не меняется: запросы, уже получившие его, дочитают свои данные
+            self.files[file_id] = {key: value for key, value in file_data.items() if key != 'logs'}
+            self.evictions += 1
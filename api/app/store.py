@@ -0,0 +1,645 @@
+import json
+import re
+import sys
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from itertools import compress
+
+from .textindex import TrigramIndex
+from .traces import RequestIndex
+
+ENTRY_KEYS = (
+    'id', 'timestamp', 'level', 'operation', 'component', 'message_type',
+    'message', 'raw_data', 'line_number', 'tf_req_id', 'tf_resource_type', 'tf_rpc', 'timestamp_ns'
+)
+# Записи из файлов, разобранных до появления timestamp_ns
+LEGACY_ENTRY_KEYS = ENTRY_KEYS[:-1]
+CATEGORY_FIELDS = ('level', 'operation', 'component', 'message_type')
+INTERNED_FIELDS = ('tf_req_id', 'tf_resource_type', 'tf_rpc')
+# Разделы статистики get_statistics и поля, по которым они считаются
+FACET_FIELDS = {
+    'by_level': 'level',
+    'by_operation': 'operation',
+    'by_component': 'component',
+    'by_rpc': 'tf_rpc',
+    'by_resource_type': 'tf_resource_type',
+}
+ID_PREFIXES = ('log', 'raw')
+
+BODY_REQ = 1
+BODY_RES = 2
+
+# Отметка «полного времени нет» в столбце epoch_ns
+MISSING_TIME = -(1 << 63)
+MS_NS = 1_000_000
+DAY_NS = 86400 * 1000 * MS_NS
+
+_CANONICAL_TIMESTAMP = re.compile(r'([0-9]{2}):([0-9]{2}):([0-9]{2})\.([0-9]{3})')
+
+
+def format_timestamp_ms(ms):
+    seconds, millis = divmod(ms, 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours:02d}:{minutes:02d}:{seconds:02d}.{millis:03d}'
+
+
+def body_flags_of(raw_data):
+    """BODY_REQ | BODY_RES - какие HTTP-тела есть в raw_data записи"""
+    flags = 0
+    if raw_data:
+        if 'tf_http_req_body' in raw_data:
+            flags |= BODY_REQ
+        if 'tf_http_res_body' in raw_data:
+            flags |= BODY_RES
+    return flags
+
+
+def estimate_size(value):
+    """Приблизительный размер значения из JSON в памяти, с вложенными объектами"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += sys.getsizeof(key) + estimate_size(item)
+    elif isinstance(value, list):
+        for item in value:
+            size += estimate_size(item)
+    return size
+
+
+def mask_rows(mask):
+    """Номера строк, отмеченных единицей в байтовой маске"""
+    # Для редких совпадений быстрее искать единицы, чем перебирать все строки
+    if mask.count(1) * 20 < len(mask):
+        rows = []
+        find = mask.find
+        row = find(1)
+        while row != -1:
+            rows.append(row)
+            row = find(1, row + 1)
+        return rows
+    return list(compress(range(len(mask)), mask))
+
+
+class CodedColumn:
+    """Столбец, хранящий номера значений из словаря вместо самих значений.
+
+    Строки интернируются, поэтому одинаковые значения в памяти одни на файл.
+    """
+
+    def __init__(self, typecode='B', indexed=False):
+        self.values = []
+        self.codes = {}
+        self.data = array(typecode)
+        # Число строк с каждым кодом
+        self.counts = array('q')
+        # Размер словаря значений и хеш-индекса
+        self.bytes = 0
+        # Хеш-индекс: для каждого кода - возрастающий список строк с этим значением
+        self.postings = [] if indexed else None
+
+    @staticmethod
+    def key(value):
+        # True, 1 и 1.0 равны как ключи словаря, но в записи должны остаться разными
+        return value if value.__class__ is str else (value.__class__, value)
+
+    def encode(self, value):
+        try:
+            key = self.key(value)
+            code = self.codes.get(key)
+        except TypeError:
+            # Нехешируемые значения (списки, словари) просто дописываются в словарь
+            key = code = None
+
+        if code is None:
+            if value.__class__ is str:
+                value = sys.intern(value)
+            code = len(self.values)
+            self.values.append(value)
+            self.counts.append(0)
+            self.bytes += estimate_size(value)
+            if key is not None:
+                self.codes[key] = code
+            if self.postings is not None:
+                self.postings.append(array('I'))
+                self.bytes += sys.getsizeof(self.postings[-1])
+
+        return code
+
+    def load(self, values, counts, data=None):
+        """Словарь значений и счётчики из файла (см. columns); data - отображённые коды строк"""
+        self.values = [sys.intern(value) if value.__class__ is str else value for value in values]
+        self.counts = array('q', counts)
+        self.bytes = 0
+        for code, value in enumerate(self.values):
+            self.bytes += estimate_size(value)
+            try:
+                self.codes[self.key(value)] = code
+            except TypeError:
+                pass
+        if data is not None:
+            self.data = data
+
+    def thaw(self):
+        """Собственные массивы вместо отображённых из файла - перед дописыванием строк"""
+        if isinstance(self.data, memoryview):
+            self.data = array(self.data.format, self.data.tobytes())
+        if self.postings is not None and not isinstance(self.postings, list):
+            self.postings = [array('I', posting.tobytes()) for posting in self.postings]
+            self.bytes += sum(sys.getsizeof(posting) for posting in self.postings)
+
+    def private_nbytes(self):
+        """Память процесса под коды строк (отображённые из файла не в счёт)"""
+        if isinstance(self.data, memoryview):
+            return 0
+        size = len(self.data) * self.data.itemsize
+        if self.postings is not None:
+            # Каждая строка попадает ровно в один список хеш-индекса
+            size += len(self.data) * 4
+        return size
+
+    def append(self, value):
+        code = self.encode(value)
+        self.counts[code] += 1
+        if self.postings is not None:
+            self.postings[code].append(len(self.data))
+        try:
+            self.data.append(code)
+        except OverflowError:
+            self.data = array('I', self.data)
+            self.data.append(code)
+
+    def matching_codes(self, predicate):
+        return {code for code, value in enumerate(self.values) if predicate(value)}
+
+    def mask(self, codes):
+        """Байтовая маска строк (1 - значение входит в codes), без цикла по строкам"""
+        if self.data.itemsize == 1:
+            table = bytes(1 if code in codes else 0 for code in range(256))
+            return self.data.tobytes().translate(table)
+        return bytes(1 if code in codes else 0 for code in self.data)
+
+    def value_counts(self, rows=None):
+        """Число строк по значениям: для всего столбца - из counts, для rows - по кодам строк"""
+        if rows is None:
+            counts = enumerate(self.counts)
+        else:
+            counts = Counter(map(self.data.__getitem__, rows)).items()
+
+        result = {}
+        for code, count in counts:
+            value = self.values[code]
+            # Пустые значения (нет rpc, типа ресурса) в статистику не попадают
+            if count and value and isinstance(value, str):
+                result[value] = result.get(value, 0) + count
+        return result
+
+    def rows_for(self, codes):
+        """Объединение списков строк для codes в порядке возрастания"""
+        postings = [self.postings[code] for code in codes]
+        if len(postings) == 1:
+            return postings[0]
+        return sorted(row for posting in postings for row in posting)
+
+    def __getitem__(self, row):
+        return self.values[self.data[row]]
+
+    def __len__(self):
+        return len(self.data)
+
+
+class ColumnarLogStore:
+    """Разобранный лог в виде столбцов.
+
+    Категории и идентификаторы запросов хранятся кодами, номера строк и
+    время - массивами чисел. Словари записей собираются только для строк,
+    которые действительно отдаются клиенту (см. ``row``).
+
+    Если задан source (SourceLog), raw_data в памяти не хранится и читается
+    из исходного файла по требованию; i-я строка хранилища - i-я строка source.
+    """
+
+    def __init__(self, source=None):
+        self.source = source
+        self.line_numbers = array('q')
+        self.id_kinds = bytearray()
+        # Время в мс от начала суток; отрицательные значения -1-k ссылаются на timestamp_labels
+        self.timestamps = array('q')
+        self.timestamp_labels = CodedColumn()
+        # Полное время в нс от эпохи (MISSING_TIME, если его нет) и индекс строк по нему, см. time_index
+        self.epoch_ns = array('q')
+        self.time_rows = array('q')
+        self.time_values = array('q')
+        self.untimed_rows = array('q')
+        self.time_indexed = 0
+        self.time_index_lock = threading.Lock()
+        self.columns = {field: CodedColumn() for field in CATEGORY_FIELDS}
+        self.columns.update({field: CodedColumn('I', indexed=True) for field in INTERNED_FIELDS})
+        self.body_flags = bytearray()
+        self.messages = []
+        self.raw_data = []
+        # Записи нестандартной формы (например, из старых файлов) хранятся целиком
+        self.overrides = {}
+        # Размер сообщений, raw_data и нестандартных записей, копится при добавлении строк
+        self.payload_bytes = 0
+        self.is_sorted = True
+        self.statistics = {}
+        self.json_bodies = {}
+        self.text_indexes = {}
+        self.text_indexes_lock = threading.Lock()
+        self.requests = None
+        # Держится, пока фоновый разбор дописывает строки, и при чтении ещё не дописанного лога
+        self.lock = threading.RLock()
+        # Столбцы отображены из файла разобранного лога (columns.mapped_store) и только читаются
+        self.mapped = False
+
+    @classmethod
+    def from_result(cls, result, source=None, body_flags=None):
+        store = cls(source)
+        store.extend(result.get('logs', []), body_flags)
+        store.statistics = result.get('statistics', {})
+        store.json_bodies = result.get('json_bodies') or {}
+        return store
+
+    def extend(self, entries, body_flags=None):
+        """body_flags - готовые флаги тел для записей, у которых raw_data уже не хранится"""
+        if body_flags is None:
+            for entry in entries:
+                self.append(entry)
+        else:
+            for entry, flags in zip(entries, body_flags):
+                self.append(entry, flags)
+
+    def thaw(self):
+        """Переводит отображённые из файла столбцы в собственные массивы процесса, чтобы дописывать строки"""
+        with self.lock:
+            if not self.mapped:
+                return
+            for name, typecode in (
+                ('line_numbers', 'q'), ('id_kinds', 'B'), ('timestamps', 'q'), ('epoch_ns', 'q'), ('body_flags', 'B'),
+            ):
+                values = getattr(self, name)
+                if typecode == 'B':
+                    setattr(self, name, bytearray(values))
+                else:
+                    setattr(self, name, array(typecode, values.tobytes()) if isinstance(values, memoryview) else values)
+            for column in self.columns.values():
+                column.thaw()
+
+            self.messages = list(self.messages)
+            self.payload_bytes += sum(estimate_size(message) for message in self.messages)
+            if self.source is None:
+                self.raw_data = list(self.raw_data)
+                self.payload_bytes += sum(estimate_size(raw_data) for raw_data in self.raw_data)
+            else:
+                self.source.thaw()
+            self.mapped = False
+
+    def append(self, entry, body_flags=None):
+        if self.mapped:
+            self.thaw()
+        row = len(self.line_numbers)
+        line_number = entry.get('line_number')
+
+        if self.is_sorted and row and line_number < self.line_numbers[-1]:
+            self.is_sorted = False
+        self.line_numbers.append(line_number)
+
+        kind = 1 if str(entry.get('id', '')).startswith('raw_') else 0
+        self.id_kinds.append(kind)
+
+        timestamp = entry.get('timestamp')
+        self.timestamps.append(self.encode_timestamp(timestamp))
+        timestamp_ns = entry.get('timestamp_ns')
+        self.epoch_ns.append(timestamp_ns if timestamp_ns is not None else MISSING_TIME)
+
+        for field, column in self.columns.items():
+            column.append(entry.get(field))
+
+        raw_data = entry.get('raw_data')
+        self.body_flags.append(body_flags_of(raw_data) if body_flags is None else body_flags)
+
+        message = entry.get('message')
+        self.messages.append(message)
+        self.payload_bytes += estimate_size(message)
+        if self.source is None:
+            self.raw_data.append(raw_data)
+            self.payload_bytes += estimate_size(raw_data)
+
+        if tuple(entry) not in (ENTRY_KEYS, LEGACY_ENTRY_KEYS) or entry['id'] != f'{ID_PREFIXES[kind]}_{line_number}':
+            self.overrides[row] = dict(entry)
+            self.payload_bytes += estimate_size(entry)
+
+    def encode_timestamp(self, timestamp):
+        if timestamp.__class__ is str:
+            match = _CANONICAL_TIMESTAMP.fullmatch(timestamp)
+            if match:
+                hours, minutes, seconds, millis = map(int, match.groups())
+                ms = ((hours * 60 + minutes) * 60 + seconds) * 1000 + millis
+                if hours < 24 and minutes < 60 and seconds < 60:
+                    return ms
+
+        return -1 - self.timestamp_labels.encode(timestamp)
+
+    def timestamp(self, row):
+        value = self.timestamps[row]
+        if value >= 0:
+            return format_timestamp_ms(value)
+        return self.timestamp_labels.values[-1 - value]
+
+    def timestamp_ns(self, row):
+        value = self.epoch_ns[row]
+        return value if value != MISSING_TIME else None
+
+    def time_index(self):
+        """Строки с полным временем, упорядоченные по нему, и их времена для бисекции.
+
+        Индекс строится при первом запросе по времени. Строки, дописанные
+        позже и не нарушающие порядок, добавляются в конец, иначе индекс
+        сортируется заново.
+        """
+        with self.time_index_lock:
+            size = len(self.epoch_ns)
+            if self.time_indexed < size:
+                epoch_ns = self.epoch_ns
+                new_rows = array('q')
+                for row in range(self.time_indexed, size):
+                    if epoch_ns[row] == MISSING_TIME:
+                        self.untimed_rows.append(row)
+                    else:
+                        new_rows.append(row)
+                new_values = array('q', (epoch_ns[row] for row in new_rows))
+
+                in_order = all(new_values[i] <= new_values[i + 1] for i in range(len(new_values) - 1))
+                if in_order and (not new_values or not self.time_values or self.time_values[-1] <= new_values[0]):
+                    self.time_rows.extend(new_rows)
+                    self.time_values.extend(new_values)
+                else:
+                    rows = sorted(self.time_rows + new_rows, key=epoch_ns.__getitem__)
+                    self.time_rows = array('q', rows)
+                    self.time_values = array('q', (epoch_ns[row] for row in rows))
+                self.time_indexed = size
+            return self.time_rows, self.time_values
+
+    def day_windows(self, from_ms=None, to_ms=None):
+        """Промежутки по эпохе (нс) для времени суток from_ms - to_ms (мс) у строк с полным временем.
+
+        Сутки отсчитываются в часовом поясе первой записи, и промежуток
+        повторяется в каждых сутках от первой до последней записи. Без одной
+        из границ промежуток идёт от начала или до конца суток; конец раньше
+        начала - промежуток через полночь до следующих суток.
+        """
+        rows, values = self.time_index()
+        if not values:
+            return []
+        first, last = values[0], values[-1]
+
+        local_ms = self.timestamps[rows[0]]
+        if local_ms >= 0:
+            day_start = first - first % MS_NS - local_ms * MS_NS
+        else:
+            day_start = first - first % DAY_NS
+        days = (last - day_start) // DAY_NS + 1
+
+        # Промежуток через полночь, начатый в сутки до первой записи, захватывает её утро
+        wraps = from_ms is not None and to_ms is not None and to_ms < from_ms
+        windows = []
+        for day in range(-1 if wraps else 0, days):
+            start_ns = day_start + day * DAY_NS + (from_ms or 0) * MS_NS
+            if to_ms is not None:
+                end_ns = day_start + (day + wraps) * DAY_NS + to_ms * MS_NS + MS_NS - 1
+            else:
+                end_ns = day_start + (day + 1) * DAY_NS - 1
+            if end_ns >= first and start_ns <= last:
+                windows.append((start_ns, end_ns))
+        return windows
+
+    def time_mask(self, from_ms=None, to_ms=None):
+        """Маска строк с полным временем внутри day_windows(from_ms, to_ms); ищется бисекцией по time_index"""
+        mask = bytearray(len(self.line_numbers))
+        rows, values = self.time_index()
+        for start_ns, end_ns in self.day_windows(from_ms, to_ms):
+            low = bisect_left(values, start_ns)
+            high = bisect_right(values, end_ns)
+            for row in rows[low:high]:
+                mask[row] = 1
+        return mask
+
+    def raw(self, row):
+        if self.source is not None:
+            return self.source.raw_data(row)
+        return self.raw_data[row]
+
+    def message_text(self, row):
+        message = self.messages[row]
+        return message.lower() if isinstance(message, str) else None
+
+    def raw_data_text(self, row):
+        # Тот же текст, по которому искал исходный фильтр rawDataSearch;
+        # при построении индекса строки из source не вытесняют кэш страниц
+        raw_data = self.source.raw_data(row, cache=False) if self.source is not None else self.raw_data[row]
+        return json.dumps(raw_data, ensure_ascii=False).lower() if raw_data else None
+
+    def text_index(self, name):
+        """Триграммный индекс по messages ('message') или raw_data ('raw_data').
+
+        Строится при первом поиске и дополняется, если в лог дописаны строки.
+        """
+        index = self.text_indexes.get(name)
+        if index is None:
+            with self.text_indexes_lock:
+                index = self.text_indexes.get(name)
+                if index is None:
+                    text_of = self.message_text if name == 'message' else self.raw_data_text
+                    index = self.text_indexes[name] = TrigramIndex(text_of)
+        index.update(len(self))
+        return index
+
+    def request_index(self):
+        """Сводка по tf_req_id (RequestIndex), строится при первом обращении и дополняется"""
+        if self.requests is None:
+            with self.text_indexes_lock:
+                if self.requests is None:
+                    self.requests = RequestIndex(self)
+        self.requests.update(len(self))
+        return self.requests
+
+    def find_row(self, entry_id):
+        """Номер строки записи с данным id или None"""
+        for row, override in self.overrides.items():
+            if override.get('id') == entry_id:
+                return row
+
+        prefix, _, number = str(entry_id).partition('_')
+        if prefix not in ID_PREFIXES or not number.isdigit():
+            return None
+        kind = ID_PREFIXES.index(prefix)
+        line_number = int(number)
+
+        line_numbers = self.line_numbers
+        if self.is_sorted:
+            candidates = range(bisect_left(line_numbers, line_number), len(line_numbers))
+        else:
+            candidates = range(len(line_numbers))
+        for row in candidates:
+            if line_numbers[row] == line_number:
+                if self.id_kinds[row] == kind and row not in self.overrides:
+                    return row
+            elif self.is_sorted:
+                break
+        return None
+
+    def row_id(self, row):
+        override = self.overrides.get(row)
+        if override is not None:
+            return override.get('id')
+        return f'{ID_PREFIXES[self.id_kinds[row]]}_{self.line_numbers[row]}'
+
+    def row(self, row, fields=None):
+        """Запись строки row; с fields - только эти поля, остальные (и raw_data) не читаются"""
+        override = self.overrides.get(row)
+        if override is not None:
+            if fields is not None:
+                return {field: override.get(field) for field in fields}
+            return dict(override)
+        if fields is not None:
+            return {field: ROW_FIELDS[field](self, row) for field in fields}
+
+        columns = self.columns
+        line_number = self.line_numbers[row]
+        return {
+            'id': f'{ID_PREFIXES[self.id_kinds[row]]}_{line_number}',
+            'timestamp': self.timestamp(row),
+            'level': columns['level'][row],
+            'operation': columns['operation'][row],
+            'component': columns['component'][row],
+            'message_type': columns['message_type'][row],
+            'message': self.messages[row],
+            'raw_data': self.raw(row),
+            'line_number': line_number,
+            'tf_req_id': columns['tf_req_id'][row],
+            'tf_resource_type': columns['tf_resource_type'][row],
+            'tf_rpc': columns['tf_rpc'][row],
+            'timestamp_ns': self.timestamp_ns(row),
+        }
+
+    def rows(self, row_ids, fields=None):
+        return [self.row(row, fields) for row in row_ids]
+
+    def value_mask(self, field, predicate):
+        """Маска строк, у которых значение категории удовлетворяет predicate"""
+        column = self.columns[field]
+        return column.mask(column.matching_codes(predicate))
+
+    def facet_counts(self, rows=None):
+        """Статистика в формате generate_statistics (и по rpc и типам ресурсов) для строк rows.
+
+        Без rows берутся счётчики, накопленные при добавлении строк; иначе
+        считаются коды выбранных строк, сами записи не собираются.
+        """
+        if rows is not None and len(rows) == len(self.line_numbers):
+            rows = None
+        statistics = {
+            'total_entries': len(self.line_numbers) if rows is None else len(rows),
+        }
+        for name, field in FACET_FIELDS.items():
+            statistics[name] = self.columns[field].value_counts(rows)
+        statistics['errors_count'] = statistics['by_level'].get('error', 0)
+        return statistics
+
+    def body_mask(self, flags):
+        """Маска строк, у которых есть хотя бы одно из тел запроса/ответа в flags"""
+        table = bytes(1 if value & flags else 0 for value in range(256))
+        return bytes(self.body_flags).translate(table)
+
+    def indexed_rows(self, field, predicate):
+        """Строки из хеш-индекса поля для всех значений, удовлетворяющих predicate"""
+        column = self.columns[field]
+        return column.rows_for(column.matching_codes(predicate))
+
+    def select(self, masks=(), row_lists=()):
+        """Пересекает байтовые маски и списки строк из индексов.
+
+        Маски объединяются одной операцией над целыми числами, списки строк -
+        начиная с самого короткого; результат - номера строк по возрастанию.
+        """
+        size = len(self.line_numbers)
+
+        mask = None
+        if masks:
+            combined = int.from_bytes(masks[0], 'little')
+            for other in masks[1:]:
+                combined &= int.from_bytes(other, 'little')
+            mask = combined.to_bytes(size, 'little')
+
+        if not row_lists:
+            if mask is None:
+                return self.all_rows()
+            return mask_rows(mask)
+
+        row_lists = sorted(row_lists, key=len)
+        rows = row_lists[0]
+        for other in row_lists[1:]:
+            other = set(other)
+            rows = [row for row in rows if row in other]
+
+        if mask is None:
+            return list(rows)
+        return [row for row in rows if mask[row]]
+
+    def nbytes(self):
+        """Оценка занимаемой памяти процесса для учёта в LogStorage.
+
+        Столбцы, отображённые из файла, лежат в страничном кэше ОС, общем
+        для процессов, и в оценку не входят.
+        """
+        size = self.payload_bytes
+        for values in (
+            self.line_numbers, self.timestamps, self.epoch_ns, self.time_rows, self.time_values,
+            self.untimed_rows, self.id_kinds, self.body_flags,
+        ):
+            if not isinstance(values, memoryview):
+                size += len(values) * values.itemsize if isinstance(values, array) else len(values)
+        if not self.mapped:
+            # Ссылки в списках messages и raw_data
+            size += 16 * len(self.line_numbers)
+
+        for column in (*self.columns.values(), self.timestamp_labels):
+            size += column.bytes + column.private_nbytes() + len(column.counts) * 8
+
+        for index in list(self.text_indexes.values()):
+            size += index.bytes
+        if self.requests is not None:
+            size += self.requests.bytes
+        if self.source is not None:
+            size += self.source.nbytes()
+        return size
+
+    def all_rows(self):
+        return list(range(len(self.line_numbers)))
+
+    def sort_rows(self, rows):
+        if not self.is_sorted:
+            rows.sort(key=self.line_numbers.__getitem__)
+        return rows
+
+    def __len__(self):
+        return len(self.line_numbers)
+
+
+def _column_field(field):
+    return lambda store, row: store.columns[field][row]
+
+
+# Как достать одно поле записи, не собирая её целиком (ColumnarLogStore.row с fields)
+ROW_FIELDS = {
+    'id': ColumnarLogStore.row_id,
+    'timestamp': ColumnarLogStore.timestamp,
+    **{field: _column_field(field) for field in CATEGORY_FIELDS + INTERNED_FIELDS},
+    'message': lambda store, row: store.messages[row],
+    'raw_data': ColumnarLogStore.raw,
+    'line_number': lambda store, row: store.line_numbers[row],
+    'timestamp_ns': ColumnarLogStore.timestamp_ns,
+}
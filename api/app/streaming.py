@@ -0,0 +1,112 @@
+"""Приём тела запроса под ASGI по мере поступления.
+
+ASGIHandler Django собирает всё тело во временный файл, прежде чем вызвать
+представление, и загруженный лог начинал бы разбираться только после приёма
+целиком. StreamingASGIHandler для представлений с stream_request_body отдаёт
+телом запроса RequestBodyStream: куски берутся из receive() тогда, когда их
+запрашивает разбор формы в пуле потоков (read_form), и сразу уходят в
+LogUpload.
+"""
+import asyncio
+import io
+
+from django.core.exceptions import RequestAborted
+from django.core.handlers.asgi import ASGIHandler, ASGIRequest, get_script_prefix
+from django.urls import Resolver404, get_resolver
+
+
+def stream_request_body(view_func):
+    """Тело запроса к представлению под StreamingASGIHandler читается по мере приёма.
+
+    Представление должно читать тело (request.POST, request.FILES) только в
+    пуле потоков: из цикла событий чтение ждало бы само себя.
+    """
+    view_func.stream_request_body = True
+    return view_func
+
+
+class RequestBodyStream(io.RawIOBase):
+    """Тело запроса, которое читается из receive() в потоке пула.
+
+    Подменяет receive в ASGIHandler.handle: вызов проксируется в исходный
+    receive, а read_body и listen_for_disconnect узнают по типу, что тело
+    не нужно собирать заранее. finished выставляется, когда тело принято
+    целиком или клиент отключился.
+    """
+
+    def __init__(self, receive, loop):
+        self.receive = receive
+        self.loop = loop
+        self.chunk = memoryview(b'')
+        self.finished = asyncio.Event()
+        self.disconnected = False
+
+    async def __call__(self):
+        return await self.receive()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.chunk and not self.finished.is_set():
+            self.chunk = memoryview(self.next_chunk())
+        size = min(len(buffer), len(self.chunk))
+        buffer[:size] = self.chunk[:size]
+        self.chunk = self.chunk[size:]
+        return size
+
+    def next_chunk(self):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            raise RuntimeError('Потоковое тело запроса читается в пуле потоков, а не в цикле событий')
+
+        future = asyncio.run_coroutine_threadsafe(self.receive_chunk(), self.loop)
+        try:
+            return future.result(timeout=ASGIRequest.body_receive_timeout)
+        except TimeoutError:
+            # TimeoutError - это OSError: request.read() превратит его в UnreadablePostError
+            future.cancel()
+            raise
+
+    async def receive_chunk(self):
+        message = await self.receive()
+        if message['type'] == 'http.disconnect':
+            self.disconnected = True
+            self.finished.set()
+            raise OSError('Клиент отключился до конца запроса')
+        if not message.get('more_body', False):
+            self.finished.set()
+        return message.get('body', b'')
+
+
+class StreamingASGIHandler(ASGIHandler):
+    """ASGIHandler, который не собирает заранее тело POST-запросов к представлениям с stream_request_body"""
+
+    async def handle(self, scope, receive, send):
+        if scope.get('method') == 'POST' and self.streams_body(scope):
+            receive = RequestBodyStream(receive, asyncio.get_running_loop())
+        await super().handle(scope, receive, send)
+
+    def streams_body(self, scope):
+        path = scope['path'].removeprefix(get_script_prefix(scope))
+        try:
+            match = get_resolver().resolve(path if path.startswith('/') else f'/{path}')
+        except Resolver404:
+            return False
+        return getattr(match.func, 'stream_request_body', False)
+
+    async def read_body(self, receive):
+        if isinstance(receive, RequestBodyStream):
+            return io.BufferedReader(receive)
+        return await super().read_body(receive)
+
+    async def listen_for_disconnect(self, receive):
+        if isinstance(receive, RequestBodyStream):
+            # До конца тела receive() вызывает только чтение тела
+            await receive.finished.wait()
+            if receive.disconnected:
+                raise RequestAborted()
+        await super().listen_for_disconnect(receive)
@@ -0,0 +1,231 @@
+"""Дописывание строк к уже разобранному логу (режим tail/follow).
+
+Новые байты дописываются в исходный лог файла и разбираются парсером,
+который продолжает нумерацию строк (line_number и id) и статистику с места,
+где остановился разбор. Строки попадают в тот же ColumnarLogStore, поэтому
+индексы (текстовые, по времени, по запросам, кэш фильтров) дополняются
+сами при следующем обращении - работа пропорциональна дописанному.
+
+Файл разобранного лога при этом не переписывается: он отстаёт от исходного
+лога, а при загрузке с диска недостающий хвост исходного лога дочитывается
+(см. has_unparsed_tail). Целиком он переписывается один раз - по eof.
+
+Исходный лог общий для всех процессов: дописывание идёт под блокировкой
+файла (flock), а строки, дописанные другим процессом, этот процесс
+дочитывает сам (catch_up).
+"""
+import asyncio
+import fcntl
+import os
+import threading
+
+from .logfile import ParsedLogWriter
+from .parser import TerraformLogParser
+from .store import ENTRY_KEYS
+
+LINE_BREAKS = (b'\n', b'\r')
+# Сколько байт исходного лога дочитывается за раз при догоне хвоста
+READ_CHUNK_BYTES = 256 * 1024
+# Поля записи для файла разобранного лога: raw_data в нём не хранится, он читается из исходного лога
+SNAPSHOT_FIELDS = tuple(key for key in ENTRY_KEYS if key != 'raw_data')
+
+# Дописываемые логи по file_id
+LOG_TAILS = {}
+LOG_TAILS_LOCK = threading.Lock()
+
+
+def parsed_end(source):
+    """Конец последней разобранной строки source в байтах"""
+    if not len(source):
+        return 0
+    return source.offsets[-1] + source.lengths[-1]
+
+
+def has_unparsed_tail(source):
+    """В исходный лог дописаны строки, которых нет в разобранном"""
+    return os.path.getsize(source.path) > parsed_end(source)
+
+
+def get_tail(file_id, file_data):
+    """LogTail для загруженных данных файла; после перезагрузки файла с диска создаётся заново"""
+    with LOG_TAILS_LOCK:
+        tail = LOG_TAILS.get(file_id)
+        if tail is None or tail.store is not file_data['logs']:
+            tail = LOG_TAILS[file_id] = LogTail(file_id, file_data)
+    return tail
+
+
+def forget_tail(file_id):
+    with LOG_TAILS_LOCK:
+        tail = LOG_TAILS.pop(file_id, None)
+    if tail is not None:
+        tail.close()
+
+
+class LogTail:
+    """Продолжение разбора лога, исходный лог которого хранится рядом (store.source).
+
+    append(data) дописывает байты и разбирает завершённые строки; строка
+    без перевода строки ждёт продолжения, пока не придёт eof. wait(cursor)
+    ждёт строк хранилища с номером не меньше cursor (для long-poll и SSE);
+    wait_async - то же для цикла событий, не занимая поток.
+    """
+
+    def __init__(self, file_id, file_data):
+        store = file_data['logs']
+        if store.source is None:
+            raise ValueError('Дописывать можно только лог, исходный файл которого сохранён')
+
+        # Строки дописываются в собственные массивы процесса, а не в отображённые из файла
+        store.thaw()
+        self.file_id = file_id
+        self.file_data = file_data
+        self.store = store
+        self.source = store.source
+        self.lock = threading.Lock()
+        self.condition = threading.Condition()
+        # Пары (цикл событий, asyncio.Event) ожидающих в wait_async
+        self.async_waiters = set()
+        self.closed = False
+
+        parser = self.parser = TerraformLogParser()
+        parser.line_offsets = self.source.offsets
+        parser.line_lengths = self.source.lengths
+        statistics = store.statistics
+        if statistics:
+            parser.merge_statistics(statistics)
+
+        start = parsed_end(self.source)
+        self.last_byte = b'\n'
+        if start:
+            with open(self.source.path, 'rb') as f:
+                f.seek(start - 1)
+                self.last_byte = f.read(1)
+                if self.last_byte not in LINE_BREAKS and os.path.getsize(self.source.path) > start:
+                    # Последняя строка была разобрана без перевода строки, и append дописал его сам
+                    start += 1
+                    self.last_byte = b'\n'
+        parser.next_line = store.line_numbers[-1] + 1 if len(store) else 1
+        parser.next_offset = start
+        self.size = start
+
+        # Догоняем то, что было дописано в исходный лог, но не попало в разобранный
+        self.read_tail()
+
+    def parse(self, step, *args):
+        store = self.store
+        with store.lock:
+            entries = step(*args)
+            for entry in entries:
+                store.append(entry)
+            store.statistics = self.parser.generate_statistics()
+        return len(entries)
+
+    def read_tail(self):
+        """Разбирает то, что есть в исходном логе после уже прочитанного (вызывается под self.lock)"""
+        added = 0
+        with open(self.source.path, 'rb') as f:
+            f.seek(self.size)
+            while True:
+                chunk = f.read(READ_CHUNK_BYTES)
+                if not chunk:
+                    break
+                added += self.parse(self.parser.feed, chunk)
+                self.size += len(chunk)
+                self.last_byte = chunk[-1:]
+        return added
+
+    def catch_up(self):
+        """Разбирает строки, которые дописал в исходный лог другой процесс; возвращает их число"""
+        with self.lock:
+            if self.closed or os.path.getsize(self.source.path) <= self.size:
+                return 0
+            added = self.read_tail()
+        if added:
+            self.notify()
+        return added
+
+    def append(self, data, eof=False):
+        """Дописывает data в исходный лог и разбирает её; возвращает число новых записей"""
+        with self.lock:
+            if self.closed:
+                raise ValueError('Файл удалён')
+
+            with open(self.source.path, 'ab') as f:
+                # Лог могут дописывать и другие процессы: сначала разбираем их строки, пишем под блокировкой файла
+                fcntl.flock(f, fcntl.LOCK_EX)
+                caught_up = self.read_tail()
+                if data and not self.parser.pending and self.size and self.last_byte not in LINE_BREAKS:
+                    # Прошлая последняя строка уже разобрана целиком - новые данные начинаются с новой строки
+                    f.write(b'\n')
+                    self.size += 1
+                    self.parser.next_offset += 1
+                f.write(data)
+            self.size += len(data)
+            if data:
+                self.last_byte = data[-1:]
+
+            added = caught_up + (self.parse(self.parser.feed, data) if data else 0)
+            if eof:
+                added += self.parse(self.parser.finish)
+
+            if added:
+                self.notify()
+            if eof:
+                self.snapshot()
+        return added
+
+    def snapshot(self):
+        """Переписывает файл разобранного лога по хранилищу: после него догонять с диска нечего"""
+        store = self.store
+        file_data = self.file_data
+        writer = ParsedLogWriter(file_data['file_path'], source=self.source)
+        for row in range(len(store)):
+            if row in store.overrides:
+                entry = store.row(row)
+            else:
+                values = store.row(row, SNAPSHOT_FIELDS)
+                entry = {key: values.get(key) for key in ENTRY_KEYS}
+            writer.add(entry, store.body_flags[row])
+        writer.close({
+            'original_filename': file_data['filename'],
+            'session_id': file_data['session_id'],
+            'timestamp': file_data['timestamp'],
+            'file_id': self.file_id,
+        }, store.statistics, store.json_bodies, store)
+
+    def notify(self):
+        with self.condition:
+            self.condition.notify_all()
+            for loop, event in self.async_waiters:
+                try:
+                    loop.call_soon_threadsafe(event.set)
+                except RuntimeError:
+                    # Цикл событий ожидающего уже закрыт
+                    pass
+
+    def wait(self, cursor, timeout):
+        """Ждёт, пока в хранилище станет больше cursor строк; возвращает их число"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.closed or len(self.store) > cursor, timeout)
+        return len(self.store)
+
+    async def wait_async(self, cursor, timeout):
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self.condition:
+            if self.closed or len(self.store) > cursor:
+                return len(self.store)
+            self.async_waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self.condition:
+                self.async_waiters.discard(waiter)
+        return len(self.store)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+        self.notify()
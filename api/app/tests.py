@@ -1,3 +1,1364 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client, SimpleTestCase, TransactionTestCase, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.urls import resolve
+from django.utils import timezone
+
+from app.models import LogFile
+
+from .classifier import (
+    OPERATION_MARKERS, COMPONENT_INDICATORS, MESSAGE_TYPE_MARKERS, LEVEL_PATTERNS,
+    RAW_OPERATION_MARKERS, RAW_COMPONENT_INDICATORS, RAW_LEVEL_PATTERNS,
+)
+from . import catalog, codec
+from .cache import FilterResultCache
+from . import parser as parser_module
+from .logfile import ParsedLogFile, write_parsed_log
+from .loggen import TerraformLogGenerator
+from .parser import TerraformLogParser
+from .storage import LogStorage
+from .streaming import StreamingASGIHandler
+from .source import SourceLog
+from .store import BODY_REQ, BODY_RES, ColumnarLogStore, body_flags_of, mask_rows
+from .uploads import LogUpload
+from .views import apply_filters
+
+SAMPLE_LOG = os.path.join(settings.MEDIA_ROOT, 'temp', '1. plan_test-k801vip_tflog.json')
+
+
+def sample_lines():
+    with open(SAMPLE_LOG, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+class ClassifierParityTests(SimpleTestCase):
+    def assert_entry_parity(self, parser, data):
+        message, operation, component, message_type, level = parser.classify_entry(data)
+        expected = (
+            parser.extract_message(data),
+            parser.detect_operation(data),
+            parser.detect_component(data),
+            parser.detect_message_type(data),
+            parser.extract_level(data),
+        )
+        self.assertEqual((message, operation, component, message_type, level), expected, data)
+
+    def test_sample_log_matches_marker_methods(self):
+        parser = TerraformLogParser()
+        for line in sample_lines():
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            self.assert_entry_parity(parser, parser.parse_json_bodies_in_data(data))
+
+    def test_every_marker_combination_keeps_precedence(self):
+        parser = TerraformLogParser()
+        markers = sorted({
+            marker
+            for table in (OPERATION_MARKERS, COMPONENT_INDICATORS, MESSAGE_TYPE_MARKERS, LEVEL_PATTERNS)
+            for group in table.values()
+            for marker in group
+        })
+        for first in markers:
+            self.assert_entry_parity(parser, {'@message': first.upper()})
+            for second in markers[::7]:
+                self.assert_entry_parity(parser, {'@message': f'{second} then {first}'})
+                self.assert_entry_parity(parser, {'@message': f'{first}{second}', '@level': 'bogus'})
+
+        self.assert_entry_parity(parser, {'@message': 'nothing here', '@module': 'sdk.proto'})
+        self.assert_entry_parity(parser, {'@message': 'nothing here', 'tf_rpc': 'PlanResourceChange'})
+        self.assert_entry_parity(parser, {'@level': 'WARNING', 'other': 'no message field'})
+
+    def test_raw_lines_match_marker_methods(self):
+        parser = TerraformLogParser()
+        markers = sorted({
+            marker
+            for table in (RAW_OPERATION_MARKERS, RAW_COMPONENT_INDICATORS, RAW_LEVEL_PATTERNS)
+            for group in table.values()
+            for marker in group
+        })
+        lines = [f'2025/09/09 {first} and {second}' for first in markers for second in markers]
+        lines.append('plain line')
+        for line in lines:
+            parser.parsed_logs = []
+            parser.process_raw_line(line, 1)
+            entry = parser.parsed_logs[0]
+            self.assertEqual(
+                (entry['operation'], entry['component'], entry['level']),
+                (
+                    parser.detect_operation_from_raw(line),
+                    parser.detect_component_from_raw(line),
+                    parser.extract_level_from_raw(line),
+                ),
+                line,
+            )
+
+
+class StreamingParserTests(SimpleTestCase):
+    def test_iter_entries_matches_parse_file(self):
+        expected = TerraformLogParser().parse_file(SAMPLE_LOG)
+
+        parser = TerraformLogParser()
+        with open(SAMPLE_LOG, 'rb') as stream:
+            entries = list(parser.iter_entries(stream))
+
+        self.assertEqual(parser.parsed_logs, [])
+        self.assertEqual(entries, expected['logs'])
+        self.assertEqual(parser.generate_statistics(), expected['statistics'])
+
+    def test_timed_parse_matches_untimed(self):
+        with override_settings(METRICS_ENABLED=False):
+            parser = TerraformLogParser()
+            expected = list(parser.iter_entries(SAMPLE_LOG))
+
+        timed = TerraformLogParser()
+        with override_settings(METRICS_ENABLED=True):
+            self.assertEqual(list(timed.iter_entries(SAMPLE_LOG)), expected)
+        self.assertEqual(timed.generate_statistics(), parser.generate_statistics())
+        self.assertEqual(timed.line_offsets, parser.line_offsets)
+
+    def test_statistics_are_collected_while_iterating(self):
+        parser = TerraformLogParser()
+        lines = ['{"@level":"error","@message":"apply failed"}', '', 'raw plan line']
+
+        entries = parser.iter_entries(iter(lines))
+        next(entries)
+        self.assertEqual(parser.statistics['total_entries'], 1)
+        self.assertEqual(parser.statistics['errors_count'], 1)
+
+        last = next(entries)
+        self.assertEqual((last['id'], last['line_number']), ('raw_3', 3))
+        self.assertEqual(parser.generate_statistics()['by_operation'], {'apply': 1, 'plan': 1})
+
+    def test_line_spans_point_at_source_lines(self):
+        content = b'  {"@message":"\xd0\xbf\xd0\xbb\xd0\xb0\xd0\xbd"}\r\n\nraw one\rraw two\r\n' + sample_lines()[5].encode()
+        parser = TerraformLogParser()
+        entries = list(parser.iter_entries(io.BytesIO(content), first_offset=100))
+
+        self.assertEqual([entry['line_number'] for entry in entries], [1, 3, 4, 5])
+        self.assertEqual(len(parser.line_offsets), len(entries))
+        for offset, length, entry in zip(parser.line_offsets, parser.line_lengths, entries):
+            line = content[offset - 100:offset - 100 + length].decode('utf-8').strip()
+            self.assertEqual(parser.parse_raw_data(line), entry['raw_data'])
+
+
+class ParallelParserTests(SimpleTestCase):
+    def test_parallel_parse_is_identical_to_serial(self):
+        with open(SAMPLE_LOG, 'rb') as f:
+            content = f.read()
+        # Пустые строки, \r\n и одиночный \r должны нумероваться так же, как при open()
+        content += b'\n\r\nraw error line\rraw plan line\r\n' + content[:4096].rsplit(b'\n', 1)[0]
+
+        with tempfile.NamedTemporaryFile(suffix='.log', delete=False) as tmp:
+            tmp.write(content)
+        self.addCleanup(os.unlink, tmp.name)
+
+        expected = TerraformLogParser().parse_file(tmp.name)
+        with mock.patch.object(parser_module, 'PARALLEL_MIN_CHUNK_BYTES', 4096):
+            self.assertGreater(len(parser_module.split_byte_ranges(tmp.name, 8, 4096)), 1)
+            result = TerraformLogParser().parse_file(tmp.name, workers=2)
+
+        self.assertEqual(result['logs'], expected['logs'])
+        self.assertEqual(list(result['statistics']['by_level'].items()), list(expected['statistics']['by_level'].items()))
+        self.assertEqual(result, expected)
+
+
+class CodecTests(SimpleTestCase):
+    def test_loads_matches_stdlib(self):
+        documents = [
+            '{"@message":"ok","n":1.5,"t":"2025-09-09T15:31:32.757289+03:00"}',
+            '{"id":123456789012345678901234567890}',
+            '{"value":NaN}',
+            '"\\ud800"',
+            b'{"bytes":[1,2,3]}',
+        ]
+        for document in documents:
+            self.assertEqual(repr(codec.loads(document)), repr(json.loads(document)), document)
+
+        with self.assertRaises(json.JSONDecodeError):
+            codec.loads('not json')
+
+    def test_dumps_round_trips(self):
+        data = {'message': 'Привет', 'nested': {'list': [1, 2.5, None, True]}, 'big': 2 ** 70}
+        self.assertEqual(json.loads(codec.dumps(data)), data)
+
+
+def reference_filters(logs, params):
+    """Исходная построчная фильтрация по словарям - эталон для проверок"""
+    filtered = list(logs)
+    for param, field in (
+        ('level', 'level'), ('operation', 'operation'), ('component', 'component'),
+        ('message_type', 'message_type'), ('rpc', 'tf_rpc'), ('resource_type', 'tf_resource_type'),
+    ):
+        value = params.get(param)
+        if value and value != 'all':
+            filtered = [log for log in filtered if log.get(field) == value]
+
+    req_id = params.get('req_id')
+    if req_id:
+        filtered = [log for log in filtered if req_id in log.get('tf_req_id', '')]
+
+    search_text = params.get('search_text')
+    if search_text:
+        search_lower = search_text.lower()
+        filtered = [log for log in filtered if (
+            search_lower in log.get('message', '').lower() or
+            search_lower in log.get('tf_resource_type', '').lower() or
+            search_lower in log.get('tf_rpc', '').lower()
+        )]
+
+    body_fields = {
+        'has_req_body': ('tf_http_req_body',),
+        'has_res_body': ('tf_http_res_body',),
+        'has_both': ('tf_http_req_body', 'tf_http_res_body'),
+    }.get(params.get('body_filter'))
+    if body_fields:
+        filtered = [log for log in filtered if log.get('raw_data') and any(f in log['raw_data'] for f in body_fields)]
+
+    raw_search = params.get('rawDataSearch')
+    if raw_search:
+        search_lower = raw_search.lower()
+        filtered = [log for log in filtered if log.get('raw_data') and search_lower in json.dumps(log['raw_data'], ensure_ascii=False).lower()]
+
+    def to_ms(value):
+        try:
+            hours, minutes, rest = value.split(':')[:3]
+            seconds, _, millis = rest.partition('.')
+            return int(hours) * 3600_000 + int(minutes) * 60_000 + int(seconds) * 1000 + int(millis or 0)
+        except (AttributeError, ValueError):
+            return None
+
+    from_ms = to_ms(params.get('time_from')) if params.get('time_from') else None
+    till_ms = to_ms(params.get('time_to')) if params.get('time_to') else None
+    if from_ms is not None or till_ms is not None:
+        filtered = [
+            log for log in filtered
+            if to_ms(log['timestamp']) is not None
+            and (from_ms is None or to_ms(log['timestamp']) >= from_ms)
+            and (till_ms is None or to_ms(log['timestamp']) <= till_ms)
+        ]
+
+    return sorted(filtered, key=lambda log: log['line_number'])
+
+
+FILTER_CASES = [
+    {},
+    {'level': 'error'},
+    {'level': 'debug', 'component': 'provider'},
+    {'operation': 'plan', 'level': 'all'},
+    {'component': 'grpc', 'operation': 'general'},
+    {'req_id': 'a3'},
+    {'req_id': '-', 'level': 'trace', 'component': 'provider'},
+    {'message_type': 'RAW'},
+    {'rpc': 'PlanResourceChange', 'level': 'trace'},
+    {'resource_type': 't1_vpc_vip', 'rpc': 'ValidateResourceConfig', 'req_id': 'f'},
+    {'resource_type': 'missing'},
+    {'req_id': 'no-such-request'},
+    {'search_text': 'T1_VPC_'},
+    {'search_text': 'ReadDataSource'},
+    {'search_text': 'provider', 'level': 'trace'},
+    {'body_filter': 'has_req_body'},
+    {'body_filter': 'has_res_body'},
+    {'body_filter': 'has_both', 'level': 'debug'},
+    {'rawDataSearch': 'tf_provider_addr'},
+    {'rawDataSearch': '"@level": "DEBUG"'},
+    {'rawDataSearch': 'vip', 'operation': 'plan'},
+    {'rawDataSearch': 'z'},
+    {'rawDataSearch': '"}'},
+    {'rawDataSearch': 'PROVIDER", "TF_'},
+    {'search_text': 'gE'},
+    {'search_text': 'ЗАПРОС'},
+    {'time_from': '15:31:33'},
+    {'time_to': '15:31:33.500'},
+    {'time_from': '15:31:33.100', 'time_to': '15:31:34', 'level': 'debug'},
+    {'time_from': 'garbage'},
+]
+
+
+class LogGeneratorTests(SimpleTestCase):
+    def test_seeded_log_is_reproducible_and_mixed(self):
+        lines = list(TerraformLogGenerator(seed=7).iter_lines(3000))
+        self.assertEqual(lines, list(TerraformLogGenerator(seed=7).iter_lines(3000)))
+        self.assertNotEqual(lines, list(TerraformLogGenerator(seed=8).iter_lines(3000)))
+
+        parser = TerraformLogParser()
+        logs = list(parser.iter_entries(iter(lines)))
+        self.assertEqual(len(logs), 3000)
+        self.assertTrue(any(log['message_type'] == 'RAW' for log in logs))
+        self.assertTrue(any(log['tf_rpc'] and log['tf_req_id'] for log in logs))
+        self.assertTrue(any(body_flags_of(log['raw_data']) == BODY_RES for log in logs))
+        self.assertTrue(any(body_flags_of(log['raw_data']) == BODY_REQ for log in logs))
+        # Строки не в JSON несут время с точностью до миллисекунд
+        timestamps = [log['timestamp_ns'] // 1_000_000 for log in logs if log['timestamp_ns'] is not None]
+        self.assertEqual(timestamps, sorted(timestamps))
+
+
+class ParsedLogFileTests(SimpleTestCase):
+    def test_reads_pages_across_blocks(self):
+        result = TerraformLogParser().parse_file(SAMPLE_LOG)
+        logs = result['logs']
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'file_parsed.tflog')
+            write_parsed_log(path, {'session_id': 's'}, result, block_rows=7)
+
+            with ParsedLogFile(path) as log_file:
+                self.assertEqual(len(log_file), len(logs))
+                self.assertEqual(log_file.metadata, {'session_id': 's'})
+                self.assertEqual(log_file.statistics, result['statistics'])
+                self.assertTrue(log_file.is_sorted)
+                self.assertEqual(list(log_file), logs)
+                for start, stop in ((0, 1), (5, 9), (6, 21), (len(logs) - 3, len(logs) + 10), (len(logs), len(logs) + 5)):
+                    self.assertEqual(log_file.rows(start, stop), logs[start:stop])
+
+
+class ColumnarStoreTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        lines = sample_lines()
+        lines[10:10] = [
+            'raw ERROR line at 15:31:33 req_id=a3-raw',
+            '2025-09-09 15:31:33 plain provider line',
+            '{"@level":"info","@message":"Отправка запроса","@timestamp":"2025-09-09T15:31:33.001+03:00"}',
+        ]
+        cls.logs = list(TerraformLogParser().iter_entries(iter(lines)))
+        cls.store = ColumnarLogStore.from_result({'logs': cls.logs, 'statistics': {}})
+
+    def test_rows_round_trip(self):
+        self.assertEqual(self.store.rows(range(len(self.store))), self.logs)
+
+    def test_filters_match_reference(self):
+        for params in FILTER_CASES:
+            expected = reference_filters(self.logs, params)
+            rows = apply_filters(self.store, params)
+            self.assertEqual(self.store.rows(rows), expected, params)
+
+    def test_index_select_matches_scan(self):
+        store = self.store
+        trace = store.value_mask('level', lambda value: value == 'trace')
+        provider = store.value_mask('component', lambda value: value == 'provider')
+        plan_rows = store.indexed_rows('tf_rpc', lambda value: value == 'PlanResourceChange')
+
+        expected = [
+            row for row, log in enumerate(self.logs)
+            if log['level'] == 'trace' and log['component'] == 'provider' and log['tf_rpc'] == 'PlanResourceChange'
+        ]
+        self.assertTrue(expected)
+        self.assertEqual(store.select([trace, provider], [plan_rows]), expected)
+        self.assertEqual(mask_rows(bytes([0, 1, 0, 0, 1])), [1, 4])
+        self.assertEqual(mask_rows(bytes([1] * 5)), [0, 1, 2, 3, 4])
+
+    def test_source_backed_store_matches_in_memory(self):
+        parser = TerraformLogParser()
+        logs = parser.parse_file(SAMPLE_LOG)['logs']
+        store = ColumnarLogStore.from_result({'logs': logs}, SourceLog(SAMPLE_LOG, parser.line_offsets, parser.line_lengths))
+
+        self.assertEqual(store.rows(range(len(store))), logs)
+        self.assertLess(store.nbytes(), ColumnarLogStore.from_result({'logs': logs}).nbytes() / 4)
+        for params in FILTER_CASES:
+            self.assertEqual(store.rows(apply_filters(store, params)), reference_filters(logs, params), params)
+
+        row = store.find_row(logs[700]['id'])
+        self.assertEqual(row, 700)
+        self.assertIsNone(store.find_row('log_0'))
+
+    def test_mapped_store_matches_in_memory(self):
+        logs = [dict(log) for log in self.logs]
+        logs[3]['extra'] = 'kept'
+        store = ColumnarLogStore.from_result({'logs': logs, 'statistics': {'total_entries': len(logs)}})
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'file_parsed.tflog')
+            write_parsed_log(path, {}, {'logs': logs, 'statistics': store.statistics}, columns=store)
+            with ParsedLogFile(path) as log_file:
+                mapped = log_file.mapped_store()
+
+            # Столбцы читаются из файла, в памяти процесса - только словари значений
+            self.assertTrue(mapped.mapped)
+            self.assertLess(mapped.nbytes(), store.nbytes() / 4)
+            self.assertEqual(mapped.rows(range(len(mapped))), logs)
+            self.assertEqual(mapped.facet_counts(), store.facet_counts())
+            for params in FILTER_CASES:
+                self.assertEqual(apply_filters(mapped, params), apply_filters(store, params), params)
+
+            # Перед дописыванием строк столбцы копируются в память процесса
+            entry = dict(self.logs[0], id='log_100000', line_number=100000)
+            mapped.append(entry)
+            store.append(entry)
+            self.assertFalse(mapped.mapped)
+            self.assertEqual(mapped.rows(range(len(mapped))), store.rows(range(len(store))))
+            self.assertEqual(apply_filters(mapped, {'rpc': 'PlanResourceChange'}), apply_filters(store, {'rpc': 'PlanResourceChange'}))
+
+    def test_facet_counts_match_rows(self):
+        store = self.store
+        for params in FILTER_CASES[:12]:
+            rows = apply_filters(store, params)
+            expected = {name: {} for name in ('by_level', 'by_operation', 'by_component', 'by_rpc', 'by_resource_type')}
+            for log in store.rows(rows):
+                for name, field in (
+                    ('by_level', 'level'), ('by_operation', 'operation'), ('by_component', 'component'),
+                    ('by_rpc', 'tf_rpc'), ('by_resource_type', 'tf_resource_type'),
+                ):
+                    if log[field]:
+                        expected[name][log[field]] = expected[name].get(log[field], 0) + 1
+            statistics = store.facet_counts(rows)
+            self.assertEqual(statistics['total_entries'], len(rows), params)
+            self.assertEqual({name: statistics[name] for name in expected}, expected, params)
+            self.assertEqual(statistics['errors_count'], expected['by_level'].get('error', 0), params)
+
+    def test_timestamps_keep_date_and_full_precision(self):
+        parser = TerraformLogParser()
+        entry = parser.build_log_entry({'@timestamp': '2025-09-09T15:31:32.757289123+03:00'}, 1)
+        self.assertEqual(entry['timestamp'], '15:31:32.757')
+        self.assertEqual(entry['timestamp_ns'], 1757421092757289123)
+        self.assertEqual(parser.build_log_entry({'@timestamp': '2025-09-09T12:31:32Z'}, 2)['timestamp_ns'], 1757421092000000000)
+        self.assertIsNone(parser.build_log_entry({'@message': 'no time'}, 3)['timestamp_ns'])
+        self.assertEqual(parser.build_raw_entry('2025-09-09T15:31:32.757+0300 [DEBUG] x', 4)['timestamp_ns'], 1757421092757000000)
+        self.assertIsNone(parser.build_raw_entry('2025-09-09 15:31:32 no zone', 5)['timestamp_ns'])
+
+    def test_time_filter_crosses_midnight(self):
+        lines = [
+            json.dumps({'@level': 'info', '@message': f'step {i}', '@timestamp': timestamp})
+            for i, timestamp in enumerate([
+                '2025-09-09T23:50:00.000+03:00', '2025-09-09T23:58:30.500+03:00',
+                '2025-09-10T00:02:00.000+03:00', '2025-09-10T00:15:00.000+03:00',
+            ])
+        ]
+        lines.insert(2, 'raw line at 23:59:00')
+        store = ColumnarLogStore.from_result({'logs': list(TerraformLogParser().iter_entries(iter(lines)))})
+
+        def messages(**params):
+            return [log['message'] for log in store.rows(apply_filters(store, params))]
+
+        self.assertEqual(messages(time_from='23:55:00', time_to='00:05:00'), ['step 1', 'raw line at 23:59:00', 'step 2'])
+        # Одна граница - время суток в каждых сутках, как и у строки без даты
+        self.assertEqual(messages(time_from='00:00:00'), ['step 0', 'step 1', 'raw line at 23:59:00', 'step 2', 'step 3'])
+        self.assertEqual(messages(time_from='23:00:00'), ['step 0', 'step 1', 'raw line at 23:59:00'])
+        self.assertEqual(messages(time_to='00:02:00'), ['step 2'])
+        self.assertEqual(messages(time_from='23:58:30.500', time_to='23:58:30.500'), ['step 1'])
+
+        # Дописанные строки попадают в индекс времени
+        store.append(TerraformLogParser().build_log_entry(
+            {'@message': 'late', '@timestamp': '2025-09-10T00:03:00+03:00'}, 10
+        ))
+        self.assertEqual(messages(time_from='00:00:00', time_to='00:05:00'), ['step 2', 'late'])
+
+    def test_time_filter_repeats_on_every_day(self):
+        timestamps = {
+            'a0': '2025-09-09T00:30:00+03:00', 'a1': '2025-09-09T10:00:00+03:00', 'a2': '2025-09-09T23:00:00+03:00',
+            'b0': '2025-09-10T00:30:00+03:00', 'b1': '2025-09-10T10:00:00+03:00',
+            'c1': '2025-09-11T10:00:00+03:00', 'c2': '2025-09-11T23:30:00+03:00',
+        }
+        logs = [
+            TerraformLogParser().build_log_entry({'@message': message, '@timestamp': timestamp}, line_number)
+            for line_number, (message, timestamp) in enumerate(timestamps.items(), 1)
+        ]
+        store = ColumnarLogStore.from_result({'logs': logs})
+
+        def messages(**params):
+            return [log['message'] for log in store.rows(apply_filters(store, params))]
+
+        self.assertEqual(messages(time_from='09:00:00', time_to='11:00:00'), ['a1', 'b1', 'c1'])
+        # Через полночь: в том числе утро первых суток
+        self.assertEqual(messages(time_from='22:00:00', time_to='01:00:00'), ['a0', 'a2', 'b0', 'c2'])
+        self.assertEqual(messages(time_from='12:00:00', time_to='13:00:00'), [])
+        # Одна граница тоже повторяется в каждых сутках: от неё до конца суток или от начала суток до неё
+        self.assertEqual(messages(time_from='10:00:00'), ['a1', 'a2', 'b1', 'c1', 'c2'])
+        self.assertEqual(messages(time_from='23:00:00'), ['a2', 'c2'])
+        self.assertEqual(messages(time_to='01:00:00'), ['a0', 'b0'])
+        self.assertEqual(messages(time_to='10:00:00'), ['a0', 'a1', 'b0', 'b1', 'c1'])
+
+        # Лог начинается позже границы: первые сутки не теряются
+        late = ColumnarLogStore.from_result({'logs': [
+            TerraformLogParser().build_log_entry({'@message': message, '@timestamp': timestamp}, line_number)
+            for line_number, (message, timestamp) in enumerate([
+                ('d0', '2025-09-09T11:00:00+03:00'), ('d1', '2025-09-09T18:00:00+03:00'),
+                ('e0', '2025-09-10T09:00:00+03:00'), ('e1', '2025-09-10T12:00:00+03:00'),
+            ], 1)
+        ]})
+        rows = apply_filters(late, {'time_from': '10:00:00'})
+        self.assertEqual([log['message'] for log in late.rows(rows)], ['d0', 'd1', 'e1'])
+
+    def test_unsorted_and_irregular_entries(self):
+        logs = [dict(log) for log in self.logs[:50]]
+        logs.reverse()
+        logs[3]['extra'] = 'kept'
+        logs[4]['id'] = 'custom'
+        store = ColumnarLogStore.from_result({'logs': logs})
+
+        self.assertEqual(store.rows(range(len(store))), logs)
+        self.assertEqual(store.rows(apply_filters(store, {})), reference_filters(logs, {}))
+
+
+class LogsViewTests(TransactionTestCase):
+    session_id = 'test-session'
+
+    def setUp(self):
+        # Тестовый клиент обслуживает модуль, подключённый в urls.py, - он может отличаться от импортированного здесь
+        self.views = sys.modules[resolve('/api/upload/').func.__module__]
+        storage_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(storage_dir.cleanup)
+        settings_override = override_settings(LOG_STORAGE_DIR=storage_dir.name, PARSER_WORKERS=1)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.views.DATA_STORAGE.clear()
+        self.addCleanup(self.views.DATA_STORAGE.clear)
+        self.views.RESULT_CACHE.clear()
+
+    def post(self, **data):
+        data.setdefault('session_id', self.session_id)
+        return self.client.post('/api/upload/', data)
+
+    def upload(self, extra=b''):
+        # extra - другое содержимое: одинаковые загрузки ссылаются на один разбор
+        with open(SAMPLE_LOG, 'rb') as f:
+            upload = SimpleUploadedFile('plan.json', f.read() + extra)
+        response = self.post(log_file=upload)
+        self.assertEqual(response.status_code, 200)
+        uploaded = response.json()
+        self.assertEqual(uploaded['provisional'], uploaded['job']['status'] != 'done')
+        job = self.wait_for_job(uploaded['job_id'])
+        self.assertEqual(job['status'], 'done')
+        # Ответ на загрузку отдаётся до конца разбора - итог берём из задачи
+        uploaded.update(count=job['entries'], statistics=job['statistics'])
+        return uploaded
+
+    def wait_for_job(self, job_id, timeout=5):
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.post(action='get_job_status', job_id=job_id).json()
+            if job['status'] in ('done', 'error') or time.monotonic() > deadline:
+                return job
+            time.sleep(0.01)
+
+    def test_upload_is_parsed_while_streaming(self):
+        with mock.patch.object(LogUpload, 'from_chunks') as from_chunks:
+            uploaded = self.upload()
+        # Запрос разобран обработчиком загрузки, без повторного чтения файла и временных копий
+        from_chunks.assert_not_called()
+        self.assertEqual(sorted(os.listdir(settings.LOG_STORAGE_DIR)), sorted([
+            f"{uploaded['file_id']}_parsed.tflog", f"{uploaded['file_id']}_source.log",
+        ]))
+
+        expected = TerraformLogParser().parse_file(SAMPLE_LOG)
+        self.assertEqual(uploaded['count'], expected['count'])
+        self.assertEqual(uploaded['statistics'], expected['statistics'])
+        with open(os.path.join(settings.LOG_STORAGE_DIR, f"{uploaded['file_id']}_source.log"), 'rb') as f, \
+                open(SAMPLE_LOG, 'rb') as original:
+            self.assertEqual(f.read(), original.read())
+
+    def test_upload_from_chunks_matches_file_parse(self):
+        expected = TerraformLogParser().parse_file(SAMPLE_LOG)
+        with open(SAMPLE_LOG, 'rb') as f:
+            content = f.read()
+
+        upload = LogUpload.from_chunks('plan.json', (content[i:i + 1000] for i in range(0, len(content), 1000)))
+        store = upload.store
+        upload.set_metadata({'session_id': self.session_id})
+        self.assertTrue(upload.wait(5))
+
+        self.assertIsNone(upload.error)
+        self.assertEqual(upload.status, 'done')
+        self.assertEqual(store.rows(range(len(store))), expected['logs'])
+        with ParsedLogFile(upload.file_path) as log_file:
+            self.assertEqual(log_file.rows(0, len(log_file)), expected['logs'])
+            self.assertEqual(log_file.statistics, expected['statistics'])
+
+    def test_broken_upload_leaves_no_files(self):
+        response = self.post(log_file=SimpleUploadedFile('bad.log', b'ok line\n\xff\xfe broken\n'))
+        # Ошибка разбора приходит уже из фоновой задачи
+        self.assertEqual(response.status_code, 200)
+        job = self.wait_for_job(response.json()['job_id'])
+        self.assertEqual(job['status'], 'error')
+        self.assertEqual(os.listdir(settings.LOG_STORAGE_DIR), [])
+        self.assertEqual(self.post(action='get_logs', file_id=response.json()['job_id']).json()['total_count'], 0)
+
+    def test_first_page_is_served_while_parsing(self):
+        with open(SAMPLE_LOG, 'rb') as f:
+            lines = f.read().splitlines(keepends=True)
+        head, tail = b''.join(lines[:len(lines) // 2]), b''.join(lines[len(lines) // 2:])
+        expected = TerraformLogParser().parse_file(SAMPLE_LOG)
+
+        upload = self.views.LogUpload('plan.json', len(head) + len(tail))
+        self.addCleanup(upload.wait, 5)
+        self.addCleanup(upload.cancel, RuntimeError('test'))
+        upload.feed(head)
+        file_id = upload.file_id
+        self.views.DATA_STORAGE.put(file_id, {
+            'session_id': self.session_id, 'filename': 'plan.json', 'logs': upload.store,
+            'file_path': upload.file_path, 'source_path': upload.source_path,
+        })
+        self.views.DATA_STORAGE.pin(file_id)
+        upload.set_metadata({'session_id': self.session_id}, on_done=self.views.upload_done)
+
+        deadline = time.monotonic() + 5
+        while upload.progress()['bytes_processed'] < len(head) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        job = self.post(action='get_job_status', job_id=file_id).json()
+        self.assertEqual(job['status'], 'receiving')
+        self.assertEqual(job['bytes_processed'], len(head))
+        self.assertGreater(job['entries'], 0)
+
+        page = self.post(action='get_logs', file_id=file_id, page=1, page_size=10).json()
+        self.assertTrue(page['parsing'])
+        self.assertEqual(page['total_count'], job['entries'])
+        self.assertEqual([log['id'] for log in page['logs']], [log['id'] for log in expected['logs'][:10]])
+
+        upload.feed(tail)
+        upload.finish()
+        self.assertEqual(self.wait_for_job(file_id)['status'], 'done')
+        page = self.post(action='get_logs', file_id=file_id, page=1, page_size=10).json()
+        self.assertFalse(page['parsing'])
+        self.assertEqual(page['total_count'], expected['count'])
+        self.assertTrue(os.path.exists(upload.file_path))
+
+    def test_job_status_of_other_session_is_forbidden(self):
+        uploaded = self.upload()
+        response = self.post(action='get_job_status', job_id=uploaded['job_id'], session_id='other')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.post(action='get_job_status', job_id='missing').status_code, 404)
+
+    def test_upload_and_page_through_logs(self):
+        uploaded = self.upload()
+        expected = reference_filters(TerraformLogParser().parse_file(SAMPLE_LOG)['logs'], {'level': 'debug'})
+
+        response = self.post(action='get_logs', file_id=uploaded['file_id'], level='debug', page=2, page_size=10)
+        body = response.json()
+
+        self.assertEqual(body['total_count'], len(expected))
+        self.assertEqual([log['id'] for log in body['logs']], [log['id'] for log in expected[10:20]])
+        self.assertFalse(body['logs'][0]['has_json_bodies'])
+
+    def test_reload_from_disk_after_restart(self):
+        uploaded = self.upload()
+        self.views.DATA_STORAGE.clear()
+
+        body = self.post(action='get_logs', file_id=uploaded['file_id'], page=3, page_size=5).json()
+        self.assertEqual(body['total_count'], uploaded['count'])
+        self.assertEqual(body['current_file'], 'plan.json')
+        self.assertEqual([log['line_number'] for log in body['logs']], list(range(11, 16)))
+        # Страница без фильтров читается из файла, лог целиком не загружается
+        self.assertEqual(self.views.DATA_STORAGE.stats()['resident_files'], 0)
+
+        body = self.post(action='get_logs', file_id=uploaded['file_id'], level='debug', page_size=5).json()
+        self.assertEqual(body['current_file'], 'plan.json')
+        self.assertEqual(self.views.DATA_STORAGE.stats()['resident_files'], 1)
+
+    def test_fields_projection(self):
+        uploaded = self.upload()
+        params = {'action': 'get_logs', 'file_id': uploaded['file_id'], 'page_size': uploaded['count']}
+        full = self.post(**params).json()
+        fields = ('level', 'timestamp', 'message', 'has_json_bodies')
+        expected = [{field: log[field] for field in fields} for log in full['logs']]
+        self.assertTrue(any(log['has_json_bodies'] for log in expected))
+
+        # Из файла на диске и из хранилища в памяти - одни и те же записи
+        self.views.DATA_STORAGE.clear()
+        from_disk = self.post(fields='level, timestamp,message,has_json_bodies', **params).json()
+        self.assertEqual(self.views.DATA_STORAGE.stats()['resident_files'], 0)
+        in_memory = self.post(fields=','.join(fields), level='debug', **params).json()
+        self.assertEqual(from_disk['logs'], expected)
+        self.assertEqual(in_memory['logs'], [log for log in expected if log['level'] == 'debug'])
+
+        response = self.post(fields='level,secret', **params)
+        self.assertEqual(response.status_code, 400)
+
+    def test_ndjson_page_matches_json_page(self):
+        uploaded = self.upload()
+        self.views.DATA_STORAGE.clear()
+
+        def ndjson(**params):
+            response = self.post(action='get_logs', file_id=uploaded['file_id'], format='ndjson', **params)
+            self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+            header, *logs = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+            self.assertEqual(header.pop('type'), 'page')
+            return header, logs
+
+        with mock.patch.object(self.views, 'STREAM_BATCH_ROWS', 7):
+            for params in ({'page': 2, 'page_size': 30}, {'level': 'trace', 'page_size': 25}, {'fields': 'id,raw_data'}):
+                expected = self.post(action='get_logs', file_id=uploaded['file_id'], **params).json()
+                header, logs = ndjson(**params)
+                self.assertEqual(logs, expected.pop('logs'))
+                self.assertEqual(header, expected)
+
+    def appended_pages(self, file_id):
+        body = self.post(action='get_logs', file_id=file_id, page_size=100000).json()
+        for log in body['logs']:
+            del log['has_json_bodies']
+        return body['logs']
+
+    def test_append_continues_numbering_and_statistics(self):
+        uploaded = self.upload()
+        file_id = uploaded['file_id']
+        parts = [
+            b'{"@level":"error","@message":"apply failed","@timestamp":"2025-09-09T15:40:00.000001+03:00"}\n{"@level":"info",',
+            b'"@message":"Apply complete"}\n\nraw tail line',
+        ]
+
+        added = [self.post(action='append_logs', file_id=file_id, data=part.decode()).json()['added'] for part in parts]
+        self.assertEqual(added, [1, 1])
+        response = self.post(action='append_logs', file_id=file_id, eof='1').json()
+        self.assertEqual((response['added'], response['total_count']), (1, uploaded['count'] + 3))
+        self.assertEqual(response['statistics']['errors_count'], uploaded['statistics']['errors_count'] + 1)
+        # После eof последняя строка закончена: новые данные начинаются со следующей строки
+        more = self.post(action='append_logs', file_id=file_id, chunk=SimpleUploadedFile('more.log', b'after eof\n')).json()
+        self.assertEqual(more['added'], 1)
+
+        with open(SAMPLE_LOG, 'rb') as f:
+            content = f.read() + b''.join(parts) + b'\nafter eof\n'
+        with tempfile.NamedTemporaryFile(suffix='.log') as f:
+            f.write(content)
+            f.flush()
+            expected = TerraformLogParser().parse_file(f.name)
+        self.assertEqual(self.appended_pages(file_id), expected['logs'])
+        self.assertEqual(more['statistics'], expected['statistics'])
+        self.assertEqual([log['id'] for log in expected['logs'][-2:]], [f'raw_{uploaded["count"] + 4}', f'raw_{uploaded["count"] + 5}'])
+
+        # Файл с диска дочитывает хвост исходного лога, не попавший в разобранный файл
+        self.views.DATA_STORAGE.clear()
+        self.assertEqual(self.appended_pages(file_id), expected['logs'])
+
+        self.assertEqual(self.post(action='append_logs', file_id=file_id, data='x', session_id='other').status_code, 403)
+
+    def test_pending_line_survives_reload(self):
+        uploaded = self.upload()
+        file_id = uploaded['file_id']
+        self.post(action='append_logs', file_id=file_id, data='first appended\nsecond ')
+        self.views.DATA_STORAGE.clear()
+
+        body = self.post(action='get_logs', file_id=file_id, page_size=1).json()
+        self.assertEqual(body['total_count'], uploaded['count'] + 1)
+        self.post(action='append_logs', file_id=file_id, data='half\n')
+        tail = self.post(action='follow_logs', file_id=file_id, cursor=uploaded['count'], fields='message').json()
+        self.assertEqual([log['message'] for log in tail['logs']], ['first appended', 'second half'])
+        self.assertEqual(tail['cursor'], uploaded['count'] + 2)
+
+    def test_follow_waits_for_appended_rows(self):
+        uploaded = self.upload()
+        file_id = uploaded['file_id']
+        cursor = uploaded['count']
+
+        empty = self.post(action='follow_logs', file_id=file_id, cursor=cursor, timeout='0.05').json()
+        self.assertEqual((empty['logs'], empty['cursor']), ([], cursor))
+
+        def append_later():
+            time.sleep(0.1)
+            Client().post('/api/upload/', {'action': 'append_logs', 'file_id': file_id, 'session_id': self.session_id,
+                                           'data': '{"@level":"warn","@message":"late line"}\n'})
+        thread = threading.Thread(target=append_later)
+        thread.start()
+        self.addCleanup(thread.join)
+
+        start = time.monotonic()
+        body = self.post(action='follow_logs', file_id=file_id, cursor=cursor, timeout='5', fields='level,message').json()
+        self.assertLess(time.monotonic() - start, 4)
+        self.assertEqual(body['logs'], [{'level': 'warn', 'message': 'late line'}])
+        thread.join()
+
+        with override_settings(FOLLOW_STREAM_SECONDS=0.2):
+            response = self.client.get('/api/logs/follow/', {
+                'file_id': file_id, 'session_id': self.session_id, 'fields': 'message',
+            }, HTTP_LAST_EVENT_ID=str(cursor - 1))
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            events = b''.join(response.streaming_content).decode().strip().split('\n\n')
+        event_id, event, data = events[0].split('\n')
+        self.assertEqual((event_id, event), (f'id: {cursor + 1}', 'event: logs'))
+        self.assertEqual([log['message'] for log in json.loads(data[len('data: '):])['logs']][-1], 'late line')
+
+        # Неверные параметры - ошибка в JSON, а не необработанное исключение
+        response = self.client.get('/api/logs/follow/', {'file_id': file_id, 'session_id': self.session_id},
+                                   HTTP_LAST_EVENT_ID='latest')
+        self.assertEqual((response.status_code, response.json()['status']), (400, 'error'))
+        self.assertEqual(self.post(action='get_logs', file_id=file_id, page_size='many').json()['status'], 'error')
+
+    async def test_asgi_path_matches_sync_path(self):
+        with open(SAMPLE_LOG, 'rb') as f:
+            upload = SimpleUploadedFile('plan.json', f.read())
+        response = await self.async_client.post('/api/upload/', {'log_file': upload, 'session_id': self.session_id})
+        self.assertEqual(response.status_code, 200)
+        file_id = response.json()['file_id']
+        job = await asyncio.to_thread(self.wait_for_job, file_id)
+        self.assertEqual(job['status'], 'done')
+
+        params = {'action': 'get_logs', 'file_id': file_id, 'session_id': self.session_id, 'level': 'trace', 'page_size': 50}
+        response = await self.async_client.post('/api/upload/', params)
+        self.assertIn('Server-Timing', response)
+        expected = await asyncio.to_thread(self.post, **params)
+        self.assertEqual(response.json(), expected.json())
+
+        # Под ASGI поток NDJSON отдаётся асинхронно, а не собирается в память
+        response = await self.async_client.post('/api/upload/', dict(params, format='ndjson'))
+        self.assertTrue(response.is_async)
+        lines = b''.join([chunk async for chunk in response.streaming_content]).splitlines()
+        self.assertEqual([json.loads(line) for line in lines[1:]], expected.json()['logs'])
+
+        body = (await self.async_client.post('/api/upload/', {'action': 'get_json_bodies', 'file_id': file_id, 'session_id': self.session_id})).json()
+        self.assertEqual(body, (await asyncio.to_thread(self.post, action='get_json_bodies', file_id=file_id)).json())
+
+    async def asgi_upload(self, filename, content):
+        """Загрузка через обработчик из asgi.py без хвоста тела: возвращает задачу запроса, очередь receive,
+        отправленные клиенту сообщения, LogUpload и неотправленный хвост, когда разбор уже идёт"""
+        body = encode_multipart(BOUNDARY, {'log_file': SimpleUploadedFile(filename, content), 'session_id': self.session_id})
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST', 'scheme': 'http',
+            'path': '/api/upload/', 'raw_path': b'/api/upload/', 'query_string': b'', 'root_path': '',
+            'headers': [(b'content-type', MULTIPART_CONTENT.encode()), (b'content-length', str(len(body)).encode())],
+            'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+        }
+        messages = asyncio.Queue()
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        request = asyncio.create_task(StreamingASGIHandler()(scope, messages.get, send))
+        self.addCleanup(request.cancel)
+        head = body[:-16 * 1024]
+        for start in range(0, len(head), 64 * 1024):
+            await messages.put({'type': 'http.request', 'body': head[start:start + 64 * 1024], 'more_body': True})
+
+        jobs = sys.modules[self.views.LogUpload.__module__].UPLOAD_JOBS
+        deadline = time.monotonic() + 5
+        while True:
+            upload = next((job for job in list(jobs.values()) if job.name == filename), None)
+            if upload is not None and upload.entries or time.monotonic() > deadline:
+                break
+            await asyncio.sleep(0.01)
+        self.assertIsNotNone(upload)
+        return request, messages, sent, upload, body[len(head):]
+
+    async def test_asgi_upload_is_parsed_while_body_streams(self):
+        with open(SAMPLE_LOG, 'rb') as f:
+            content = f.read()
+        request, messages, sent, upload, tail = await self.asgi_upload('streamed.json', content)
+        # Хвост запроса ещё не отправлен, а записи уже разобраны
+        self.assertFalse(upload.received_all)
+        self.assertGreater(upload.entries, 0)
+
+        await messages.put({'type': 'http.request', 'body': tail, 'more_body': False})
+        await asyncio.wait_for(request, 10)
+        self.assertEqual(sent[0]['status'], 200)
+        uploaded = json.loads(b''.join(message.get('body', b'') for message in sent[1:]))
+        self.assertEqual(uploaded['file_id'], upload.file_id)
+
+        job = await asyncio.to_thread(self.wait_for_job, upload.file_id)
+        expected = TerraformLogParser().parse_file(SAMPLE_LOG)
+        self.assertEqual((job['status'], job['entries']), ('done', expected['count']))
+
+    async def test_asgi_upload_is_cancelled_when_client_disconnects(self):
+        with open(SAMPLE_LOG, 'rb') as f:
+            content = f.read()
+        request, messages, sent, upload, tail = await self.asgi_upload('dropped.json', content)
+
+        await messages.put({'type': 'http.disconnect'})
+        await asyncio.wait_for(request, 10)
+        self.assertEqual(sent, [])
+        self.assertTrue(await asyncio.to_thread(upload.done.wait, 5))
+        self.assertEqual(upload.status, 'error')
+        self.assertFalse(os.path.exists(upload.source_path))
+
+    async def test_asgi_follow_waits_without_thread(self):
+        uploaded = await asyncio.to_thread(self.upload)
+        file_id, cursor = uploaded['file_id'], uploaded['count']
+
+        async def append_later():
+            await asyncio.sleep(0.1)
+            await self.async_client.post('/api/upload/', {
+                'action': 'append_logs', 'file_id': file_id, 'session_id': self.session_id, 'data': 'late raw line\n',
+            })
+
+        # Пул быстрых запросов из одного потока: ожидающий long-poll его не занимает, и append проходит
+        with mock.patch.object(self.views, 'PAGE_EXECUTOR', ThreadPoolExecutor(max_workers=1)):
+            poll = self.async_client.post('/api/upload/', {
+                'action': 'follow_logs', 'file_id': file_id, 'session_id': self.session_id,
+                'cursor': cursor, 'timeout': '5', 'fields': 'message',
+            })
+            response, _ = await asyncio.gather(poll, append_later())
+        self.assertEqual(response.json()['logs'], [{'message': 'late raw line'}])
+
+        with override_settings(FOLLOW_STREAM_SECONDS=0.2):
+            response = await self.async_client.get('/api/logs/follow/', {
+                'file_id': file_id, 'session_id': self.session_id, 'cursor': cursor, 'fields': 'message',
+            })
+            self.assertTrue(response.is_async)
+            events = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertTrue(events.startswith(f'id: {cursor + 1}\nevent: logs\n'))
+        self.assertIn('late raw line', events)
+
+    def test_migrates_parsed_json_files(self):
+        result = TerraformLogParser().parse_file(SAMPLE_LOG)
+        with open(os.path.join(settings.LOG_STORAGE_DIR, 'old_parsed.json'), 'w') as f:
+            json.dump({'metadata': {'original_filename': 'old.json', 'session_id': self.session_id},
+                       'parsed_data': result}, f, indent=2)
+
+        self.assertEqual(self.views.convert_parsed_json_files(), 1)
+        self.assertEqual(os.listdir(settings.LOG_STORAGE_DIR), ['old_parsed.tflog'])
+
+        body = self.post(action='get_logs', file_id='old', level='debug', page_size=1000).json()
+        self.assertEqual(body['current_file'], 'old.json')
+        self.assertEqual(body['logs'], [
+            dict(log, has_json_bodies=bool(body_flags_of(log['raw_data'])))
+            for log in reference_filters(result['logs'], {'level': 'debug'})
+        ])
+
+    def test_raw_data_and_bodies_are_read_from_source_log(self):
+        uploaded = self.upload()
+        logs = TerraformLogParser().parse_file(SAMPLE_LOG)['logs']
+        with_body = next(log for log in logs if 'tf_http_res_body' in log['raw_data'])
+
+        store = self.views.DATA_STORAGE.get(uploaded['file_id'])['logs']
+        self.assertIsNotNone(store.source)
+        self.assertEqual(store.raw_data, [])
+
+        body = self.post(action='get_logs', file_id=uploaded['file_id'], body_filter='has_res_body').json()
+        self.assertEqual(body['logs'][0]['raw_data'], with_body['raw_data'])
+        self.assertTrue(body['logs'][0]['has_json_bodies'])
+
+        # После перезапуска тела читаются из исходного лога рядом с разобранным файлом
+        self.views.DATA_STORAGE.clear()
+        body = self.post(action='get_json_bodies', file_id=uploaded['file_id'], log_id=with_body['id']).json()
+        self.assertEqual(body['json_bodies'], {'tf_http_res_body': with_body['raw_data']['tf_http_res_body']})
+
+    def test_pages_reuse_cached_filter_result(self):
+        uploaded = self.upload()
+        before = self.views.RESULT_CACHE.stats()
+
+        for page in (1, 2, 3):
+            self.post(action='get_logs', file_id=uploaded['file_id'], level='trace', search_text='Provider', page=page)
+        self.post(action='get_logs', file_id=uploaded['file_id'], level='trace', search_text='PROVIDER', component='all')
+
+        stats = self.post(action='get_cache_stats').json()
+        self.assertEqual(stats['misses'] - before['misses'], 1)
+        self.assertEqual(stats['hits'] - before['hits'], 3)
+
+        self.post(action='clear_data', file_id=uploaded['file_id'])
+        self.assertEqual(self.views.RESULT_CACHE.stats()['entries'], 0)
+
+    def test_server_timing_and_metrics_endpoint(self):
+        uploaded = self.upload()
+
+        response = self.post(action='get_logs', file_id=uploaded['file_id'], level='trace')
+        stages = dict(part.split(';dur=') for part in response['Server-Timing'].split(', '))
+        self.assertLessEqual({'filter', 'rows', 'serialize', 'total'}, set(stages))
+        self.assertTrue(all(float(duration) >= 0 for duration in stages.values()))
+
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        for stage in ('decode', 'bodies', 'classify', 'statistics', 'persist', 'filter', 'serialize', 'request'):
+            self.assertIn(f'tflog_stage_seconds_count{{stage="{stage}"}}', text)
+        self.assertIn('tflog_stage_seconds_bucket{stage="filter",le="+Inf"}', text)
+        self.assertRegex(text, r'tflog_parsed_lines_total [1-9]')
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_metrics_switched_off(self):
+        uploaded = self.upload()
+        response = self.post(action='get_logs', file_id=uploaded['file_id'], level='trace')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 404)
+
+    def test_statistics_follow_filters(self):
+        uploaded = self.upload()
+        logs = TerraformLogParser().parse_file(SAMPLE_LOG)['logs']
+
+        statistics = self.post(action='get_statistics', file_id=uploaded['file_id']).json()['statistics']
+        self.assertEqual({key: statistics[key] for key in uploaded['statistics']}, uploaded['statistics'])
+
+        params = {'level': 'trace', 'search_text': 'provider'}
+        self.post(action='get_logs', file_id=uploaded['file_id'], **params)
+        hits = self.views.RESULT_CACHE.stats()['hits']
+        statistics = self.post(action='get_statistics', file_id=uploaded['file_id'], **params).json()['statistics']
+        # Строки фильтра взяты из кэша страниц
+        self.assertEqual(self.views.RESULT_CACHE.stats()['hits'], hits + 1)
+
+        expected = reference_filters(logs, params)
+        self.assertEqual(statistics['total_entries'], len(expected))
+        self.assertEqual(statistics['by_level'], {'trace': len(expected)})
+        rpc_counts = {}
+        for log in expected:
+            if log['tf_rpc']:
+                rpc_counts[log['tf_rpc']] = rpc_counts.get(log['tf_rpc'], 0) + 1
+        self.assertTrue(rpc_counts)
+        self.assertEqual(statistics['by_rpc'], rpc_counts)
+
+        response = self.post(action='get_statistics', file_id=uploaded['file_id'], session_id='intruder')
+        self.assertEqual(response.status_code, 403)
+
+    def test_request_traces(self):
+        uploaded = self.upload()
+        logs = TerraformLogParser().parse_file(SAMPLE_LOG)['logs']
+        by_request = {}
+        for log in logs:
+            if log['tf_req_id']:
+                by_request.setdefault(log['tf_req_id'], []).append(log)
+
+        body = self.post(action='get_requests', file_id=uploaded['file_id'], limit=3).json()
+        self.assertEqual(body['total_requests'], len(by_request))
+        self.assertEqual(len(body['requests']), min(3, len(by_request)))
+        durations = {
+            req_id: (max(log['timestamp_ns'] for log in entries) - min(log['timestamp_ns'] for log in entries)) / 1e6
+            for req_id, entries in by_request.items()
+        }
+        slowest = body['requests'][0]
+        self.assertEqual(slowest['duration_ms'], max(durations.values()))
+        self.assertEqual(slowest['entries'], len(by_request[slowest['req_id']]))
+        self.assertEqual(slowest['tf_rpc'], next(log['tf_rpc'] for log in by_request[slowest['req_id']] if log['tf_rpc']))
+
+        body = self.post(action='get_requests', file_id=uploaded['file_id'], req_id=slowest['req_id']).json()
+        entries = by_request[slowest['req_id']]
+        self.assertEqual([step['id'] for step in body['waterfall']], [log['id'] for log in entries])
+        self.assertEqual(body['waterfall'][0]['offset_ms'], 0)
+        self.assertEqual(body['waterfall'][-1]['offset_ms'], slowest['duration_ms'])
+
+        self.assertEqual(self.post(action='get_requests', file_id=uploaded['file_id'], req_id='missing').status_code, 404)
+        self.assertEqual(self.post(action='get_requests', file_id=uploaded['file_id'], sort='bogus').status_code, 400)
+
+    def test_session_search_merges_files_by_time(self):
+        first = self.upload()
+        second = self.upload()
+        logs = TerraformLogParser().parse_file(SAMPLE_LOG)['logs']
+        params = {'level': 'info'}
+        expected = reference_filters(logs, params)
+        self.assertTrue(expected)
+
+        response = self.post(action='search_session', page_size=5, **params)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+        files = {line['file_id']: line['count'] for line in lines if line['type'] == 'file'}
+        self.assertEqual(files, {first['file_id']: len(expected), second['file_id']: len(expected)})
+        result = lines[-1]
+        self.assertEqual(result['type'], 'result')
+        self.assertEqual(result['counts'], files)
+        self.assertEqual(result['total_count'], 2 * len(expected))
+
+        # Одинаковые файлы: каждая запись встречается дважды подряд, по времени
+        merged = sorted(
+            ((log['timestamp_ns'], log['line_number'], file_id) for log in expected
+             for file_id in sorted((first['file_id'], second['file_id']))),
+        )[:5]
+        self.assertEqual(
+            [(log['timestamp_ns'], log['line_number'], log['file_id']) for log in result['logs']], merged
+        )
+
+        # Чужой файл не загружается в память, даже если перечислен явно
+        self.views.DATA_STORAGE.clear()
+        other = self.post(action='search_session', session_id='intruder', file_ids=first['file_id'], **params)
+        lines = [json.loads(line) for line in b''.join(other.streaming_content).splitlines()]
+        self.assertEqual(lines, [{
+            'type': 'result', 'logs': [], 'counts': {}, 'total_count': 0,
+            'page': 1, 'page_size': 100, 'total_pages': 0,
+        }])
+        self.assertNotIn(first['file_id'], self.views.DATA_STORAGE)
+        self.assertEqual(self.post(action='search_session', page='first').json()['status'], 'error')
+
+    def test_session_search_puts_untimed_rows_last(self):
+        content = (
+            b'untimed marker\n'
+            b'{"@level":"info","@message":"marker late","@timestamp":"2025-09-09T15:31:33+03:00"}\n'
+            b'{"@level":"info","@message":"marker early","@timestamp":"2025-09-09T15:31:32+03:00"}\n'
+        )
+        response = self.post(log_file=SimpleUploadedFile('marker.log', content))
+        self.assertEqual(self.wait_for_job(response.json()['job_id'])['status'], 'done')
+
+        response = self.post(action='search_session', search_text='marker')
+        result = json.loads(b''.join(response.streaming_content).splitlines()[-1])
+        self.assertEqual([log['message'] for log in result['logs']], ['marker early', 'marker late', 'untimed marker'])
+
+    def test_other_session_is_denied(self):
+        uploaded = self.upload()
+        response = self.post(action='get_logs', file_id=uploaded['file_id'], session_id='intruder')
+        self.assertEqual(response.status_code, 403)
+
+    def test_evicted_file_is_reloaded_on_access(self):
+        with mock.patch.object(self.views, 'DATA_STORAGE', LogStorage(max_bytes=1)):
+            first = self.upload()
+            second = self.upload(extra=b'\n')
+
+            stats = self.post(action='get_storage_stats').json()
+            self.assertEqual((stats['files'], stats['resident_files'], stats['evictions']), (2, 1, 1))
+
+            body = self.post(action='get_logs', file_id=first['file_id'], level='debug', page_size=5).json()
+            self.assertEqual(body['total_count'], first['statistics']['by_level']['debug'])
+            self.assertEqual(body['current_file'], 'plan.json')
+
+            stats = self.post(action='get_storage_stats').json()
+            self.assertEqual((stats['resident_files'], stats['evictions'], stats['loads']), (1, 2, 1))
+
+            # Выгруженный файл тоже удаляется при очистке сессии
+            self.post(action='clear_data')
+            self.assertEqual(len(self.views.DATA_STORAGE), 0)
+            self.assertFalse(os.listdir(settings.LOG_STORAGE_DIR))
+
+    def test_changes_from_other_workers_are_seen(self):
+        uploaded = self.upload()
+        file_id = uploaded['file_id']
+        debug_count = uploaded['statistics']['by_level']['debug']
+        parsed_path = os.path.join(settings.LOG_STORAGE_DIR, f'{file_id}_parsed.tflog')
+        source_path = os.path.join(settings.LOG_STORAGE_DIR, f'{file_id}_source.log')
+
+        # Как в другом воркере: файл открывается с диска, столбцы отображаются из него без разбора
+        self.views.DATA_STORAGE.clear()
+        self.assertEqual(self.post(action='get_logs', file_id=file_id, level='debug').json()['total_count'], debug_count)
+        self.assertTrue(self.views.DATA_STORAGE.get(file_id)['logs'].mapped)
+
+        # Другой воркер дописал строку в исходный лог
+        with open(source_path, 'ab') as f:
+            f.write(b'{"@level":"debug","@message":"from another worker"}\n')
+        body = self.post(action='get_logs', file_id=file_id, level='debug', page_size=1000).json()
+        self.assertEqual(body['total_count'], debug_count + 1)
+        self.assertEqual(body['logs'][-1]['message'], 'from another worker')
+
+        # Другой воркер удалил файл: копия этого процесса отбрасывается
+        os.remove(parsed_path)
+        os.remove(source_path)
+        LogFile.objects.filter(file_id=file_id).delete()
+        self.assertEqual(self.post(action='get_logs', file_id=file_id, level='debug').json()['total_count'], 0)
+        self.assertNotIn(file_id, self.views.DATA_STORAGE)
+
+    def test_identical_upload_reuses_parsed_file(self):
+        first = self.upload()
+        stored_files = sorted(os.listdir(settings.LOG_STORAGE_DIR))
+
+        with open(SAMPLE_LOG, 'rb') as f:
+            response = self.post(log_file=SimpleUploadedFile('again.json', f.read()), session_id='other')
+        second = response.json()
+        # Лог не разбирается заново: в ответе уже итог, новых файлов на диске нет
+        self.assertTrue(second['deduplicated'])
+        self.assertFalse(second['provisional'])
+        self.assertNotEqual(second['file_id'], first['file_id'])
+        self.assertEqual((second['job']['status'], second['count'], second['statistics']),
+                         ('done', first['count'], first['statistics']))
+        job = self.post(action='get_job_status', job_id=second['file_id'], session_id='other').json()
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(sorted(os.listdir(settings.LOG_STORAGE_DIR)), stored_files)
+
+        # Сессия и имя у каждой загрузки свои
+        body = self.post(action='get_logs', file_id=second['file_id'], session_id='other').json()
+        self.assertEqual((body['total_count'], body['current_file']), (first['count'], 'again.json'))
+        body = self.post(action='get_logs', file_id=second['file_id'], session_id='other', level='debug').json()
+        self.assertEqual(body['total_count'], first['statistics']['by_level']['debug'])
+        self.assertEqual(self.post(action='get_logs', file_id=second['file_id']).status_code, 403)
+        files = self.post(action='list_files', session_id='other').json()['files']
+        self.assertEqual([(file['file_id'], file['filename']) for file in files], [(second['file_id'], 'again.json')])
+
+        # Общий разбор удаляется с диска вместе с последней ссылкой на него
+        self.post(action='clear_data')
+        self.assertEqual(sorted(os.listdir(settings.LOG_STORAGE_DIR)), stored_files)
+        self.views.DATA_STORAGE.clear()
+        body = self.post(action='get_logs', file_id=second['file_id'], session_id='other', level='debug').json()
+        self.assertEqual(body['total_count'], first['statistics']['by_level']['debug'])
+        self.post(action='clear_data', session_id='other')
+        self.assertFalse(os.listdir(settings.LOG_STORAGE_DIR))
+
+    def test_append_to_shared_upload_copies_it(self):
+        first = self.upload()
+        second = self.upload()
+        self.assertTrue(second['deduplicated'])
+
+        response = self.post(action='append_logs', file_id=second['file_id'], eof='1',
+                             data='{"@level":"debug","@message":"appended"}\n')
+        self.assertEqual(response.json()['total_count'], first['count'] + 1)
+
+        # Дописан только второй файл; он больше не совпадает с загрузкой, а первый - совпадает
+        self.views.DATA_STORAGE.clear()
+        self.assertEqual(self.post(action='get_logs', file_id=first['file_id']).json()['total_count'], first['count'])
+        self.assertEqual(self.post(action='get_logs', file_id=second['file_id']).json()['total_count'], first['count'] + 1)
+        entry = catalog.lookup(second['file_id'])
+        self.assertEqual(entry.content_hash, '')
+        self.assertNotEqual(entry.file_name, f"{first['file_id']}_parsed.tflog")
+
+        third = self.upload()
+        self.assertTrue(third['deduplicated'])
+        self.assertEqual(catalog.lookup(third['file_id']).file_name, f"{first['file_id']}_parsed.tflog")
+
+    def test_append_to_original_of_shared_upload_copies_it(self):
+        first = self.upload()
+        second = self.upload()
+        self.assertTrue(second['deduplicated'])
+        self.assertEqual(self.post(action='get_logs', file_id=second['file_id']).json()['total_count'], first['count'])
+
+        # Дописывает первая загрузка: общие файлы носят её file_id, но остаются у второй
+        response = self.post(action='append_logs', file_id=first['file_id'], eof='1',
+                             data='{"@level":"debug","@message":"appended"}\n')
+        self.assertEqual(response.json()['total_count'], first['count'] + 1)
+        self.assertEqual(self.post(action='get_logs', file_id=second['file_id']).json()['total_count'], first['count'])
+
+        self.views.DATA_STORAGE.clear()
+        self.assertEqual(self.post(action='get_logs', file_id=first['file_id']).json()['total_count'], first['count'] + 1)
+        self.assertEqual(self.post(action='get_logs', file_id=second['file_id']).json()['total_count'], first['count'])
+        self.assertEqual(catalog.lookup(second['file_id']).file_name, f"{first['file_id']}_parsed.tflog")
+
+        # Каждая копия удаляется со своей записью
+        self.post(action='clear_data', file_id=first['file_id'])
+        self.assertEqual(self.post(action='get_logs', file_id=second['file_id']).json()['total_count'], first['count'])
+        self.post(action='clear_data')
+        self.assertFalse(os.listdir(settings.LOG_STORAGE_DIR))
+
+    def test_catalog_lists_session_files_after_restart(self):
+        uploaded = self.upload()
+        # Перезапуск процесса: в памяти файлов нет, о них знает только каталог
+        self.views.DATA_STORAGE.clear()
+
+        files = self.post(action='list_files').json()['files']
+        self.assertEqual([(file['file_id'], file['filename'], file['line_count']) for file in files],
+                         [(uploaded['file_id'], 'plan.json', uploaded['count'])])
+        self.assertEqual(files[0]['statistics'], uploaded['statistics'])
+        self.assertEqual(self.post(action='list_files', session_id='other').json()['files'], [])
+
+        response = self.post(action='search_session', level='debug')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(lines[-1]['total_count'], uploaded['statistics']['by_level']['debug'])
+
+        self.views.DATA_STORAGE.clear()
+        self.post(action='clear_data')
+        self.assertEqual(self.post(action='list_files').json()['files'], [])
+        self.assertFalse(os.listdir(settings.LOG_STORAGE_DIR))
+
+    def test_cleanup_and_backfill_use_catalog(self):
+        old = self.upload()
+        new = self.upload(extra=b'\n')
+        LogFile.objects.filter(file_id=old['file_id']).update(created_at=timezone.now() - timedelta(days=2))
+        self.views.DATA_STORAGE.clear()
+
+        self.assertEqual(self.views.cleanup_old_data(max_age_hours=24), 2)
+        self.assertEqual(sorted(os.listdir(settings.LOG_STORAGE_DIR)), sorted([
+            f"{new['file_id']}_parsed.tflog", f"{new['file_id']}_source.log",
+        ]))
+        self.assertEqual(list(LogFile.objects.values_list('file_id', flat=True)), [new['file_id']])
+
+        # Файлы, сохранённые до каталога, заносятся в него один раз
+        LogFile.objects.all().delete()
+        self.assertEqual(catalog.index_storage_dir(), 1)
+        self.assertEqual(catalog.index_storage_dir(), 0)
+        entry = catalog.lookup(new['file_id'])
+        self.assertEqual((entry.session_id, entry.line_count), (self.session_id, new['count']))
+        self.assertEqual(entry.source_path, os.path.join(settings.LOG_STORAGE_DIR, f"{new['file_id']}_source.log"))
+
+    def test_cleanup_sweeps_orphaned_files(self):
+        kept = self.upload()
+        old_time = time.time() - 2 * 24 * 3600
+        orphans = ['dead_parsed.tflog.tmp', 'dead_source.log', 'legacy_plan.json']
+        for filename in orphans + ['fresh_parsed.tflog.tmp']:
+            with open(os.path.join(settings.LOG_STORAGE_DIR, filename), 'w') as f:
+                f.write('x')
+        # Старые по времени изменения, но известные каталогу файлы остаются
+        for filename in orphans + [f"{kept['file_id']}_parsed.tflog", f"{kept['file_id']}_source.log"]:
+            os.utime(os.path.join(settings.LOG_STORAGE_DIR, filename), (old_time, old_time))
+        self.views.DATA_STORAGE.clear()
+
+        self.assertEqual(self.views.cleanup_old_data(max_age_hours=24), 3)
+        self.assertEqual(sorted(os.listdir(settings.LOG_STORAGE_DIR)), sorted([
+            'fresh_parsed.tflog.tmp', f"{kept['file_id']}_parsed.tflog", f"{kept['file_id']}_source.log",
+        ]))
+        self.assertEqual(self.post(action='get_logs', file_id=kept['file_id']).json()['total_count'], kept['count'])
+
+
+class LogStorageTests(SimpleTestCase):
+    def make_file_data(self, rows):
+        logs = TerraformLogParser().parse_file(SAMPLE_LOG)['logs'][:rows]
+        return {'logs': ColumnarLogStore.from_result({'logs': logs}), 'session_id': 's', 'timestamp': 0}
+
+    def test_evicts_least_recently_used_logs_but_keeps_metadata(self):
+        small = self.make_file_data(10)
+        storage = LogStorage(max_bytes=small['logs'].nbytes() * 2 + 1)
+        storage.put('a', small)
+        storage.put('b', self.make_file_data(10))
+        self.assertIsNotNone(storage.get('a'))
+
+        storage.put('c', self.make_file_data(10))
+        self.assertIsNone(storage.get('b'))
+        self.assertEqual(storage.metadata('b'), {'session_id': 's', 'timestamp': 0})
+        self.assertIs(storage.get('a'), small)
+        self.assertLessEqual(storage.stats()['bytes'], storage.max_bytes)
+
+    def test_concurrent_reloads_share_one_load(self):
+        storage = LogStorage(max_bytes=1 << 30)
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def loader():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return self.make_file_data(10)
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(storage.get('a', loader))) for _ in range(4)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 4)
+        self.assertTrue(all(result is results[0] for result in results))
+
+    def test_file_removed_during_reload_is_not_cached(self):
+        storage = LogStorage(max_bytes=1 << 30)
+        started = threading.Event()
+        release = threading.Event()
+
+        def loader():
+            started.set()
+            release.wait(5)
+            return self.make_file_data(10)
+
+        results = []
+        thread = threading.Thread(target=lambda: results.append(storage.get('a', loader)))
+        thread.start()
+        started.wait(5)
+        # Файл удалён (очистка сессии), пока другой запрос загружал его с диска
+        storage.pop('a')
+        release.set()
+        thread.join(5)
+
+        self.assertIsNotNone(results[0])
+        self.assertNotIn('a', storage)
+        self.assertEqual(storage.stats()['loads'], 0)
+        # Следующая загрузка снова кэшируется
+        self.assertIsNotNone(storage.get('a', lambda: self.make_file_data(10)))
+        self.assertIn('a', storage)
+
+
+class FilterResultCacheTests(SimpleTestCase):
+    def test_evicts_least_recently_used_within_budget(self):
+        cache = FilterResultCache(max_bytes=2 * FilterResultCache.entry_size(array('I', range(100))))
+        cache.put(('a', 1), range(100))
+        cache.put(('b', 1), range(100))
+        self.assertIsNotNone(cache.get(('a', 1)))
+
+        cache.put(('c', 1), range(100))
+        self.assertIsNone(cache.get(('b', 1)))
+        self.assertEqual(list(cache.get(('a', 1))), list(range(100)))
+        self.assertLessEqual(cache.stats()['bytes'], cache.max_bytes)
+
+        cache.invalidate('a')
+        self.assertIsNone(cache.get(('a', 1)))
+        self.assertEqual(cache.stats()['entries'], 1)
+
+    def test_oversized_result_is_not_cached(self):
+        cache = FilterResultCache(max_bytes=1024)
+        rows = cache.put(('a', 1), range(10000))
+        self.assertEqual(len(rows), 10000)
+        self.assertEqual(cache.stats()['entries'], 0)
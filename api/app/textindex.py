@@ -0,0 +1,95 @@
+import re
+import threading
+from array import array
+
+# Строки индексируются блоками по 2**BLOCK_BITS: индекс хранит номера блоков,
+# а не строк, поэтому он в разы меньше самого текста.
+BLOCK_BITS = 6
+
+# Индексируются только триграммы внутри слов (\w+): любые три подряд идущих
+# словесных символа запроса лежат внутри одного слова текста, а повторяющиеся
+# в блоке ключи и значения разбираются на триграммы один раз.
+_WORDS = re.compile(r'\w{3,}')
+
+# Примерный размер ключа-триграммы, массива и слота словаря для новой триграммы
+POSTING_OVERHEAD_BYTES = 200
+
+
+def trigrams(text):
+    grams = set()
+    for word in set(_WORDS.findall(text)):
+        grams.update(word[start:start + 3] for start in range(len(word) - 2))
+    return grams
+
+
+class TrigramIndex:
+    """Триграммный индекс для поиска подстроки без учёта регистра.
+
+    text_of(row) возвращает текст строки в нижнем регистре (или None, если
+    строка в поиске не участвует). Индекс только сужает кандидатов: каждая
+    найденная строка проверяется обычным ``query in text``, поэтому результат
+    совпадает с полным перебором.
+    """
+
+    def __init__(self, text_of):
+        self.text_of = text_of
+        self.postings = {}
+        self.size = 0
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def update(self, size):
+        """Дописывает в индекс строки с self.size до size"""
+        if self.size >= size:
+            return
+
+        with self.lock:
+            postings = self.postings
+            row = self.size
+            while row < size:
+                block = row >> BLOCK_BITS
+                end = min(size, (block + 1) << BLOCK_BITS)
+
+                texts = [self.text_of(current) for current in range(row, end)]
+                grams = trigrams('\n'.join(text for text in texts if text))
+
+                for gram in grams:
+                    posting = postings.get(gram)
+                    if posting is None:
+                        postings[gram] = array('I', (block,))
+                        self.bytes += POSTING_OVERHEAD_BYTES
+                    elif posting[-1] != block:
+                        posting.append(block)
+                        self.bytes += posting.itemsize
+
+                row = end
+            self.size = size
+
+    def candidate_blocks(self, query):
+        """Блоки, где встречаются все триграммы запроса; None - если сузить поиск нечем"""
+        grams = trigrams(query)
+        if not grams:
+            return None
+
+        postings = sorted((self.postings.get(gram, ()) for gram in grams), key=len)
+        blocks = set(postings[0])
+        for posting in postings[1:]:
+            if not blocks:
+                break
+            blocks.intersection_update(posting)
+        return blocks
+
+    def search(self, query, rows):
+        """Оставляет из rows строки, текст которых содержит query (уже в нижнем регистре)"""
+        blocks = self.candidate_blocks(query)
+        text_of = self.text_of
+
+        if blocks is not None:
+            rows = [row for row in rows if row >> BLOCK_BITS in blocks]
+
+        matched = []
+        for row in rows:
+            text = text_of(row)
+            if text and query in text:
+                matched.append(row)
+        return matched
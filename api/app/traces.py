@@ -0,0 +1,152 @@
+import threading
+from array import array
+
+# Отметки «нет времени» и «нет значения» в массивах сводки
+NO_TIME = -(1 << 63)
+NO_VALUE = -1
+
+# Порядок, в котором get_requests отдаёт запросы
+RANKINGS = ('duration', 'errors', 'entries')
+
+
+class RequestIndex:
+    """Сводка по запросам (tf_req_id) одного лога.
+
+    Для каждого кода значения tf_req_id хранятся время первой и последней
+    записи, число ошибок и первые непустые tf_rpc и tf_resource_type; строки
+    запроса берутся из хеш-индекса столбца tf_req_id. Индекс дописывается по
+    мере добавления строк, поэтому ответы не зависят от размера файла: список
+    запросов - от числа запросов, разбивка одного запроса - от числа его строк.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.size = 0
+        self.first_ns = array('q')
+        self.last_ns = array('q')
+        self.errors = array('q')
+        self.rpc = array('q')
+        self.resource_type = array('q')
+        # Отсортированные коды запросов по каждому из RANKINGS, до следующего update
+        self.rankings = {}
+        self.lock = threading.Lock()
+
+    @property
+    def bytes(self):
+        return 8 * 5 * len(self.first_ns) + sum(4 * len(codes) for codes in self.rankings.values())
+
+    def update(self, size):
+        """Дописывает в сводку строки с self.size до size"""
+        if self.size >= size:
+            return
+
+        with self.lock:
+            store = self.store
+            columns = store.columns
+            requests = columns['tf_req_id'].data
+            levels, level_values = columns['level'].data, columns['level'].values
+            rpcs, rpc_values = columns['tf_rpc'].data, columns['tf_rpc'].values
+            resources, resource_values = columns['tf_resource_type'].data, columns['tf_resource_type'].values
+
+            for row in range(self.size, size):
+                code = requests[row]
+                while len(self.first_ns) <= code:
+                    self.first_ns.append(NO_TIME)
+                    self.last_ns.append(NO_TIME)
+                    self.errors.append(0)
+                    self.rpc.append(NO_VALUE)
+                    self.resource_type.append(NO_VALUE)
+
+                ns = store.timestamp_ns(row)
+                if ns is not None:
+                    if self.first_ns[code] == NO_TIME or ns < self.first_ns[code]:
+                        self.first_ns[code] = ns
+                    if ns > self.last_ns[code]:
+                        self.last_ns[code] = ns
+                if level_values[levels[row]] == 'error':
+                    self.errors[code] += 1
+                if self.rpc[code] == NO_VALUE and rpc_values[rpcs[row]]:
+                    self.rpc[code] = rpcs[row]
+                if self.resource_type[code] == NO_VALUE and resource_values[resources[row]]:
+                    self.resource_type[code] = resources[row]
+
+            self.size = size
+            self.rankings = {}
+
+    def code(self, req_id):
+        code = self.store.columns['tf_req_id'].codes.get(req_id)
+        if code is None or code >= len(self.first_ns):
+            return None
+        return code
+
+    def duration_ns(self, code):
+        if self.first_ns[code] == NO_TIME:
+            return None
+        return self.last_ns[code] - self.first_ns[code]
+
+    def ranking(self, by):
+        """Коды запросов по убыванию длительности, числа ошибок или записей"""
+        codes = self.rankings.get(by)
+        if codes is None:
+            column = self.store.columns['tf_req_id']
+            key = {
+                'duration': lambda code: self.duration_ns(code) or 0,
+                'errors': self.errors.__getitem__,
+                'entries': lambda code: len(column.postings[code]),
+            }[by]
+            codes = [
+                code for code in range(len(self.first_ns))
+                if column.values[code] and len(column.postings[code])
+            ]
+            codes.sort(key=key, reverse=True)
+            codes = self.rankings[by] = array('I', codes)
+        return codes
+
+    def summary(self, code):
+        store = self.store
+        columns = store.columns
+        rows = columns['tf_req_id'].postings[code]
+        duration = self.duration_ns(code)
+        return {
+            'req_id': columns['tf_req_id'].values[code],
+            'entries': len(rows),
+            'first_row': rows[0],
+            'start': store.timestamp(rows[0]),
+            'end': store.timestamp(rows[-1]),
+            'start_ns': self.first_ns[code] if duration is not None else None,
+            'duration_ms': duration / 1e6 if duration is not None else None,
+            'errors': self.errors[code],
+            'tf_rpc': columns['tf_rpc'].values[self.rpc[code]] if self.rpc[code] != NO_VALUE else '',
+            'tf_resource_type': (
+                columns['tf_resource_type'].values[self.resource_type[code]]
+                if self.resource_type[code] != NO_VALUE else ''
+            ),
+        }
+
+    def top(self, by='duration', limit=50):
+        return [self.summary(code) for code in self.ranking(by)[:limit]]
+
+    def waterfall(self, code):
+        """Строки запроса по времени: смещение от начала запроса и длительность до следующей его строки"""
+        store = self.store
+        columns = store.columns
+        rows = store.sort_rows(list(columns['tf_req_id'].postings[code]))
+        start = self.first_ns[code]
+
+        steps = []
+        for index, row in enumerate(rows):
+            ns = store.timestamp_ns(row)
+            next_ns = store.timestamp_ns(rows[index + 1]) if index + 1 < len(rows) else None
+            timed = ns is not None and start != NO_TIME
+            steps.append({
+                'id': store.row_id(row),
+                'line_number': store.line_numbers[row],
+                'timestamp': store.timestamp(row),
+                'offset_ms': (ns - start) / 1e6 if timed else None,
+                'duration_ms': (next_ns - ns) / 1e6 if timed and next_ns is not None else None,
+                'level': columns['level'][row],
+                'component': columns['component'][row],
+                'message': store.messages[row],
+                'tf_rpc': columns['tf_rpc'][row],
+            })
+        return steps
@@ -0,0 +1,303 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+
+from .logfile import PARSED_SUFFIX, ParsedLogWriter
+from .parser import TerraformLogParser
+from .source import SOURCE_SUFFIX, SourceLog
+from .store import ColumnarLogStore
+
+UPLOAD_FIELD = 'log_file'
+
+# Сколько байт исходного лога фоновый разбор читает за раз
+READ_CHUNK_BYTES = 256 * 1024
+# Сколько разбор ждёт метаданных от представления или новых данных, прежде чем счесть загрузку брошенной
+METADATA_TIMEOUT = 60
+RECEIVE_TIMEOUT = 60
+
+PARSE_EXECUTOR = ThreadPoolExecutor(max_workers=settings.PARSE_JOB_WORKERS, thread_name_prefix='log-parse')
+
+# Загрузки по file_id (он же id задачи разбора)
+UPLOAD_JOBS = {}
+UPLOAD_JOBS_LOCK = threading.Lock()
+
+
+def get_job(job_id):
+    with UPLOAD_JOBS_LOCK:
+        return UPLOAD_JOBS.get(job_id)
+
+
+def active_job_ids():
+    with UPLOAD_JOBS_LOCK:
+        return set(UPLOAD_JOBS)
+
+
+def forget_job(job_id):
+    with UPLOAD_JOBS_LOCK:
+        return UPLOAD_JOBS.pop(job_id, None)
+
+
+class LogUpload:
+    """Загружаемый лог и фоновая задача его разбора.
+
+    Куски запроса сразу дописываются в исходный лог (он же источник
+    raw_data), а задача в PARSE_EXECUTOR читает этот файл вслед за записью
+    и разбирает его в ColumnarLogStore и ParsedLogWriter. Разбор идёт
+    одновременно с приёмом данных и продолжается после ответа на запрос;
+    уже разобранные строки доступны через store (под store.lock).
+
+    Файл разобранного лога пишется, когда разбор закончен и представление
+    передало метаданные (set_metadata). При ошибке заполняется error, а
+    файлы загрузки удаляются.
+
+    Куски хешируются по мере приёма: когда загрузка принята целиком,
+    content_hash позволяет найти уже разобранный лог с тем же содержимым,
+    и тогда загрузка отменяется (abandon).
+    """
+
+    def __init__(self, name, total_bytes=None):
+        self.name = name
+        self.total_bytes = total_bytes
+        self.file_id = str(uuid.uuid4())
+        self.source_path = os.path.join(settings.LOG_STORAGE_DIR, f"{self.file_id}{SOURCE_SUFFIX}")
+        self.file_path = os.path.join(settings.LOG_STORAGE_DIR, f"{self.file_id}{PARSED_SUFFIX}")
+
+        self.parser = TerraformLogParser()
+        source = SourceLog(self.source_path, self.parser.line_offsets, self.parser.line_lengths)
+        self.store = ColumnarLogStore(source)
+        self.writer = ParsedLogWriter(self.file_path, source=source)
+        self.source_file = open(self.source_path, 'wb')
+        self.hasher = hashlib.sha256()
+
+        self.status = 'receiving'
+        self.error = None
+        self.size = 0
+        self.received_all = False
+        self.processed_bytes = 0
+        self.lines = 0
+        self.entries = 0
+        self.statistics = self.parser.generate_statistics()
+        self.started = time.time()
+        self.finished = None
+        self.metadata = None
+        self.on_done = None
+        self.condition = threading.Condition()
+        self.metadata_ready = threading.Event()
+        self.done = threading.Event()
+
+        with UPLOAD_JOBS_LOCK:
+            UPLOAD_JOBS[self.file_id] = self
+        PARSE_EXECUTOR.submit(self.run)
+
+    def feed(self, chunk):
+        """Очередной кусок загрузки из потока запроса"""
+        if self.error is not None:
+            return
+        try:
+            self.source_file.write(chunk)
+            self.source_file.flush()
+        except ValueError:
+            # Файл уже закрыт фоновой задачей из-за ошибки разбора
+            return
+        self.hasher.update(chunk)
+        with self.condition:
+            self.size += len(chunk)
+            self.condition.notify_all()
+
+    def finish(self):
+        """Загрузка принята целиком"""
+        self.close()
+        with self.condition:
+            self.received_all = True
+            if self.status == 'receiving':
+                self.status = 'parsing'
+            self.condition.notify_all()
+
+    def set_metadata(self, metadata, on_done=None):
+        """Метаданные для заголовка файла; on_done(upload) вызывается по завершении или ошибке"""
+        with self.condition:
+            self.metadata = metadata
+            self.on_done = on_done
+            self.metadata_ready.set()
+            completed = self.finished is not None
+        if completed and on_done is not None:
+            on_done(self)
+
+    @property
+    def content_hash(self):
+        """SHA-256 загруженного лога; None, пока он принят не целиком или при ошибке"""
+        if not self.received_all or self.error is not None:
+            return None
+        return self.hasher.hexdigest()
+
+    def cancel(self, error):
+        if self.done.is_set():
+            return
+        self.fail(error)
+        self.finish()
+        # Разбор не ждёт метаданных, которых уже не будет
+        self.metadata_ready.set()
+
+    def abandon(self):
+        """Отменяет загрузку, которая не нужна (её содержимое уже разобрано): разбор останавливается, файлы удаляются"""
+        forget_job(self.file_id)
+        self.cancel(RuntimeError('Загрузка отменена'))
+        # Разбор мог закончиться раньше - тогда его файлы уже записаны
+        self.discard()
+
+    def run(self):
+        try:
+            with open(self.source_path, 'rb') as f:
+                while self.error is None:
+                    chunk = f.read(READ_CHUNK_BYTES)
+                    if chunk:
+                        self.parse(self.parser.feed, chunk)
+                        continue
+
+                    with self.condition:
+                        if self.processed_bytes >= self.size:
+                            if self.received_all:
+                                break
+                            if not self.condition.wait(RECEIVE_TIMEOUT) and self.size == self.processed_bytes:
+                                raise RuntimeError('Загрузка прервана: данные перестали поступать')
+
+            if self.error is None:
+                self.parse(self.parser.finish)
+                self.store.statistics = self.parser.generate_statistics()
+
+                if not self.metadata_ready.wait(METADATA_TIMEOUT):
+                    raise RuntimeError('Загрузка не была зарегистрирована')
+                if self.error is None:
+                    self.writer.close(self.metadata, self.store.statistics, columns=self.store)
+        except Exception as e:
+            self.fail(e)
+        finally:
+            self.complete()
+
+    def parse(self, step, *args):
+        store = self.store
+        with store.lock:
+            for entry in step(*args):
+                store.append(entry)
+                self.writer.add(entry)
+            self.entries = len(store)
+            self.lines = self.parser.next_line - 1
+            self.statistics = self.parser.generate_statistics()
+        if args:
+            self.processed_bytes += len(args[0])
+
+    def fail(self, error):
+        if self.error is not None:
+            return
+        self.error = error
+        self.status = 'error'
+        self.discard()
+
+    def discard(self):
+        self.close()
+        for path in (self.source_path, self.file_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def complete(self):
+        with self.condition:
+            self.finished = time.time()
+            on_done = self.on_done if self.metadata_ready.is_set() else None
+        try:
+            if on_done is not None:
+                on_done(self)
+        finally:
+            # Задача больше не держит разобранный лог: им владеет DATA_STORAGE
+            self.parser = self.writer = self.store = None
+            # Готовым файл считается только после on_done: к этому времени он уже в каталоге
+            if self.error is None:
+                self.status = 'done'
+            else:
+                # Загрузку могли отменить, пока записывался файл разобранного лога
+                self.discard()
+            self.done.set()
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+    def progress(self):
+        processed = self.processed_bytes
+        total = self.size if self.received_all else max(self.total_bytes or 0, self.size)
+        elapsed = (self.finished or time.time()) - self.started
+
+        eta = None
+        if self.status == 'done':
+            eta = 0
+        elif processed and total:
+            eta = round(elapsed * (total - processed) / processed, 1)
+
+        return {
+            'job_id': self.file_id,
+            'status': self.status,
+            'message': str(self.error) if self.error is not None else None,
+            'bytes_received': self.size,
+            'bytes_total': total or None,
+            'bytes_processed': processed,
+            'lines_processed': self.lines,
+            'entries': self.entries,
+            'statistics': self.statistics,
+            'elapsed': round(elapsed, 3),
+            'eta_seconds': eta,
+        }
+
+    def close(self):
+        # Вызывается и Django при закрытии request.FILES
+        if not self.source_file.closed:
+            self.source_file.close()
+
+    @classmethod
+    def from_chunks(cls, name, chunks, total_bytes=None):
+        upload = cls(name, total_bytes)
+        for chunk in chunks:
+            upload.feed(chunk)
+        upload.finish()
+        return upload
+
+
+class LogUploadHandler(FileUploadHandler):
+    """Обработчик загрузки, который передаёт поле log_file в LogUpload прямо из тела запроса.
+
+    Вместо временного файла Django в request.FILES попадает LogUpload,
+    разбор которого идёт в фоне одновременно с приёмом данных по сети.
+    """
+
+    upload = None
+    total_bytes = None
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # Размер всего запроса - оценка размера файла для прогресса
+        self.total_bytes = content_length
+
+    def new_file(self, field_name, file_name, *args, **kwargs):
+        super().new_file(field_name, file_name, *args, **kwargs)
+        self.upload = None
+        if field_name == UPLOAD_FIELD:
+            self.upload = LogUpload(file_name, self.total_bytes)
+            raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.upload is None:
+            return raw_data
+        self.upload.feed(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if self.upload is None:
+            return None
+        self.upload.finish()
+        return self.upload
+
+    def upload_interrupted(self):
+        if self.upload is not None:
+            self.upload.cancel(RuntimeError('Загрузка прервана'))
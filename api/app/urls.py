@@ -5,4 +5,6 @@ urlpatterns = [
     path('upload/', views.terraform_logs_view, name='upload_log_file'),  
     path('logs/', views.terraform_logs_view, name='get_logs'),           
     path('logs/json-bodies/', views.terraform_logs_view, name='get_json_bodies'), 
+    path('logs/follow/', views.follow_view, name='follow_logs'),
+    path('metrics/', views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
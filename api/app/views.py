@@ -1,244 +1,934 @@
-import json
+import asyncio
+import contextvars
+import functools
+import heapq
+import itertools
 import os
+import shutil
 import uuid
-from django.http import JsonResponse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from django.core.handlers.asgi import ASGIRequest
 from django.views.decorators.csrf import csrf_exempt
 from django.core.files.storage import default_storage
+from django.http import HttpResponse, HttpResponseNotFound
 from django.shortcuts import render
-from .parser import TerraformLogParser
-import tempfile
+from . import catalog, codec, metrics
+from .cache import FilterResultCache
+from .logfile import PARSED_SUFFIX, ParsedLogFile, write_parsed_log
+from .parser import PARSER_VERSION, TerraformLogParser
+from .responses import EventStreamResponse, JsonResponse, NdjsonResponse
+from .storage import LogStorage
+from .streaming import stream_request_body
+from .source import SOURCE_SUFFIX, SourceLog
+from .store import BODY_REQ, BODY_RES, ENTRY_KEYS, MISSING_TIME, ColumnarLogStore, body_flags_of
+from .tail import forget_tail, get_tail, has_unparsed_tail
+from .traces import RANKINGS
+from .uploads import LogUpload, LogUploadHandler, active_job_ids, forget_job, get_job
 import time
 from django.conf import settings
 
-DATA_STORAGE = {}
+DATA_STORAGE = LogStorage(settings.DATA_STORAGE_MAX_BYTES)
+RESULT_CACHE = FilterResultCache(settings.FILTER_CACHE_MAX_BYTES)
+SEARCH_EXECUTOR = ThreadPoolExecutor(max_workers=settings.SEARCH_WORKERS, thread_name_prefix='log-search')
+# Под ASGI обработчики выполняются вне цикла событий: быстрые страницы и тяжёлые запросы
+# (загрузки, чтение файла с диска, фильтры без кэша) - в разных пулах, чтобы вторые не задерживали первые
+PAGE_EXECUTOR = ThreadPoolExecutor(max_workers=settings.PAGE_WORKERS, thread_name_prefix='log-page')
+QUERY_EXECUTOR = ThreadPoolExecutor(max_workers=settings.QUERY_WORKERS, thread_name_prefix='log-query')
 
+FILTER_PARAMS = (
+    'level', 'operation', 'component', 'message_type', 'req_id', 'rpc', 'resource_type',
+    'search_text', 'body_filter', 'rawDataSearch', 'time_from', 'time_to',
+)
+# Поиск по тексту регистронезависимый, поэтому и ключ кэша для него в нижнем регистре
+CASE_INSENSITIVE_PARAMS = ('search_text', 'rawDataSearch')
+# Поля, которые можно запросить в get_logs через fields=
+PAGE_FIELDS = ENTRY_KEYS + ('has_json_bodies',)
+# Записей в одном куске потокового (format=ndjson) ответа get_logs и в одном событии follow
+STREAM_BATCH_ROWS = 500
+# Как часто поток server-sent events напоминает о себе, пока новых строк нет, секунды
+FOLLOW_HEARTBEAT_SECONDS = 15
+# Как часто проверяются новые строки файла, который ещё разбирается после загрузки, секунды
+FOLLOW_JOB_POLL_SECONDS = 0.1
+# Как часто ожидающий строк проверяет, не дописал ли их в исходный лог другой процесс, секунды
+FOLLOW_SHARED_POLL_SECONDS = 0.5
+# Страница больше этого считается тяжёлым запросом: её сборка и сериализация заметно дольше обычной
+PAGE_EXECUTOR_MAX_ROWS = 1000
+# Тело POST больше этого (загрузка лога) разбирается в пуле тяжёлых запросов
+PAGE_EXECUTOR_MAX_BODY_BYTES = 64 * 1024
+
+async def run_blocking(executor, func, *args):
+    """Выполняет func(*args) в пуле потоков, не блокируя цикл событий; контекст (замеры стадий) сохраняется"""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(context.run, func, *args))
+
+async def iterate_blocking(executor, iterator):
+    """Асинхронный обход синхронного итератора: каждый шаг - в пуле потоков"""
+    iterator = iter(iterator)
+    done = object()
+    while True:
+        item = await run_blocking(executor, next, iterator, done)
+        if item is done:
+            return
+        yield item
+
+def is_async_request(request):
+    return isinstance(request, ASGIRequest)
+
+def async_streaming(request, response, executor):
+    """Под ASGI потоковый ответ с синхронным итератором Django собрал бы в память целиком - обходим его в пуле"""
+    if is_async_request(request) and response.streaming and not response.is_async:
+        response.streaming_content = iterate_blocking(executor, response.streaming_content)
+    return response
+
+def read_form(request):
+    # Лог из log_file разбирается прямо при приёме тела запроса, без временного файла
+    upload_handler = LogUploadHandler(request)
+    request.upload_handlers.insert(0, upload_handler)
+    try:
+        return request.POST, request.FILES
+    except Exception:
+        # Тело оборвалось посреди лога (клиент отключился, истёк таймаут) - MultiPartParser о таком не сообщает
+        upload_handler.upload_interrupted()
+        raise
+
+def is_page_request(params):
+    """Запрос страницы, который отвечается быстро: файл в памяти (или страница без фильтров с диска),
+    результат фильтров уже в кэше и страница небольшая"""
+    file_id = params.get('file_id')
+    try:
+        page_size = int(params.get('page_size', 100))
+    except ValueError:
+        # Об ошибке параметра сообщит handle_get_logs
+        return False
+    if not file_id or page_size > PAGE_EXECUTOR_MAX_ROWS:
+        return False
+    file_data = DATA_STORAGE.metadata(file_id)
+    if file_data is None or 'logs' not in file_data:
+        return not active_filters(params)
+    store = file_data['logs']
+    return not active_filters(params) or filter_cache_key(file_id, store, params) in RESULT_CACHE
+
+@stream_request_body
 @csrf_exempt
-def terraform_logs_view(request):
+async def terraform_logs_view(request):
+    """Точка входа API. Под ASGI цикл событий только разбирает действие: тело запроса, разбор и
+    фильтры выполняются в PAGE_EXECUTOR и QUERY_EXECUTOR, long-poll ждёт строк без потока"""
     if request.method == 'GET':
-        return render(request, 'logs.html')
+        return await run_blocking(PAGE_EXECUTOR, render, request, 'logs.html')
 
     elif request.method == 'POST':
+        large_body = int(request.META.get('CONTENT_LENGTH') or 0) > PAGE_EXECUTOR_MAX_BODY_BYTES
+        await run_blocking(QUERY_EXECUTOR if large_body else PAGE_EXECUTOR, read_form, request)
+
         session_id = request.COOKIES.get('session_id') or request.POST.get('session_id')
 
         if not session_id:
             session_id = str(uuid.uuid4())
 
         if request.FILES.get('log_file'):
-            return handle_file_upload(request, session_id)
+            return await run_blocking(QUERY_EXECUTOR, handle_file_upload, request, session_id)
 
         action = request.POST.get('action')
-
         if action == 'get_logs':
-            return handle_get_logs(request, session_id)
+            return await handle_get_logs_async(request, session_id)
         elif action == 'get_json_bodies':
-            return handle_get_json_bodies(request, session_id)
-        elif action == 'clear_data':
-            return handle_clear_data(request, session_id)
-        elif action == 'get_statistics':
-            return handle_get_statistics(request, session_id)
-        elif action == 'get_session':
-            return JsonResponse({'session_id': session_id})
+            return await handle_get_json_bodies_async(request, session_id)
+        elif action == 'follow_logs':
+            return await handle_follow_logs_async(request, session_id)
+
+        response = await run_blocking(QUERY_EXECUTOR, dispatch_action, request, session_id, action)
+        return async_streaming(request, response, QUERY_EXECUTOR)
+
+    return JsonResponse({'status': 'error', 'message': 'Invalid request'}, status=400)
+
+async def handle_get_logs_async(request, session_id):
+    executor = PAGE_EXECUTOR if is_page_request(request.POST) else QUERY_EXECUTOR
+    response = await run_blocking(executor, handle_get_logs, request, session_id)
+    return async_streaming(request, response, executor)
+
+async def handle_get_json_bodies_async(request, session_id):
+    file_data = DATA_STORAGE.metadata(request.POST.get('file_id'))
+    executor = PAGE_EXECUTOR if file_data is not None and 'logs' in file_data else QUERY_EXECUTOR
+    return await run_blocking(executor, handle_get_json_bodies, request, session_id)
+
+async def handle_follow_logs_async(request, session_id):
+    """follow_logs, у которого ожидание новых строк не занимает поток"""
+    file_id = request.POST.get('file_id')
+    try:
+        cursor = int(request.POST.get('cursor', 0))
+        timeout = min(float(request.POST.get('timeout', 0)), settings.FOLLOW_POLL_TIMEOUT)
+    except ValueError:
+        timeout = 0
+    if file_id and timeout > 0:
+        file_data = await run_blocking(QUERY_EXECUTOR, load_file, file_id, session_id)
+        if file_data is not None and file_data['session_id'] == session_id:
+            await wait_for_rows_async(file_id, file_data, cursor, timeout)
+    return await run_blocking(PAGE_EXECUTOR, handle_follow_logs, request, session_id, False)
+
+def dispatch_action(request, session_id, action):
+    """Действия без отдельной асинхронной версии; выполняется в пуле потоков"""
+    if action == 'clear_data':
+        return handle_clear_data(request, session_id)
+    elif action == 'append_logs':
+        return handle_append_logs(request, session_id)
+    elif action == 'get_statistics':
+        return handle_get_statistics(request, session_id)
+    elif action == 'get_requests':
+        return handle_get_requests(request, session_id)
+    elif action == 'search_session':
+        return handle_search_session(request, session_id)
+    elif action == 'list_files':
+        return handle_list_files(request, session_id)
+    elif action == 'get_session':
+        return JsonResponse({'session_id': session_id})
+    elif action == 'get_cache_stats':
+        return JsonResponse(RESULT_CACHE.stats())
+    elif action == 'get_job_status':
+        return handle_get_job_status(request, session_id)
+    elif action == 'get_storage_stats':
+        return JsonResponse(DATA_STORAGE.stats())
 
     return JsonResponse({'status': 'error', 'message': 'Invalid request'}, status=400)
 
+def metrics_view(request):
+    """Гистограммы стадий и счётчики процесса в текстовом формате Prometheus"""
+    if not metrics.enabled():
+        return HttpResponseNotFound()
+    return HttpResponse(metrics.REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+async def follow_view(request):
+    """Дописываемые строки файла как server-sent events (GET ?file_id=&cursor=).
+
+    Каждое событие - страница follow_page с записями после курсора; id
+    события - новый курсор, так что переподключение с Last-Event-ID
+    продолжает с того же места. Под ASGI ожидание строк не занимает поток.
+    """
+    session_id = request.COOKIES.get('session_id') or request.GET.get('session_id')
+    file_id = request.GET.get('file_id')
+    if not file_id or not session_id:
+        return JsonResponse({'status': 'error', 'message': 'file_id and session_id are required'}, status=400)
+
+    file_data = await run_blocking(QUERY_EXECUTOR, load_file, file_id, session_id)
+    if file_data is None:
+        return JsonResponse({'status': 'error', 'message': 'File not found'}, status=404)
+    if file_data['session_id'] != session_id:
+        return JsonResponse({'status': 'error', 'message': 'Access denied'}, status=403)
+
+    fields = parse_fields(request.GET.get('fields'))
+    unknown = [field for field in fields or () if field not in PAGE_FIELDS]
+    if unknown:
+        return JsonResponse({'status': 'error', 'message': f'Unknown fields: {", ".join(unknown)}'}, status=400)
+
+    try:
+        cursor = int(request.headers.get('Last-Event-ID') or request.GET.get('cursor', 0))
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'cursor must be an integer'}, status=400)
+    events = follow_events_async if is_async_request(request) else follow_events
+    return EventStreamResponse(events(file_id, session_id, cursor, fields), event='logs')
+
+def follow_events(file_id, session_id, cursor, fields):
+    deadline = time.monotonic() + settings.FOLLOW_STREAM_SECONDS
+    while file_id in DATA_STORAGE:
+        # Файл могли выгрузить из памяти и загрузить заново - берём текущее хранилище
+        file_data = load_file(file_id, session_id)
+        if file_data is None:
+            return
+        page = follow_page(file_data['logs'], cursor, STREAM_BATCH_ROWS, fields)
+        if page['logs']:
+            cursor = page['cursor']
+            yield cursor, page
+            continue
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        if not wait_for_rows(file_id, file_data, cursor, min(FOLLOW_HEARTBEAT_SECONDS, remaining)):
+            yield None
+
+async def follow_events_async(file_id, session_id, cursor, fields):
+    """follow_events для цикла событий: чтение строк - в пуле потоков, ожидание - wait_for_rows_async"""
+    deadline = time.monotonic() + settings.FOLLOW_STREAM_SECONDS
+    while file_id in DATA_STORAGE:
+        file_data = await run_blocking(QUERY_EXECUTOR, load_file, file_id, session_id)
+        if file_data is None:
+            return
+        page = await run_blocking(PAGE_EXECUTOR, follow_page, file_data['logs'], cursor, STREAM_BATCH_ROWS, fields)
+        if page['logs']:
+            cursor = page['cursor']
+            yield cursor, page
+            continue
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        if not await wait_for_rows_async(file_id, file_data, cursor, min(FOLLOW_HEARTBEAT_SECONDS, remaining)):
+            yield None
+
 def handle_file_upload(request, session_id):
     try:
         log_file = request.FILES['log_file']
 
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.log') as tmp_file:
-            for chunk in log_file.chunks():
-                tmp_file.write(chunk)
-            tmp_path = tmp_file.name
-
-        parser = TerraformLogParser()
-        result = parser.parse_file(tmp_path)
-
-        os.unlink(tmp_path)
-
-        file_id = str(uuid.uuid4())
-        parsed_filename = f"{file_id}_parsed.json"
-        parsed_file_path = os.path.join(settings.LOG_STORAGE_DIR, parsed_filename)
-
-        with open(parsed_file_path, 'w', encoding='utf-8') as f:
-            json.dump({
-                'metadata': {
-                    'original_filename': log_file.name,
-                    'session_id': session_id,
-                    'timestamp': time.time(),
-                    'file_id': file_id
-                },
-                'parsed_data': result
-            }, f, ensure_ascii=False, indent=2)
-
-        DATA_STORAGE[file_id] = {
-            'raw_data': result,
-            'filename': log_file.name,
-            'file_path': parsed_file_path,
-            'session_id': session_id,
-            'timestamp': time.time()
-        }
+        # Обычно файл уже принят LogUploadHandler; иначе передаём его куски здесь
+        if isinstance(log_file, LogUpload):
+            upload = log_file
+        else:
+            upload = LogUpload.from_chunks(log_file.name, log_file.chunks(), log_file.size)
+
+        # Такой же лог уже разобран той же версией парсера: файл ссылается на сохранённый разбор, а загрузка отменяется.
+        # id у файла новый - отменённая задача ещё может удалять файлы со своим id
+        content_hash = upload.content_hash
+        shared = None
+        if content_hash is not None:
+            shared = catalog.share_parsed(content_hash, str(uuid.uuid4()), session_id, upload.name, time.time())
+        if shared is not None:
+            upload.abandon()
+            job = stored_job_progress(shared)
+            return JsonResponse({
+                'status': 'success',
+                'message': f'Такой лог уже разобран. Записей: {shared.line_count}',
+                'count': shared.line_count,
+                'statistics': shared.statistics,
+                'file_id': shared.file_id,
+                'job_id': shared.file_id,
+                'job': job,
+                'session_id': session_id,
+                'filename': upload.name,
+                'deduplicated': True,
+                'provisional': False,
+            })
+
+        # Разбор идёт в фоне; уже разобранные строки сразу доступны через get_logs.
+        # Если он успел закончиться ошибкой, хранилища уже нет - об ошибке сообщает статус задачи
+        store = upload.store
+        file_id = upload.file_id
+        if store is not None:
+            DATA_STORAGE.put(file_id, {
+                'logs': store,
+                'filename': upload.name,
+                'file_path': upload.file_path,
+                'source_path': upload.source_path,
+                'session_id': session_id,
+                'timestamp': time.time(),
+                'content_hash': content_hash,
+                'parser_version': PARSER_VERSION,
+            })
+            DATA_STORAGE.pin(file_id)
+            upload.set_metadata({
+                'original_filename': upload.name,
+                'session_id': session_id,
+                'timestamp': time.time(),
+                'file_id': file_id,
+                'content_hash': content_hash,
+                'parser_version': PARSER_VERSION,
+            }, on_done=upload_done)
 
+        # count и statistics - на момент ответа; пока provisional, итог клиент берёт из get_job_status
+        progress = upload.progress()
         return JsonResponse({
             'status': 'success',
-            'message': f'Файл успешно обработан. Записей: {result["count"]}',
-            'count': result['count'],
-            'statistics': result['statistics'],
+            'message': f'Файл принят, идёт разбор. Записей: {progress["entries"]}',
+            'count': progress['entries'],
+            'statistics': progress['statistics'],
             'file_id': file_id,
+            'job_id': file_id,
+            'job': progress,
             'session_id': session_id,
-            'filename': log_file.name
+            'filename': upload.name,
+            'provisional': progress['status'] != 'done',
         })
     except Exception as e:
-        if 'tmp_path' in locals() and os.path.exists(tmp_path):
-            os.unlink(tmp_path)
+        if 'upload' in locals():
+            upload.cancel(e)
         return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
 
-def handle_get_logs(request, session_id):
+def upload_done(upload):
+    """Завершение фонового разбора: лог можно выгружать, а при ошибке - забыть"""
+    if upload.error is not None:
+        DATA_STORAGE.pop(upload.file_id)
+        RESULT_CACHE.invalidate(upload.file_id)
+        return
+
+    file_data = DATA_STORAGE.metadata(upload.file_id)
+    if file_data is not None:
+        # Файл разобранного лога уже на диске - с этого момента его находят через каталог
+        file_data['file_version'] = file_version(upload.file_path)
+        catalog.record(upload.file_id, file_data, upload.entries, upload.statistics)
+    DATA_STORAGE.unpin(upload.file_id)
+
+def handle_append_logs(request, session_id):
+    """Дописывает к файлу новые строки лога: файл в поле chunk или текст в data; eof=1 - лог закончен"""
     try:
         file_id = request.POST.get('file_id')
-        if not file_id:
-            return JsonResponse({'logs': [], 'total_count': 0, 'current_file': None})
+        file_data = load_file(file_id, session_id) if file_id else None
+        if file_data is None:
+            return JsonResponse({'status': 'error', 'message': 'File not found'}, status=404)
+
+        if file_data['session_id'] != session_id:
+            return JsonResponse({'status': 'error', 'message': 'Access denied'}, status=403)
+
+        job = get_job(file_id)
+        if job is not None and job.finished is None:
+            return JsonResponse({'status': 'error', 'message': 'File is still being parsed'}, status=409)
+
+        if file_data['logs'].source is None:
+            return JsonResponse({'status': 'error', 'message': 'Append needs the source log of the file'}, status=400)
+
+        file_data = own_file_data(file_id, file_data, session_id)
+        store = file_data['logs']
+        tail = get_tail(file_id, file_data)
+        added = 0
+        chunk = request.FILES.get('chunk')
+        for data in chunk.chunks() if chunk is not None else (request.POST.get('data', '').encode('utf-8'),):
+            added += tail.append(data)
+        if request.POST.get('eof') in ('1', 'true'):
+            added += tail.append(b'', eof=True)
+            # Файл разобранного лога переписан целиком - обновляем его версию и запись в каталоге
+            file_data['file_version'] = file_version(file_data['file_path'])
+            with store.lock:
+                line_count, statistics = len(store), store.statistics
+            catalog.record(file_id, file_data, line_count, statistics)
+
+        with store.lock:
+            return JsonResponse({
+                'status': 'success',
+                'added': added,
+                'total_count': len(store),
+                'statistics': store.statistics,
+            })
+    except Exception as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
 
-        if file_id not in DATA_STORAGE:
-            file_path, _ = find_file_on_disk(file_id)
-            if file_path and os.path.exists(file_path):
-                if file_path.endswith('_parsed.json'):
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        file_content = json.load(f)
-
-                    metadata = file_content.get('metadata', {})
-                    result = file_content.get('parsed_data', {})
-
-                    DATA_STORAGE[file_id] = {
-                        'raw_data': result,
-                        'filename': metadata.get('original_filename', 'Unknown'),
-                        'file_path': file_path,
-                        'session_id': metadata.get('session_id', session_id),
-                        'timestamp': metadata.get('timestamp', os.path.getctime(file_path))
-                    }
-                else:
-                    parser = TerraformLogParser()
-                    result = parser.parse_file(file_path)
-
-                    DATA_STORAGE[file_id] = {
-                        'raw_data': result,
-                        'filename': os.path.basename(file_path).split('_', 1)[1],
-                        'file_path': file_path,
-                        'session_id': session_id,
-                        'timestamp': os.path.getctime(file_path)
-                    }
-            else:
-                return JsonResponse({'logs': [], 'total_count': 0, 'current_file': None})
-
-        file_data = DATA_STORAGE[file_id]
+def own_file_data(file_id, file_data, session_id):
+    """Данные файла перед дописыванием строк: файл должен владеть своими файлами на диске.
+
+    Разбор, общий с другими записями каталога (одинаковые загрузки),
+    копируется под новыми именами, а хеш содержимого сбрасывается: дописанный
+    лог уже не совпадает с загрузкой, и новые загрузки на него не ссылаются.
+    Имена {file_id}_* для копии не годятся: у первой из одинаковых загрузок
+    это и есть общие файлы.
+    """
+    entry = catalog.lookup(file_id)
+    if entry is None:
+        return file_data
+    if entry.file_path != file_data['file_path']:
+        # Копию уже сделал другой процесс - у этого процесса данные общего разбора
+        forget_tail(file_id)
+        DATA_STORAGE.pop(file_id)
+        RESULT_CACHE.invalidate(file_id)
+        return load_file(file_id, session_id)
+    if not entry.content_hash:
+        return file_data
+
+    store = file_data['logs']
+    if catalog.references(entry) > 1:
+        forget_tail(file_id)
+        name = str(uuid.uuid4())
+        source_path = os.path.join(settings.LOG_STORAGE_DIR, f"{name}{SOURCE_SUFFIX}")
+        shutil.copyfile(store.source.path, source_path)
+        with store.lock:
+            store.thaw()
+            store.source = SourceLog(source_path, store.source.offsets, store.source.lengths)
+        file_data['source_path'] = source_path
+        file_data['file_path'] = os.path.join(settings.LOG_STORAGE_DIR, f"{name}{PARSED_SUFFIX}")
+        get_tail(file_id, file_data).snapshot()
+        file_data['file_version'] = file_version(file_data['file_path'])
+        RESULT_CACHE.invalidate(file_id)
+
+    file_data.pop('content_hash', None)
+    with store.lock:
+        line_count, statistics = len(store), store.statistics
+    catalog.record(file_id, file_data, line_count, statistics)
+    return file_data
+
+def handle_follow_logs(request, session_id, wait=True):
+    """Записи после cursor; если их ещё нет, ждёт дописанных до timeout секунд (long-poll).
+
+    wait=False - не ждать: асинхронная версия уже дождалась строк сама.
+    """
+    try:
+        file_id = request.POST.get('file_id')
+        file_data = load_file(file_id, session_id) if file_id else None
+        if file_data is None:
+            return JsonResponse({'status': 'error', 'message': 'File not found'}, status=404)
 
         if file_data['session_id'] != session_id:
             return JsonResponse({'status': 'error', 'message': 'Access denied'}, status=403)
 
-        logs = file_data['raw_data']['logs']
+        fields = parse_fields(request.POST.get('fields'))
+        unknown = [field for field in fields or () if field not in PAGE_FIELDS]
+        if unknown:
+            return JsonResponse({'status': 'error', 'message': f'Unknown fields: {", ".join(unknown)}'}, status=400)
+
+        cursor = int(request.POST.get('cursor', 0))
+        limit = int(request.POST.get('limit', STREAM_BATCH_ROWS))
+        timeout = min(float(request.POST.get('timeout', 0)), settings.FOLLOW_POLL_TIMEOUT)
+        if wait and timeout > 0:
+            wait_for_rows(file_id, file_data, cursor, timeout)
+        return JsonResponse(follow_page(file_data['logs'], cursor, limit, fields))
+    except Exception as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
+
+def follow_page(store, cursor, limit, fields=None):
+    """Записи строк хранилища начиная с cursor (не больше limit) и курсор для следующего запроса"""
+    with store.lock:
+        total_count = len(store)
+        logs = store_page_logs(store, range(cursor, min(total_count, cursor + limit)), fields)
+        return {
+            'logs': logs,
+            'cursor': cursor + len(logs),
+            'total_count': total_count,
+            'statistics': store.statistics,
+        }
 
-        filtered_logs = apply_filters(logs, request.POST)
+def wait_for_rows(file_id, file_data, cursor, timeout):
+    """Ждёт, пока в файле станет больше cursor строк, не дольше timeout; True - дождались"""
+    store = file_data['logs']
+    deadline = time.monotonic() + timeout
+    while len(store) <= cursor:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or file_id not in DATA_STORAGE:
+            return False
 
-        json_bodies = file_data['raw_data'].get('json_bodies', {})
-        for log in filtered_logs:
-            log['has_json_bodies'] = log['id'] in json_bodies
+        job = get_job(file_id)
+        if job is not None and job.finished is None:
+            # Строки дописывает фоновый разбор загрузки
+            time.sleep(min(FOLLOW_JOB_POLL_SECONDS, remaining))
+        elif store.source is not None:
+            tail = get_tail(file_id, file_data)
+            tail.wait(cursor, min(remaining, FOLLOW_SHARED_POLL_SECONDS))
+            if tail.closed:
+                return False
+            tail.catch_up()
+        else:
+            return False
+    return True
+
+async def wait_for_rows_async(file_id, file_data, cursor, timeout):
+    """wait_for_rows для цикла событий"""
+    store = file_data['logs']
+    deadline = time.monotonic() + timeout
+    while len(store) <= cursor:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or file_id not in DATA_STORAGE:
+            return False
+
+        job = get_job(file_id)
+        if job is not None and job.finished is None:
+            await asyncio.sleep(min(FOLLOW_JOB_POLL_SECONDS, remaining))
+        elif store.source is not None:
+            # Создание LogTail может дочитывать хвост исходного лога с диска
+            tail = await run_blocking(PAGE_EXECUTOR, get_tail, file_id, file_data)
+            await tail.wait_async(cursor, min(remaining, FOLLOW_SHARED_POLL_SECONDS))
+            if tail.closed:
+                return False
+            await run_blocking(PAGE_EXECUTOR, tail.catch_up)
+        else:
+            return False
+    return True
+
+def handle_get_job_status(request, session_id):
+    """Прогресс фонового разбора загрузки"""
+    job_id = request.POST.get('job_id') or request.POST.get('file_id')
+    upload = get_job(job_id) if job_id else None
+    if upload is None:
+        # Задачи нет (разбор не понадобился или процесс перезапущен), но файл в каталоге - он готов
+        entry = catalog.lookup(job_id) if job_id else None
+        if entry is None:
+            return JsonResponse({'status': 'error', 'message': 'Job not found'}, status=404)
+        if entry.session_id != session_id:
+            return JsonResponse({'status': 'error', 'message': 'Access denied'}, status=403)
+        return JsonResponse(stored_job_progress(entry))
+
+    file_data = DATA_STORAGE.metadata(job_id)
+    if file_data is not None and file_data['session_id'] != session_id:
+        return JsonResponse({'status': 'error', 'message': 'Access denied'}, status=403)
+
+    return JsonResponse(upload.progress())
+
+def stored_job_progress(entry):
+    """Прогресс в формате LogUpload.progress для файла, который уже в каталоге"""
+    return {
+        'job_id': entry.file_id,
+        'status': 'done',
+        'message': None,
+        'bytes_received': entry.source_bytes,
+        'bytes_total': entry.source_bytes,
+        'bytes_processed': entry.source_bytes,
+        'lines_processed': entry.line_count,
+        'entries': entry.line_count,
+        'statistics': entry.statistics,
+        'elapsed': 0,
+        'eta_seconds': 0,
+    }
+
+def handle_get_logs(request, session_id):
+    """Страница записей; fields=a,b оставляет только эти поля, format=ndjson - потоковый ответ"""
+    try:
+        file_id = request.POST.get('file_id')
+        if not file_id:
+            return JsonResponse({'logs': [], 'total_count': 0, 'current_file': None})
 
         page = int(request.POST.get('page', 1))
         page_size = int(request.POST.get('page_size', 100))
         start_idx = (page - 1) * page_size
         end_idx = start_idx + page_size
+        stream = request.POST.get('format') == 'ndjson'
 
-        paginated_logs = filtered_logs[start_idx:end_idx]
+        fields = parse_fields(request.POST.get('fields'))
+        unknown = [field for field in fields or () if field not in PAGE_FIELDS]
+        if unknown:
+            return JsonResponse({'status': 'error', 'message': f'Unknown fields: {", ".join(unknown)}'}, status=400)
 
-        return JsonResponse({
-            'logs': paginated_logs,
-            'total_count': len(filtered_logs),
-            'current_file': file_data['filename'],
-            'page': page,
-            'page_size': page_size,
-            'total_pages': (len(filtered_logs) + page_size - 1) // page_size
-        })
+        # Страница без фильтров читается прямо из файла, не загружая весь лог в память
+        if DATA_STORAGE.get(file_id) is None and not active_filters(request.POST):
+            response = get_page_from_disk(file_id, session_id, page, page_size, fields, stream)
+            if response is not None:
+                return response
+
+        file_data = load_file(file_id, session_id)
+        if file_data is None:
+            return JsonResponse({'logs': [], 'total_count': 0, 'current_file': None})
+
+        if file_data['session_id'] != session_id:
+            return JsonResponse({'status': 'error', 'message': 'Access denied'}, status=403)
+
+        store = file_data['logs']
+        job = get_job(file_id)
+        parsing = job is not None and job.finished is None
+
+        # Пока идёт фоновый разбор, фильтруются и отдаются уже разобранные строки
+        with store.lock:
+            filtered_rows = get_filtered_rows(file_id, store, request.POST)
+            page_rows = filtered_rows[start_idx:end_idx]
+            if not stream:
+                with metrics.stage('rows'):
+                    paginated_logs = store_page_logs(store, page_rows, fields)
+
+        header = page_header(len(filtered_rows), file_data['filename'], page, page_size, parsing)
+        if stream:
+            return NdjsonResponse(stream_store_page(store, page_rows, fields, header), batched=True)
+        return JsonResponse({'logs': paginated_logs, **header})
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
 
-def apply_filters(logs, params):
-    """Применяет фильтры к логам"""
-    filtered = logs
-    
-    level = params.get('level')
-    if level and level != 'all':
-        filtered = [log for log in filtered if log.get('level') == level]
-    
-    operation = params.get('operation')
-    if operation and operation != 'all':
-        filtered = [log for log in filtered if log.get('operation') == operation]
-    
-    component = params.get('component')
-    if component and component != 'all':
-        filtered = [log for log in filtered if log.get('component') == component]
-    
+def parse_fields(value):
+    """Поля из параметра fields=a,b в порядке перечисления; None - все поля"""
+    if not value:
+        return None
+    return tuple(dict.fromkeys(field.strip() for field in value.split(',') if field.strip())) or None
+
+def page_header(total_count, filename, page, page_size, parsing=False):
+    return {
+        'total_count': total_count,
+        'current_file': filename,
+        'page': page,
+        'page_size': page_size,
+        'total_pages': (total_count + page_size - 1) // page_size,
+        'parsing': parsing
+    }
+
+def store_page_logs(store, rows, fields=None):
+    """Записи строк rows с признаком has_json_bodies; с fields - только эти поля.
+
+    Признак берётся из флагов тел в хранилище, поэтому без raw_data в fields
+    raw_data не читается вовсе.
+    """
+    logs = store.rows(rows, fields and tuple(field for field in fields if field != 'has_json_bodies'))
+    if fields is None or 'has_json_bodies' in fields:
+        json_bodies, body_flags = store.json_bodies, store.body_flags
+        for row, log in zip(rows, logs):
+            log['has_json_bodies'] = store.row_id(row) in json_bodies or bool(body_flags[row])
+    return logs
+
+def file_page_logs(log_file, start, stop, fields=None):
+    """То же, что store_page_logs, для строк [start, stop) файла разобранного лога"""
+    body_flags = log_file.body_flags
+    logs = log_file.rows(start, stop, raw_data=fields is None or 'raw_data' in fields or body_flags is None)
+    json_bodies = log_file.json_bodies
+    for row, log in enumerate(logs, max(start, 0)):
+        flags = body_flags[row] if body_flags is not None else body_flags_of(log['raw_data'])
+        log['has_json_bodies'] = log['id'] in json_bodies or bool(flags)
+    if fields is not None:
+        logs = [{field: log.get(field) for field in fields} for log in logs]
+    return logs
+
+def stream_store_page(store, rows, fields, header):
+    """Пачки строк NDJSON: сначала заголовок страницы с type='page', затем записи по одной в строке.
+
+    Хранилище блокируется только на время сборки очередной пачки, так что
+    ответ не держит ни всю страницу в памяти, ни блокировку на всё время отдачи.
+    """
+    yield [{'type': 'page', **header}]
+    for start in range(0, len(rows), STREAM_BATCH_ROWS):
+        with store.lock:
+            batch = store_page_logs(store, rows[start:start + STREAM_BATCH_ROWS], fields)
+        yield batch
+
+def stream_file_page(file_path, start, stop, fields, header):
+    yield [{'type': 'page', **header}]
+    with ParsedLogFile(file_path) as log_file:
+        for first in range(start, min(stop, len(log_file)), STREAM_BATCH_ROWS):
+            yield file_page_logs(log_file, first, min(first + STREAM_BATCH_ROWS, stop), fields)
+
+def get_page_from_disk(file_id, session_id, page, page_size, fields=None, stream=False):
+    """Страница без фильтров из файла с произвольным доступом; None - если файл другого формата"""
+    file_path, entry = find_file_on_disk(file_id)
+    if not file_path or not file_path.endswith(PARSED_SUFFIX):
+        return None
+
+    with ParsedLogFile(file_path) as log_file:
+        # Без сортировки по номеру строки страница из файла не совпала бы с отфильтрованной
+        if not log_file.is_sorted:
+            return None
+        # К логу дописывали строки: они есть только в исходном логе, его хвост дочитывает read_file_data
+        if log_file.source is not None and has_unparsed_tail(log_file.source):
+            return None
+        metadata = stored_metadata(log_file.metadata, entry)
+        if metadata.get('session_id', session_id) != session_id:
+            return JsonResponse({'status': 'error', 'message': 'Access denied'}, status=403)
+
+        start_idx = (page - 1) * page_size
+        header = page_header(len(log_file), metadata.get('original_filename', 'Unknown'), page, page_size)
+        if stream:
+            # Файл заново открывает генератор: он живёт, пока ответ отдаётся клиенту
+            return NdjsonResponse(
+                stream_file_page(file_path, start_idx, start_idx + page_size, fields, header), batched=True
+            )
+        logs = file_page_logs(log_file, start_idx, start_idx + page_size, fields)
+        return JsonResponse({'logs': logs, **header})
+
+def active_filters(params):
+    """Заданные фильтры в нормализованном виде: пары (параметр, значение)"""
+    filters = []
+    for name in FILTER_PARAMS:
+        value = params.get(name)
+        if not value or value == 'all':
+            continue
+        if name in CASE_INSENSITIVE_PARAMS:
+            value = value.lower()
+        filters.append((name, value))
+    return tuple(filters)
+
+def filter_cache_key(file_id, store, params):
+    """Ключ кэша: файл, число строк в нём и нормализованные фильтры"""
+    return (file_id, len(store), active_filters(params))
+
+def get_filtered_rows(file_id, store, params):
+    """Номера строк после фильтрации; повторные запросы страниц берутся из кэша"""
+    key = filter_cache_key(file_id, store, params)
+    rows = RESULT_CACHE.get(key)
+    if rows is None:
+        rows = RESULT_CACHE.put(key, apply_filters(store, params))
+    return rows
+
+def parse_ts(ts_str: str):
+    try:
+        if not isinstance(ts_str, str):
+            return None
+        parts = ts_str.split(':')
+        if len(parts) < 3:
+            return None
+        hours = int(parts[0])
+        minutes = int(parts[1])
+        sec_parts = parts[2].split('.')
+        seconds = int(sec_parts[0])
+        millis = int(sec_parts[1]) if len(sec_parts) > 1 else 0
+        return hours * 3600_000 + minutes * 60_000 + seconds * 1000 + millis
+    except Exception:
+        return None
+
+@metrics.timed('filter')
+def apply_filters(store, params):
+    """Применяет фильтры к столбцам лога и возвращает номера подходящих строк"""
+    masks = []
+    row_lists = []
+
+    for field in ('level', 'operation', 'component', 'message_type'):
+        value = params.get(field)
+        if value and value != 'all':
+            masks.append(store.value_mask(field, lambda candidate, value=value: candidate == value))
+
+    body_filter = params.get('body_filter')
+    if body_filter and body_filter != 'all':
+        flags = {'has_req_body': BODY_REQ, 'has_res_body': BODY_RES, 'has_both': BODY_REQ | BODY_RES}.get(body_filter)
+        if flags:
+            masks.append(store.body_mask(flags))
+
+    time_mask = get_time_mask(store, params.get('time_from'), params.get('time_to'))
+    if time_mask is not None:
+        masks.append(time_mask)
+
     req_id = params.get('req_id')
     if req_id:
-        filtered = [log for log in filtered if req_id in log.get('tf_req_id', '')]
-    
+        row_lists.append(store.indexed_rows('tf_req_id', lambda value: isinstance(value, str) and req_id in value))
+
+    for param, field in (('rpc', 'tf_rpc'), ('resource_type', 'tf_resource_type')):
+        value = params.get(param)
+        if value and value != 'all':
+            row_lists.append(store.indexed_rows(field, lambda candidate, value=value: candidate == value))
+
+    filtered = store.select(masks, row_lists)
+
     search_text = params.get('search_text')
     if search_text:
         search_lower = search_text.lower()
-        filtered = [log for log in filtered if (
-            search_lower in log.get('message', '').lower() or
-            search_lower in log.get('tf_resource_type', '').lower() or
-            search_lower in log.get('tf_rpc', '').lower()
-        )]
 
-    body_filter = params.get('body_filter')
-    if body_filter and body_filter != 'all':
-        if body_filter == 'has_req_body':
-            filtered = [log for log in filtered if log.get('raw_data') and 'tf_http_req_body' in log['raw_data']]
-        elif body_filter == 'has_res_body':
-            filtered = [log for log in filtered if log.get('raw_data') and 'tf_http_res_body' in log['raw_data']]
-        elif body_filter == 'has_both':
-            filtered = [log for log in filtered if log.get('raw_data') and ('tf_http_req_body' in log['raw_data'] or 'tf_http_res_body' in log['raw_data'])]
+        def contains_search(value):
+            return isinstance(value, str) and search_lower in value.lower()
+
+        resource_codes = store.columns['tf_resource_type'].matching_codes(contains_search)
+        rpc_codes = store.columns['tf_rpc'].matching_codes(contains_search)
+        resource_data = store.columns['tf_resource_type'].data
+        rpc_data = store.columns['tf_rpc'].data
+        message_rows = set(store.text_index('message').search(search_lower, filtered))
+        filtered = [row for row in filtered if (
+            row in message_rows or
+            resource_data[row] in resource_codes or
+            rpc_data[row] in rpc_codes
+        )]
 
     rawDataSearch = params.get('rawDataSearch')
     if rawDataSearch:
-        search_lower = rawDataSearch.lower()
-        filtered = [log for log in filtered if log.get('raw_data') and search_lower in json.dumps(log['raw_data'], ensure_ascii=False).lower()]
+        filtered = store.text_index('raw_data').search(rawDataSearch.lower(), filtered)
 
-    def parse_ts(ts_str: str):
-        try:
-            if not isinstance(ts_str, str):
-                return None
-            parts = ts_str.split(':')
-            if len(parts) < 3:
-                return None
-            hours = int(parts[0])
-            minutes = int(parts[1])
-            sec_parts = parts[2].split('.')
-            seconds = int(sec_parts[0])
-            millis = int(sec_parts[1]) if len(sec_parts) > 1 else 0
-            return hours * 3600_000 + minutes * 60_000 + seconds * 1000 + millis
-        except Exception:
-            return None
+    return store.sort_rows(filtered)
 
-    time_from = params.get('time_from')
-    time_to = params.get('time_to')
-    if (time_from or time_to) and filtered:
-        from_ms = parse_ts(time_from) if time_from else None
-        to_ms = parse_ts(time_to) if time_to else None
-        if from_ms is not None or to_ms is not None:
-            def in_range(log):
-                ts = parse_ts(log.get('timestamp'))
-                if ts is None:
-                    return False
-                if from_ms is not None and ts < from_ms:
-                    return False
-                if to_ms is not None and ts > to_ms:
-                    return False
-                return True
-            filtered = [log for log in filtered if in_range(log)]
-    
-    filtered.sort(key=lambda x: x['line_number'])
-    
-    return filtered
+def get_time_mask(store, time_from, time_to):
+    """Маска строк в промежутке time_from - time_to (время суток) или None без фильтра по времени"""
+    from_ms = parse_ts(time_from) if time_from else None
+    to_ms = parse_ts(time_to) if time_to else None
+    if from_ms is None and to_ms is None:
+        return None
+
+    # Строки с полным временем ищутся бисекцией, в том числе через полночь
+    mask = store.time_mask(from_ms, to_ms)
+
+    # Остальные (старые файлы, строки без даты) сравниваются по времени суток;
+    # нестандартные метки разбираются один раз на метку, а не на строку
+    label_ms = [parse_ts(label) for label in store.timestamp_labels.values]
+    timestamps = store.timestamps
+    wraps = from_ms is not None and to_ms is not None and to_ms < from_ms
+    for row in store.untimed_rows:
+        ts = timestamps[row]
+        if ts < 0:
+            ts = label_ms[-1 - ts]
+            if ts is None:
+                continue
+        after_from = from_ms is None or ts >= from_ms
+        before_to = to_ms is None or ts <= to_ms
+        if (after_from or before_to) if wraps else (after_from and before_to):
+            mask[row] = 1
+    return mask
+
+def file_version(file_path):
+    """Отметка версии файла на диске; None - файла нет"""
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+def load_file(file_id, session_id):
+    """Данные файла из DATA_STORAGE; выгруженный или ещё не открытый файл загружается с диска.
+
+    Файлы на диске общие для всех процессов (воркеров): если другой процесс
+    удалил или переписал файл, копия этого процесса отбрасывается и файл
+    загружается заново, а строки, дописанные другим процессом в исходный
+    лог, дочитываются.
+    """
+    loader = lambda: read_file_data(file_id, session_id)
+    file_data = DATA_STORAGE.get(file_id, loader)
+    # Версии нет, пока файл разбирается в этом процессе
+    if file_data is None or file_data.get('file_version') is None:
+        return file_data
+
+    if file_version(file_data['file_path']) != file_data['file_version']:
+        forget_tail(file_id)
+        DATA_STORAGE.pop(file_id)
+        RESULT_CACHE.invalidate(file_id)
+        return DATA_STORAGE.get(file_id, loader)
+
+    store = file_data['logs']
+    if store.source is not None and has_unparsed_tail(store.source):
+        get_tail(file_id, file_data).catch_up()
+    return file_data
+
+@metrics.timed('load')
+def read_file_data(file_id, session_id):
+    """Загружает разобранный файл с диска (или разбирает исходный) для DATA_STORAGE"""
+    file_path, entry = find_file_on_disk(file_id)
+    if not file_path or not os.path.exists(file_path):
+        return None
+
+    # Версия берётся до чтения: если файл перепишут во время загрузки, load_file это заметит
+    version = file_version(file_path)
+
+    if file_path.endswith(PARSED_SUFFIX):
+        with ParsedLogFile(file_path) as log_file:
+            metadata = stored_metadata(log_file.metadata, entry)
+            # Столбцы из файла отображаются в память без разбора блоков и общие у всех процессов
+            store = log_file.mapped_store()
+            if store is None:
+                store = ColumnarLogStore.from_result({
+                    'logs': log_file,
+                    'statistics': log_file.statistics,
+                    'json_bodies': log_file.json_bodies,
+                }, log_file.source, log_file.body_flags)
+
+        file_data = {
+            'logs': store,
+            'filename': metadata.get('original_filename', 'Unknown'),
+            'file_path': file_path,
+            'source_path': store.source.path if store.source is not None else None,
+            'session_id': metadata.get('session_id', session_id),
+            'timestamp': metadata.get('timestamp', os.path.getctime(file_path)),
+            'file_version': version,
+        }
+        # Строки, дописанные после сохранения файла, разбираются из хвоста исходного лога
+        if store.source is not None and has_unparsed_tail(store.source):
+            get_tail(file_id, file_data)
+        return file_data
+
+    if file_path.endswith('_parsed.json'):
+        with open(file_path, 'rb') as f:
+            file_content = codec.load(f)
+
+        metadata = stored_metadata(file_content.get('metadata', {}), entry)
+        result = file_content.get('parsed_data', {})
+
+        return {
+            'logs': ColumnarLogStore.from_result(result),
+            'filename': metadata.get('original_filename', 'Unknown'),
+            'file_path': file_path,
+            'session_id': metadata.get('session_id', session_id),
+            'timestamp': metadata.get('timestamp', os.path.getctime(file_path)),
+            'file_version': version,
+        }
+
+    parser = TerraformLogParser()
+    result = parser.parse_file(file_path, workers=settings.PARSER_WORKERS)
+    source = SourceLog(file_path, parser.line_offsets, parser.line_lengths)
+
+    return {
+        'logs': ColumnarLogStore.from_result(result, source),
+        'filename': os.path.basename(file_path).split('_', 1)[1],
+        'file_path': file_path,
+        'session_id': session_id,
+        'timestamp': os.path.getctime(file_path),
+        'file_version': version,
+    }
+
+def stored_metadata(metadata, entry):
+    """Метаданные файла; запись каталога важнее метаданных в файле - разбор, общий для одинаковых
+    загрузок, хранит метаданные первой из них"""
+    if entry is None:
+        return metadata
+    return {
+        **metadata,
+        'original_filename': entry.original_filename,
+        'session_id': entry.session_id,
+        'timestamp': entry.created_at.timestamp(),
+    }
 
 def handle_get_json_bodies(request, session_id):
     """Обрабатывает запрос на получение JSON тел"""
@@ -246,113 +936,321 @@ def handle_get_json_bodies(request, session_id):
         file_id = request.POST.get('file_id')
         log_id = request.POST.get('log_id')
         
-        if not file_id or file_id not in DATA_STORAGE:
+        if not file_id:
             return JsonResponse({'json_bodies': []})
         
-        file_data = DATA_STORAGE[file_id]
+        file_data = load_file(file_id, session_id)
+        if file_data is None:
+            return JsonResponse({'json_bodies': []})
         
         if file_data['session_id'] != session_id:
             return JsonResponse({'status': 'error', 'message': 'Access denied'}, status=403)
         
-        json_bodies = file_data['raw_data'].get('json_bodies', {})
+        store = file_data['logs']
+        json_bodies = store.json_bodies
         
         if log_id and log_id in json_bodies:
             return JsonResponse({'json_bodies': json_bodies[log_id]})
-        else:
-            return JsonResponse({'json_bodies': []})
+        
+        # Тела HTTP-запроса и ответа разбираются из raw_data только при открытии
+        with store.lock:
+            row = store.find_row(log_id) if log_id else None
+            raw_data = store.raw(row) if row is not None and store.body_flags[row] else None
+        if raw_data is not None:
+            return JsonResponse({'json_bodies': {
+                field: raw_data[field] for field in ('tf_http_req_body', 'tf_http_res_body') if field in raw_data
+            }})
+        return JsonResponse({'json_bodies': []})
+    except Exception as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
+
+def handle_get_statistics(request, session_id):
+    """Статистика по уровням, операциям, компонентам, rpc и типам ресурсов для текущих фильтров"""
+    try:
+        file_id = request.POST.get('file_id')
+        if not file_id:
+            return JsonResponse({'statistics': None})
+
+        file_data = load_file(file_id, session_id)
+        if file_data is None:
+            return JsonResponse({'statistics': None})
+
+        if file_data['session_id'] != session_id:
+            return JsonResponse({'status': 'error', 'message': 'Access denied'}, status=403)
+
+        store = file_data['logs']
+        # Строки берутся из того же кэша, что и страницы get_logs
+        with store.lock:
+            rows = get_filtered_rows(file_id, store, request.POST) if active_filters(request.POST) else None
+            statistics = store.facet_counts(rows)
+
+        return JsonResponse({'statistics': statistics})
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
 
+def handle_get_requests(request, session_id):
+    """Самые долгие (или с ошибками) запросы tf_req_id, а с req_id - разбивка одного запроса по времени"""
+    try:
+        file_id = request.POST.get('file_id')
+        if not file_id:
+            return JsonResponse({'requests': []})
+
+        file_data = load_file(file_id, session_id)
+        if file_data is None:
+            return JsonResponse({'requests': []})
+
+        if file_data['session_id'] != session_id:
+            return JsonResponse({'status': 'error', 'message': 'Access denied'}, status=403)
+
+        store = file_data['logs']
+        req_id = request.POST.get('req_id')
+        sort = request.POST.get('sort', 'duration')
+        if sort not in RANKINGS:
+            return JsonResponse({'status': 'error', 'message': f'Unknown sort: {sort}'}, status=400)
+        limit = int(request.POST.get('limit', 50))
+
+        with store.lock:
+            index = store.request_index()
+            if not req_id:
+                return JsonResponse({'requests': index.top(sort, limit), 'total_requests': len(index.ranking(sort))})
+
+            code = index.code(req_id)
+            if code is None:
+                return JsonResponse({'status': 'error', 'message': 'Request not found'}, status=404)
+            return JsonResponse({'request': index.summary(code), 'waterfall': index.waterfall(code)})
+    except Exception as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
+
+def handle_list_files(request, session_id):
+    """Файлы сессии: сохранённые (из каталога, в том числе после перезапуска) и ещё разбираемые"""
+    try:
+        files = [catalog.describe(entry) for entry in catalog.session_files(session_id)]
+        listed = {file['file_id'] for file in files}
+        for file_id, file_data in DATA_STORAGE.items():
+            if file_data['session_id'] != session_id or file_id in listed:
+                continue
+            job = get_job(file_id)
+            files.append({
+                'file_id': file_id,
+                'filename': file_data['filename'],
+                'status': job.status if job is not None else 'done',
+                'timestamp': file_data['timestamp'],
+            })
+        return JsonResponse({'status': 'success', 'files': files})
+    except Exception as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
+
+def handle_search_session(request, session_id):
+    """Фильтры get_logs сразу по всем файлам сессии.
+
+    Файлы ищутся параллельно в SEARCH_EXECUTOR; ответ - NDJSON: строка
+    {'type': 'file'} с числом найденного по каждому файлу по мере готовности
+    и в конце {'type': 'result'} со страницей записей всех файлов по времени.
+    """
+    try:
+        page = int(request.POST.get('page', 1))
+        page_size = int(request.POST.get('page_size', 100))
+        params = request.POST
+
+        file_ids = session_file_ids(session_id)
+        # Файлы, которых нет в каталоге (сохранённые до него), можно перечислить явно
+        for file_id in request.POST.get('file_ids', '').split(','):
+            if file_id and file_id not in file_ids:
+                file_ids.append(file_id)
+    except Exception as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
+
+    def results():
+        futures = {
+            SEARCH_EXECUTOR.submit(search_file, file_id, session_id, params): file_id
+            for file_id in file_ids
+        }
+        found = []
+        for future in as_completed(futures):
+            file_id = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                yield {'type': 'error', 'file_id': file_id, 'message': str(e)}
+                continue
+            if result is None:
+                continue
+            found.append(result)
+            yield {'type': 'file', 'file_id': file_id, 'filename': result['filename'], 'count': len(result['hits'])}
+
+        yield search_result_page(found, page, page_size)
+
+    return NdjsonResponse(results())
+
+def search_file(file_id, session_id, params):
+    """Найденные в файле строки, упорядоченные по времени (строки без времени - в конце); None - файла нет или он чужой"""
+    # Владелец проверяется до загрузки: чужой файл не загружается в память. Файл с диска,
+    # которого ещё нет в каталоге, сначала заносится в него (у .tflog для этого читается только заголовок)
+    owner = file_session(file_id)
+    if owner is None:
+        file_path, _ = find_file_on_disk(file_id)
+        if file_path is not None and catalog.index_file(os.path.basename(file_path)):
+            owner = file_session(file_id)
+    if owner != session_id:
+        return None
+
+    file_data = load_file(file_id, session_id)
+    if file_data is None or file_data['session_id'] != session_id:
+        return None
+
+    store = file_data['logs']
+    with store.lock:
+        rows = get_filtered_rows(file_id, store, params)
+        epoch_ns, line_numbers = store.epoch_ns, store.line_numbers
+        hits = sorted((epoch_ns[row] == MISSING_TIME, epoch_ns[row], line_numbers[row], row) for row in rows)
+    return {'file_id': file_id, 'filename': file_data['filename'], 'store': store, 'hits': hits}
+
+def search_result_page(found, page, page_size):
+    """Страница общего по всем файлам результата: строки файлов сливаются по времени"""
+    found.sort(key=lambda result: result['file_id'])
+    # Пары (ключ строки, номер файла): при равном времени и номере строки раньше идёт файл с меньшим id,
+    # строки без времени всех файлов - после строк со временем
+    merged = heapq.merge(*(zip(result['hits'], itertools.repeat(index)) for index, result in enumerate(found)))
+
+    start_idx = (page - 1) * page_size
+    logs = []
+    for (*_, row), index in itertools.islice(merged, start_idx, start_idx + page_size):
+        result = found[index]
+        with result['store'].lock:
+            log = result['store'].row(row)
+        log['file_id'] = result['file_id']
+        log['filename'] = result['filename']
+        logs.append(log)
+
+    total_count = sum(len(result['hits']) for result in found)
+    return {
+        'type': 'result',
+        'logs': logs,
+        'counts': {result['file_id']: len(result['hits']) for result in found},
+        'total_count': total_count,
+        'page': page,
+        'page_size': page_size,
+        'total_pages': (total_count + page_size - 1) // page_size,
+    }
+
+def stop_upload_job(file_id):
+    """Забывает задачу разбора файла и прерывает её, если она ещё идёт; ожидающие дописанных строк просыпаются"""
+    forget_tail(file_id)
+    upload = forget_job(file_id)
+    if upload is not None and upload.finished is None:
+        upload.cancel(RuntimeError('Файл удалён'))
+
 def handle_clear_data(request, session_id):
     """Очищает данные для конкретной сессии"""
     try:
         file_id = request.POST.get('file_id')
         
         if file_id:
-            if file_id in DATA_STORAGE and DATA_STORAGE[file_id]['session_id'] == session_id:
-                file_data = DATA_STORAGE[file_id]
-                file_path = file_data.get('file_path')
-                if file_path and os.path.exists(file_path):
-                    try:
-                        os.remove(file_path)
-                        print(f"Deleted file: {file_path}")
-                    except Exception as e:
-                        print(f"Error deleting file {file_path}: {e}")
-                
-                del DATA_STORAGE[file_id]
+            file_ids = [file_id] if file_session(file_id) == session_id else []
         else:
-            files_to_delete = [
-                file_id for file_id, data in DATA_STORAGE.items() 
-                if data['session_id'] == session_id
-            ]
-            for file_id in files_to_delete:
-                file_data = DATA_STORAGE[file_id]
-                file_path = file_data.get('file_path')
-                if file_path and os.path.exists(file_path):
-                    try:
-                        os.remove(file_path)
-                        print(f"Deleted file: {file_path}")
-                    except Exception as e:
-                        print(f"Error deleting file {file_path}: {e}")
-                
-                del DATA_STORAGE[file_id]
+            file_ids = session_file_ids(session_id)
+        for file_id in file_ids:
+            delete_stored_file(file_id)
         
         return JsonResponse({'status': 'success', 'message': 'Данные очищены'})
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
 
-def cleanup_old_data(max_age_hours=24):
-    """Очищает данные старше указанного времени"""
-    import time
-    current_time = time.time()
-    max_age_seconds = max_age_hours * 3600
-    
-    files_to_delete = [
-        file_id for file_id, data in DATA_STORAGE.items()
-        if current_time - data['timestamp'] > max_age_seconds
-    ]
-    
+def file_session(file_id):
+    """Сессия файла из памяти или каталога; None - файла нет"""
+    file_data = DATA_STORAGE.metadata(file_id)
+    if file_data is not None:
+        return file_data['session_id']
+    entry = catalog.lookup(file_id)
+    return entry.session_id if entry is not None else None
+
+def session_file_ids(session_id):
+    """Файлы сессии: загруженные в этом процессе (в том числе ещё разбираемые) и сохранённые в каталоге"""
+    file_ids = dict.fromkeys(file_id for file_id, data in DATA_STORAGE.items() if data['session_id'] == session_id)
+    file_ids.update(dict.fromkeys(entry.file_id for entry in catalog.session_files(session_id)))
+    return list(file_ids)
+
+def delete_stored_file(file_id):
+    """Удаляет файл с диска, из памяти и из каталога; возвращает число удалённых с диска файлов"""
+    file_data = DATA_STORAGE.metadata(file_id) or {}
+    entry = catalog.lookup(file_id)
+    file_paths = dict.fromkeys((file_data.get('file_path'), file_data.get('source_path')))
+    if entry is not None:
+        file_paths.update(dict.fromkeys((entry.file_path, entry.source_path)))
+
+    # Разбор, общий для одинаковых загрузок, удаляется с диска вместе с последней ссылкой на него
+    if catalog.release(file_id):
+        file_paths = {}
+
     deleted_count = 0
-    for file_id in files_to_delete:
-        file_data = DATA_STORAGE[file_id]
-        file_path = file_data.get('file_path')
+    for file_path in file_paths:
         if file_path and os.path.exists(file_path):
             try:
                 os.remove(file_path)
-                print(f"Deleted parsed file: {file_path}")
+                print(f"Deleted file: {file_path}")
                 deleted_count += 1
             except Exception as e:
-                print(f"Error deleting parsed file {file_path}: {e}")
-        
-        del DATA_STORAGE[file_id]
-    
-    if os.path.exists(settings.LOG_STORAGE_DIR):
-        for filename in os.listdir(settings.LOG_STORAGE_DIR):
-            file_path = os.path.join(settings.LOG_STORAGE_DIR, filename)
-            file_age = current_time - os.path.getctime(file_path)
-            if file_age > max_age_seconds:
-                try:
-                    os.remove(file_path)
-                    print(f"Deleted old file: {file_path}")
-                    deleted_count += 1
-                except Exception as e:
-                    print(f"Error deleting old file {file_path}: {e}")
+                print(f"Error deleting file {file_path}: {e}")
     
+    stop_upload_job(file_id)
+    DATA_STORAGE.pop(file_id)
+    RESULT_CACHE.invalidate(file_id)
     return deleted_count
-def find_file_on_disk(file_id):
-    """Ищет файл с ПАРСИРОВАННЫМИ данными на диске по file_id"""
-    if not os.path.exists(settings.LOG_STORAGE_DIR):
-        return None, None
+
+def cleanup_old_data(max_age_hours=24):
+    """Очищает данные старше указанного времени"""
+    cutoff = time.time() - max_age_hours * 3600
+    
+    # Устаревшие файлы - запрос по индексу каталога; в памяти могут быть и ещё не попавшие в него
+    file_ids = dict.fromkeys(file_id for file_id, data in DATA_STORAGE.items() if data['timestamp'] < cutoff)
+    file_ids.update(dict.fromkeys(entry.file_id for entry in catalog.created_before(cutoff)))
+    
+    deleted_count = 0
+    for file_id in file_ids:
+        deleted_count += delete_stored_file(file_id)
     
-    parsed_filename = f"{file_id}_parsed.json"
-    parsed_file_path = os.path.join(settings.LOG_STORAGE_DIR, parsed_filename)
+    return deleted_count + sweep_orphaned_files(cutoff)
+
+def sweep_orphaned_files(cutoff):
+    """Удаляет из LOG_STORAGE_DIR файлы старше cutoff, о которых не знают ни каталог, ни память, ни загрузки:
+    брошенные *.tmp, исходные логи без разбора, старые файлы, так и не занесённые в каталог"""
+    if not os.path.exists(settings.LOG_STORAGE_DIR):
+        return 0
     
-    if os.path.exists(parsed_file_path):
-        return parsed_file_path, None
+    in_use = catalog.stored_names()
+    for file_id, data in DATA_STORAGE.items():
+        in_use.update(os.path.basename(path) for path in (data.get('file_path'), data.get('source_path')) if path)
+    job_ids = active_job_ids()
     
+    deleted_count = 0
     for filename in os.listdir(settings.LOG_STORAGE_DIR):
-        if filename.startswith(file_id + '_') and not filename.endswith('_parsed.json'):
-            return os.path.join(settings.LOG_STORAGE_DIR, filename), None
+        if filename in in_use or filename.split('_', 1)[0] in job_ids:
+            continue
+        file_path = os.path.join(settings.LOG_STORAGE_DIR, filename)
+        try:
+            if not os.path.isfile(file_path) or os.path.getmtime(file_path) >= cutoff:
+                continue
+            os.remove(file_path)
+            print(f"Deleted orphaned file: {file_path}")
+            deleted_count += 1
+        except OSError as e:
+            print(f"Error deleting orphaned file {file_path}: {e}")
+    
+    return deleted_count
+def is_parsed_filename(filename):
+    return filename.endswith((PARSED_SUFFIX, '_parsed.json'))
+
+def find_file_on_disk(file_id):
+    """Ищет файл с ПАРСИРОВАННЫМИ данными на диске по file_id; второй элемент - его запись в каталоге или None"""
+    entry = catalog.lookup(file_id)
+    if entry is not None and os.path.exists(entry.file_path):
+        return entry.file_path, entry
+    
+    # Файл, сохранённый до каталога и ещё не занесённый в него (см. catalog.index_storage_dir)
+    for suffix in (PARSED_SUFFIX, '_parsed.json'):
+        parsed_file_path = os.path.join(settings.LOG_STORAGE_DIR, f"{file_id}{suffix}")
+        if os.path.exists(parsed_file_path):
+            return parsed_file_path, None
     
     return None, None
 
@@ -362,12 +1260,11 @@ def convert_old_files_to_parsed():
         return 0
     
     converted_count = 0
-    parser = TerraformLogParser()
     
     for filename in os.listdir(settings.LOG_STORAGE_DIR):
         file_path = os.path.join(settings.LOG_STORAGE_DIR, filename)
         
-        if filename.endswith('_parsed.json'):
+        if is_parsed_filename(filename) or filename.endswith((SOURCE_SUFFIX, '.tmp')):
             continue
             
         if '_' not in filename:
@@ -376,23 +1273,26 @@ def convert_old_files_to_parsed():
         try:
             file_id, original_name = filename.split('_', 1)
             
-            result = parser.parse_file(file_path)
+            parser = TerraformLogParser()
+            result = parser.parse_file(file_path, workers=settings.PARSER_WORKERS)
             
-            parsed_filename = f"{file_id}_parsed.json"
+            parsed_filename = f"{file_id}{PARSED_SUFFIX}"
             parsed_file_path = os.path.join(settings.LOG_STORAGE_DIR, parsed_filename)
+            created = os.path.getctime(file_path)
             
-            with open(parsed_file_path, 'w', encoding='utf-8') as f:
-                json.dump({
-                    'metadata': {
-                        'original_filename': original_name,
-                        'session_id': 'converted',  
-                        'timestamp': os.path.getctime(file_path),
-                        'file_id': file_id
-                    },
-                    'parsed_data': result
-                }, f, ensure_ascii=False, indent=2)
+            # Исходный файл остаётся источником raw_data для разобранного
+            source_path = os.path.join(settings.LOG_STORAGE_DIR, f"{file_id}{SOURCE_SUFFIX}")
+            os.replace(file_path, source_path)
+            
+            source = SourceLog(source_path, parser.line_offsets, parser.line_lengths)
+            write_parsed_log(parsed_file_path, {
+                'original_filename': original_name,
+                'session_id': 'converted',  
+                'timestamp': created,
+                'file_id': file_id
+            }, result, source=source, columns=ColumnarLogStore.from_result(result, source))
+            catalog.index_file(parsed_filename)
             
-            os.remove(file_path)
             converted_count += 1
             print(f"Converted {filename} to parsed format")
             
@@ -400,3 +1300,37 @@ def convert_old_files_to_parsed():
             print(f"Error converting {filename}: {e}")
     
     return converted_count
+
+def convert_parsed_json_files():
+    """Переводит файлы *_parsed.json в формат с произвольным доступом (logfile)"""
+    if not os.path.exists(settings.LOG_STORAGE_DIR):
+        return 0
+    
+    converted_count = 0
+    
+    for filename in os.listdir(settings.LOG_STORAGE_DIR):
+        if not filename.endswith('_parsed.json'):
+            continue
+        
+        file_path = os.path.join(settings.LOG_STORAGE_DIR, filename)
+        try:
+            with open(file_path, 'rb') as f:
+                file_content = codec.load(f)
+            
+            file_id = filename[:-len('_parsed.json')]
+            metadata = file_content.get('metadata', {})
+            metadata.setdefault('file_id', file_id)
+            metadata.setdefault('timestamp', os.path.getctime(file_path))
+            
+            parsed_file_path = os.path.join(settings.LOG_STORAGE_DIR, f"{file_id}{PARSED_SUFFIX}")
+            write_parsed_log(parsed_file_path, metadata, file_content.get('parsed_data', {}))
+            
+            os.remove(file_path)
+            catalog.index_file(f"{file_id}{PARSED_SUFFIX}")
+            converted_count += 1
+            print(f"Converted {filename} to {PARSED_SUFFIX}")
+            
+        except Exception as e:
+            print(f"Error converting {filename}: {e}")
+    
+    return converted_count
@@ -9,8 +9,12 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
+django.setup(set_prefix=False)
 
-application = get_asgi_application()
+# Как get_asgi_application(), но загрузки логов разбираются по мере приёма, а не после буферизации тела
+from app.streaming import StreamingASGIHandler  # noqa: E402
+
+application = StreamingASGIHandler()
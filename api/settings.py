@@ -23,6 +23,7 @@ SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
 SESSION_COOKIE_NAME = 'terraform_session'
 
 MIDDLEWARE = [
+    'app.metrics.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -73,4 +74,34 @@ os.makedirs(os.path.join(MEDIA_ROOT, 'temp'), exist_ok=True)
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 LOG_STORAGE_DIR = os.path.join(os.path.dirname(__file__), 'uploaded_logs')
-os.makedirs(LOG_STORAGE_DIR, exist_ok=True)
\ No newline at end of file
+os.makedirs(LOG_STORAGE_DIR, exist_ok=True)
+
+# Число процессов для разбора больших логов; 1 - последовательный разбор.
+# Пул процессов запускается в каждом веб-воркере рядом с пулами потоков ниже,
+# поэтому по умолчанию выключен: включать при развёртывании по числу свободных ядер
+PARSER_WORKERS = int(os.environ.get('PARSER_WORKERS', 1))
+
+# Бюджет памяти под кэш отфильтрованных строк для постраничного просмотра
+FILTER_CACHE_MAX_BYTES = int(os.environ.get('FILTER_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+# Бюджет памяти под разобранные логи; давно не открывавшиеся файлы выгружаются и читаются с диска заново
+DATA_STORAGE_MAX_BYTES = int(os.environ.get('DATA_STORAGE_MAX_BYTES', 1024 * 1024 * 1024))
+
+# Число фоновых задач разбора загрузок, идущих одновременно
+PARSE_JOB_WORKERS = int(os.environ.get('PARSE_JOB_WORKERS', 2))
+
+# Число потоков для поиска по всем файлам сессии
+SEARCH_WORKERS = int(os.environ.get('SEARCH_WORKERS', 4))
+
+# Потоки для обработки запросов под ASGI: быстрые страницы и тяжёлые запросы (загрузки, фильтры без кэша)
+PAGE_WORKERS = int(os.environ.get('PAGE_WORKERS', 8))
+QUERY_WORKERS = int(os.environ.get('QUERY_WORKERS', 4))
+
+# Дольше этого long-poll (follow_logs) не ждёт дописанных строк, секунды
+FOLLOW_POLL_TIMEOUT = float(os.environ.get('FOLLOW_POLL_TIMEOUT', 30))
+
+# Сколько живёт поток server-sent events /api/logs/follow/; потом клиент переподключается с Last-Event-ID
+FOLLOW_STREAM_SECONDS = float(os.environ.get('FOLLOW_STREAM_SECONDS', 300))
+
+# Замеры времени по стадиям: заголовок Server-Timing и /api/metrics/ в формате Prometheus
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1').lower() not in ('0', 'false', 'no', 'off')
@@ -1,10 +1,13 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import FileUploader from './components/FileUploader/FileUploader';
 import LogHistory from './components/LogHistory/LogHistory';
 import LogTerminal from './components/LogTerminal/LogTerminal';
 import { useLocalStorage } from './hooks/useLocalStorage';
 import '../src/styles/App.css';
 
+// Как часто спрашивать статус фонового разбора загруженного файла
+const JOB_POLL_INTERVAL = 1000;
+
 const App = () => {
   const [logs, setLogs] = useState([]);
   const [history, setHistory] = useLocalStorage('tf_history', []);
@@ -23,6 +26,10 @@ const App = () => {
   const [isLoading, setIsLoading] = useState(false);
   const [wasLogDeleted, setWasLogDeleted] = useState(false);
 
+  // Текущее состояние просмотра для обработчиков, которые завершаются позже (ожидание разбора)
+  const viewRef = useRef({});
+  viewRef.current = { currentFileId, filters, pagination };
+
   useEffect(() => {
     initializeSession();
     restoreHistoryState();
@@ -139,8 +146,62 @@ const App = () => {
     }
   };
 
+  const waitForJob = async (jobId, jobSessionId) => {
+    while (true) {
+      const formData = new FormData();
+      formData.append('action', 'get_job_status');
+      formData.append('job_id', jobId);
+      formData.append('session_id', jobSessionId);
+
+      const response = await fetch('/api/upload/', {
+        method: 'POST',
+        body: formData,
+      });
+
+      // Файл удалили, пока он разбирался
+      if (response.status === 404) {
+        return null;
+      }
+      if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+      }
+
+      const job = await response.json();
+      if (job.status === 'done' || job.status === 'error') {
+        return job;
+      }
+      await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL));
+    }
+  };
+
+  // Ответ на загрузку приходит до конца разбора: итоговые count и statistics берём из задачи
+  const refreshWhenParsed = async (fileId, jobId, jobSessionId) => {
+    try {
+      const job = await waitForJob(jobId, jobSessionId);
+      if (!job) {
+        return;
+      }
+      if (job.status === 'error') {
+        throw new Error(job.message || 'Parsing failed');
+      }
+
+      setHistory(prev => (Array.isArray(prev) ? prev.map(item => (
+        item.fileId === fileId ? { ...item, statistics: job.statistics, count: job.entries } : item
+      )) : prev));
+
+      const view = viewRef.current;
+      if (view.currentFileId === fileId) {
+        // Ошибку загрузки страницы loadLogs показывает сам
+        loadLogs(fileId, view.pagination.page, view.pagination.pageSize, view.filters).catch(() => {});
+      }
+    } catch (error) {
+      console.error('Error waiting for parsing:', error);
+      alert(`Error parsing log: ${error.message}`);
+    }
+  };
+
   const handleFileUpload = async (uploadResult) => {
-    const { file_id, session_id, filename, statistics, count } = uploadResult;
+    const { file_id, job_id, session_id, filename, statistics, count, provisional } = uploadResult;
     
     if (session_id) {
       setSessionId(session_id);
@@ -167,6 +228,10 @@ const App = () => {
     setSelectedHistoryItem(file_id);
     setWasLogDeleted(false);
     
+    if (provisional) {
+      refreshWhenParsed(file_id, job_id || file_id, session_id || sessionId);
+    }
+    
     await loadLogs(file_id, 1, pagination.pageSize, filters);
   };
 